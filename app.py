@@ -2,58 +2,220 @@ import sqlite3
 import os
 import bcrypt
 import requests
-from flask import Flask, request, session, jsonify, g, send_from_directory
+from flask import Flask, request, session, jsonify, g, send_file, Response, stream_with_context
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from fpdf import FPDF
-import tempfile
-import threading
 import time
+import hashlib
+import multiprocessing
 import html
+import io
 import re
-from chatbot import ask_groq  # Import the ask_groq function from chatbot.py
-from db import init_db, get_db, close_db # Import database functions
-from auth import create_user, verify_user # Import auth functions
+import json
+from collections import namedtuple
+from chatbot import (ask_groq, stream_groq, get_client as get_llm_client, LLM_ERROR_MESSAGES, # Import the Groq helpers from chatbot.py
+                     CIRCUIT_OPEN_MESSAGE, DEADLINE_MESSAGE, RATE_LIMITED_MESSAGE)
+from db import init_db, get_db, close_db, connect_db, iter_conversation_history, pool as db_pool # Import database functions
+from auth import (create_user, verify_user, auth_stats, start_hash_pool, BUSY_MESSAGE, THROTTLED_MESSAGE,
+                  issue_remember_token, consume_remember_token, revoke_remember_tokens,
+                  REMEMBER_COOKIE, REMEMBER_TOKEN_HOURS) # Import auth functions
+from context import build_chat_messages # Token-budgeted prompt building for /chat
+from retrieval import retrieval_index # Long-term memory: related exchanges from the user's other chats
+from cache import artifact_cache, history_key, download_store, inflight, completion_cache # Content-addressed cache for exports, finished downloads, in-flight coalescing, LLM replies
+from maintenance import start_background_maintenance # Periodic cleanup (empty conversations)
+from documents import parse_document, render_markdown, render_csv, render_tsv # One parse per export, many formats
+from pdf_fonts import font_registry # Fonts parsed once per process for every PDF export
+from jobs import submit_job, get_job, job_stats, resume_pending_jobs, register_handler as register_job_handler # Background export jobs
 
 
 # --- Flask App Setup ---
 app = Flask(__name__, static_folder='assets')
 app.secret_key = "supercutesecret"  # IMPORTANT: Use a strong, random secret key in production!
 CORS(app, supports_credentials=True)
+app.permanent_session_lifetime = timedelta(hours=REMEMBER_TOKEN_HOURS)
 
 # Register the teardown function here
 app.teardown_appcontext(close_db)
 
+# Password-hash workers re-run the main script (`python app.py` / `python asgi.py`) before they start;
+# only the process that serves requests sets up the database and starts the background work
+SERVING_PROCESS = multiprocessing.current_process().name == "MainProcess"
+
 # Initialize DB on startup (optional)
-init_db()
+if SERVING_PROCESS:
+    init_db()
+    start_background_maintenance()
+    start_hash_pool()
+font_registry.warm_up()  # parse the PDF fonts now rather than during the first export
+
+# --- Remember-me ---
+@app.before_request
+def restore_remembered_session():
+    """Logs a returning user back in from their remember-me cookie (indexed lookup, no bcrypt) and rotates it."""
+    token = request.cookies.get(REMEMBER_COOKIE)
+    if not token or "user_id" in session:
+        return
+    user_id, new_token = consume_remember_token(get_db(), token)
+    g.remember_token = new_token or ""  # "" clears a stale cookie
+    if user_id:
+        session["user_id"] = user_id
+        session.permanent = True
+        session["current_conversation_id"] = None
+
+@app.after_request
+def set_remember_cookie(response):
+    if "remember_token" in g:
+        if g.remember_token:
+            response.set_cookie(REMEMBER_COOKIE, g.remember_token, max_age=REMEMBER_TOKEN_HOURS * 3600,
+                                httponly=True, samesite="Lax")
+        else:
+            response.delete_cookie(REMEMBER_COOKIE)
+    return response
 
 # --- Helper for Conversation Management ---
-def get_or_create_default_conversation(user_id):
-    db = get_db()
-    if "current_conversation_id" in session and session["current_conversation_id"]:
-        conv = db.execute("SELECT id FROM conversations WHERE id = ? AND user_id = ?",
-                          (session["current_conversation_id"], user_id)).fetchone()
-        if conv:
-            return session["current_conversation_id"]
-
+# A new chat has no row until its first message is stored; until then current_conversation_id is None.
+def owned_conversation(db, user_id, conv_id):
+    """conv_id if it is one of user_id's conversations, otherwise None."""
+    if conv_id and db.execute("SELECT id FROM conversations WHERE id = ? AND user_id = ?", (conv_id, user_id)).fetchone():
+        return conv_id
+    return None
+
+def create_conversation(db, user_id):
     cursor = db.execute("INSERT INTO conversations (user_id, title) VALUES (?, ?)",
                         (user_id, f"Chat {datetime.now().strftime('%Y-%m-%d %H:%M')}"))
-    new_conv_id = cursor.lastrowid
     db.commit()
-    return new_conv_id
+    return cursor.lastrowid
 
-def delete_file_later(path, delay=300):
-    """Deletes a file after a specified delay."""
-    def _delete():
-        time.sleep(delay)
-        try:
-            if os.path.exists(path):
-                os.remove(path)
-                print(f"🧹 Deleted temp file: {path}")
-        except Exception as e:
-            print(f"Error deleting file {path}: {e}")
-    if path:
-        threading.Thread(target=_delete, daemon=True).start()
+def get_current_conversation(user_id):
+    """The session's open conversation id, or None when it's a new chat that hasn't been saved yet."""
+    return owned_conversation(get_db(), user_id, session.get("current_conversation_id"))
+
+def get_or_create_default_conversation(user_id):
+    """Like get_current_conversation, but creates the row; only called when a message is about to be stored."""
+    return get_current_conversation(user_id) or create_conversation(get_db(), user_id)
+
+def store_turn(conn, conv_id, user_id, user_msg, reply):
+    """Saves one exchange together with its retrieval vector, in one transaction."""
+    cursor = conn.execute("INSERT INTO messages (conversation_id, user_id, message, response) VALUES (?, ?, ?, ?)",
+                          (conv_id, user_id, user_msg, reply))
+    retrieval_index.add(conn, cursor.lastrowid, user_msg, reply)
+    conn.commit()
+
+# --- Helper for History Pagination ---
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+def history_page_args():
+    """Reads the ?before_id=&limit= cursor from the query string."""
+    before_id = request.args.get("before_id", type=int)
+    limit = request.args.get("limit", HISTORY_PAGE_SIZE, type=int)
+    return before_id, max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+
+def load_history_page(db, conv_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """Returns one page of [message, response] pairs, oldest first, ending just before before_id.
+
+    Keyset pagination on (conversation_id, id): each page is an index range scan, however deep it is.
+    The page info holds the cursor for the next (older) page.
+    """
+    if before_id is None:
+        rows = db.execute("SELECT id, message, response FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT ?",
+                          (conv_id, limit + 1)).fetchall()
+    else:
+        rows = db.execute("SELECT id, message, response FROM messages WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                          (conv_id, before_id, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    history = [[m["message"], m["response"]] for m in rows]
+    page = {"has_more": has_more, "oldest_id": rows[0]["id"] if rows else None}
+    return history, page
+
+# --- Helper for Full-Text Search ---
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_TERMS = 8
+SNIPPET_TOKENS = 12  # words of context around the hits
+SEARCH_RANK = "bm25(messages_fts, 1.0, 1.0, 0.0)"  # message, response, owner (the owner tag never counts)
+# bm25 reads the whole posting list of every query word to weigh it, so words found in nearly every message
+# would cost tens of ms each on a big table while telling the results apart hardly at all
+SEARCH_STOPWORDS = frozenset("""a an and are as at be but by can do does for from how i in is it me my of on or
+    so that the this to was what when where which who why with you your""".split())
+
+def fts_query(user_id, text):
+    """Turns free text into an FTS5 query for one user's messages, or None if there is nothing to search for.
+
+    Every word is quoted, so FTS5 operators typed by the user are searched for literally. Stopwords are
+    dropped unless nothing else is left; the porter tokenizer matches other forms of each word.
+    """
+    terms = re.findall(r"\w+", text.lower())
+    terms = ([t for t in terms if t not in SEARCH_STOPWORDS] or terms)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    phrases = " AND ".join(f'"{t}"' for t in terms)
+    return f'owner : "u{int(user_id)}" AND {{message response}} : ({phrases})'
+
+def _parse_search_cursor(cursor):
+    """The ?cursor= of the previous page is "<rank>:<message id>" of its last result."""
+    try:
+        rank, message_id = cursor.rsplit(":", 1)
+        return float(rank), int(message_id)
+    except (AttributeError, ValueError):
+        return None
+
+def search_messages(db, user_id, text, cursor=None, limit=SEARCH_PAGE_SIZE):
+    """One page of a user's messages matching text, best first, with highlighted snippets.
+
+    Keyset pagination on (rank, id): the next page starts strictly after the cursor rather than at an
+    offset. bm25 scores depend on the whole corpus, though, so messages stored between two page requests
+    can re-rank the rest and an entry may be skipped or shown twice. Snippets are only built for the page.
+    """
+    query = fts_query(user_id, text)
+    if query is None:
+        return [], {"has_more": False, "next_cursor": None}
+    after = _parse_search_cursor(cursor) if cursor else None
+    if after is None:
+        rows = db.execute(f"""SELECT rowid AS id, {SEARCH_RANK} AS rank FROM messages_fts
+                              WHERE messages_fts MATCH ? ORDER BY rank, id DESC LIMIT ?""",
+                          (query, limit + 1)).fetchall()
+    else:
+        rows = db.execute(f"""SELECT id, rank FROM (
+                                  SELECT rowid AS id, {SEARCH_RANK} AS rank FROM messages_fts WHERE messages_fts MATCH ?)
+                              WHERE rank > ? OR (rank = ? AND id < ?) ORDER BY rank, id DESC LIMIT ?""",
+                          (query, after[0], after[0], after[1], limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], {"has_more": False, "next_cursor": None}
+
+    placeholders = ",".join("?" * len(rows))
+    details = {r["id"]: r for r in db.execute(
+        f"""SELECT f.rowid AS id, m.conversation_id, m.timestamp, c.title,
+                   snippet(messages_fts, 0, '**', '**', '…', {SNIPPET_TOKENS}) AS message_snippet,
+                   snippet(messages_fts, 1, '**', '**', '…', {SNIPPET_TOKENS}) AS response_snippet
+            FROM messages_fts f
+            JOIN messages m ON m.id = f.rowid
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE messages_fts MATCH ? AND f.rowid IN ({placeholders})""",
+        (query, *[r["id"] for r in rows])).fetchall()}
+
+    results = []
+    for r in rows:
+        d = details.get(r["id"])
+        if d is None:
+            continue  # deleted between the two queries
+        # Show the side of the exchange the words were found in, the question if both
+        in_message = "**" in d["message_snippet"]
+        results.append({
+            "message_id": r["id"],
+            "conversation_id": d["conversation_id"],
+            "title": d["title"],
+            "snippet": d["message_snippet"] if in_message else d["response_snippet"],
+            "matched_in": "message" if in_message else "response",
+            "timestamp": d["timestamp"],
+        })
+    last = rows[-1]
+    return results, {"has_more": has_more, "next_cursor": f"{last['rank']!r}:{last['id']}" if has_more else None}
 
 # --- PDF Generation Classes and Helpers ---
 def safe_multicell(pdf_obj, line):
@@ -74,65 +236,40 @@ class CustomPDF(FPDF):
     """A custom PDF class to handle headers and Unicode fonts."""
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        try:
-            # Assumes you have DejaVuSans.ttf in your project directory
-            self.add_font('DejaVuSans', '', 'DejaVuSans.ttf')
-            self.add_font('DejaVuSans', 'B', 'DejaVuSans-Bold.ttf')
-            self.set_font('DejaVuSans', '', 10)
-        except RuntimeError:
-            print("Warning: DejaVu fonts not found. Falling back to Arial.")
-            self.set_font('Arial', '', 10)
+        # Fonts come pre-parsed from the process-wide registry (Helvetica if DejaVu isn't available)
+        self.font_family_name = font_registry.install(self)
+        self.set_font(self.font_family_name, '', 10)
     def ensure_space(self, min_height=15):
         """Start a new page if there's not enough vertical space left."""
         if self.get_y() + min_height > self.page_break_trigger:
             self.add_page()
     def header(self):
-        try:
-            self.set_font('DejaVuSans', 'B', 15)
-        except RuntimeError:
-            self.set_font('Arial', 'B', 15)
+        self.set_font(self.font_family_name, 'B', 15)
         safe_multicell(self, "💖 Query Quokka Learning Material 💖")
         self.ln(10)
 
     def chapter_title(self, title):
-        try:
-            self.set_font('DejaVuSans', 'B', 12)
-        except RuntimeError:
-            self.set_font('Arial', 'B', 12)
+        self.set_font(self.font_family_name, 'B', 12)
         self.set_fill_color(200, 220, 255)
         from fpdf.enums import XPos, YPos
         self.cell(0, 10, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L', fill=True)
         self.ln(4)
 
     def chapter_body(self, body):
-        try:
-            self.set_font('DejaVuSans', '', 10)
-        except RuntimeError:
-            self.set_font('Arial', '', 10)
+        self.set_font(self.font_family_name, '', 10)
         safe_multicell(self, body)
         self.ln(6)
 
 
 # --- HTML Flashcard Generation ---
-def generate_flashcards_html(flashcards_text):
+def generate_flashcards_html(document):
     """Generates an HTML string for interactive flashcards."""
     cards_html = []
-    current_topic = ""
-    current_question_text = None
-
-    lines = flashcards_text.split('\n')
-    for line in lines:
-        line = line.strip()
-        question_match = re.match(r'Q:\s*(.*)', line, re.IGNORECASE)
-        answer_match = re.match(r'A:\s*(.*)', line, re.IGNORECASE)
-
-        if line.startswith("=== ") and line.endswith(" ==="):
-            current_topic = html.escape(line.replace("===", "").strip())
-        elif question_match:
-            current_question_text = question_match.group(1).strip()
-        elif answer_match and current_question_text is not None:
-            escaped_question = html.escape(current_question_text)
-            escaped_answer = html.escape(answer_match.group(1).strip())
+    for topic in document.topics:
+        current_topic = html.escape(topic.title)
+        for card in topic.cards:
+            escaped_question = html.escape(card.question)
+            escaped_answer = html.escape(card.answer)
             cards_html.append(f"""
             <div class="flashcard-container">
                 <div class="flashcard" onclick="this.classList.toggle('flipped');">
@@ -142,7 +279,6 @@ def generate_flashcards_html(flashcards_text):
                 <div class="flashcard-topic">{current_topic}</div>
             </div>
             """)
-            current_question_text = None
 
     return f"""
 <!DOCTYPE html>
@@ -183,7 +319,300 @@ def generate_flashcards_html(flashcards_text):
 </html>
 """
 
+# --- Export Generation (summary PDF / flashcards) ---
+# Bump these whenever a prompt or its post-processing changes, so cached exports are not reused
+SUMMARY_PROMPT_VERSION = "summary-v2"
+FLASHCARD_PROMPT_VERSION = "flashcards-v2"
+EXPORT_DEADLINE = float(os.getenv("EXPORT_DEADLINE", "120"))  # seconds for the LLM part of an export job
+
+def _history_to_groq_messages(conversation_history):
+    messages_for_groq = []
+    for h_msg in conversation_history:
+        messages_for_groq.append({"role": "user", "content": h_msg["message"]})
+        messages_for_groq.append({"role": "assistant", "content": h_msg["response"]})
+    return messages_for_groq
+
+def build_summary_messages(conversation_history):
+    messages_for_groq = _history_to_groq_messages(conversation_history)
+    summarize_prompt = (
+        "You are an academic tutor and curriculum writer tasked with generating a detailed, structured learning report from the following conversation. "
+        "Your objective is to extract all educational content, group it by topic, and provide an in-depth explanation of each topic as if teaching it to a student. "
+        "Do not summarize the conversation or reference specific dialogue. Instead, reconstruct the content into a clear, well-organized report that fully explains each subject discussed. "
+        "Include additional context, definitions, and examples where needed. Fill in any gaps where a concept was mentioned but not thoroughly explained. "
+        "If practical examples, case studies, **code**, logic, syntax, functions, methods, pseudocode, scenarios, or analogies were discussed in the conversation, include them in the relevant sections. "
+        "If such examples were not provided, **GENERATE appropriate examples**, illustrations, or simplified explanations to help reinforce understanding. These can be from real-world situations, sample problems, or thought experiments. "
+        "Where helpful, include memory techniques, mnemonics, diagrams (as descriptions), or analogies to enhance understanding and retention.\n\n"
+        
+        "For formatting: "
+        "Use plain text only, EXCEPT for the subheadings (Explanation, Examples / Applications, Tips / Mnemonics) which MUST be bolded as shown in the structure below. Do not use other markdown like asterisks (*), backticks (`), or other symbols for emphasis. "
+        "For lists, use numbered bullets like '1.', '2.', '3.' instead of asterisks or dashes. "
+        "Ignore small talk, greetings, or tool usage unless directly relevant to the learning content.\n\n"
+        
+        "Important: Structure the report, exactly as below, and ensure EVERY topic (including any introductory sections) contains ALL three subsections. If content is not directly available from the conversation for 'Examples / Applications' or 'Tips / Mnemonics', you MUST generate relevant content for those sections:\n\n"
+        "=== [Topic Title] ===\n"
+        "**Explanation:**\nFull teaching-style explanation here.\n\n"
+        "**Examples / Applications:**\nReal-world or code examples (if relevant). If no direct examples from the conversation, generate new ones.\n\n"
+        "**Tips / Mnemonics:**\nUseful memory aids or tricks. If no direct tips/mnemonics from the conversation, generate new ones.\n\n"
+        "Conversation:\n" +
+        "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages_for_groq])
+    )
+    messages_for_groq.append({"role": "user", "content": summarize_prompt})
+    return messages_for_groq
+
+def build_flashcard_messages(conversation_history):
+    messages_for_groq = _history_to_groq_messages(conversation_history)
+    flashcard_prompt = (
+        "You are an instructional designer and subject matter expert. Your task is to generate high-quality educational flashcards from the following conversation. "
+        "Ignore greetings, social chat, and tool-related comments. Focus solely on extracting learning content from the conversation, even if it spans multiple topics. "
+        "Group flashcards by topic, and ensure each card tests important concepts, definitions, processes, or problem-solving methods discussed. "
+        "Where relevant, include flashcards for concepts that were only briefly mentioned or implied but are necessary for complete understanding. "
+        "\n\nFlashcards must include a **mix** of question types depending on the subject and content:\n"
+        "- Conceptual: definitions, distinctions, 'what' and 'why'\n"
+        "- Applied: case studies, real-world examples, diagnosis-based, analysis questions\n"
+        "- Practical: code snippets, pseudo-scenarios, data interpretation, step-by-step problems\n"
+        "- Process-oriented: questions about sequences, protocols, workflows\n"
+        "- Mnemonics & memory hacks: where helpful, embed memory aids or analogies\n"
+        "Use simple yet precise language for both questions and answers. Provide mnemonics, analogies, or real-world examples where they can enhance understanding or retention. "
+        "Use plain text only. Do not use markdown (e.g., no **bold**, *, or backticks). "
+        "For lists, use numbered bullets like '1.', '2.', '3.' instead of asterisks or dashes. "
+        "Do not reference specific user messages — focus on converting the knowledge into effective active recall material.\n\n"
+        "Format the output as follows:\n\n"
+        "=== [Topic Name] ===\n"
+        "Q: ...\n"
+        "A: ... [Answer in no more than 190 characters total. If the full explanation is longer, split it into multiple Q&A pairs to keep each answer within the limit.]\n\n"
+        "Conversation:\n" +
+        "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages_for_groq])
+    )
+    messages_for_groq.append({"role": "user", "content": flashcard_prompt})
+    return messages_for_groq
+
+def render_summary_pdf(document):
+    """Renders the parsed summary into PDF bytes."""
+    pdf = CustomPDF()
+    pdf.add_page()
+    for topic in document.topics:
+        if topic.title:
+            pdf.ensure_space(20)
+            pdf.chapter_title(topic.title)
+            pdf.ln(4)
+        for section in topic.sections:
+            if section.label:
+                pdf.ensure_space(15)
+                pdf.set_font('', 'B')
+                safe_multicell(pdf, section.label + ":")
+                pdf.ln(3)
+            pdf.set_font('', '')
+            for line in section.lines:
+                pdf.ensure_space(10)
+                safe_multicell(pdf, line)
+                pdf.ln(2)
+    return bytes(pdf.output())
+
+def render_flashcards_pdf(document):
+    """Renders the parsed flashcards into PDF bytes."""
+    pdf = CustomPDF()
+    pdf.add_page()
+    for topic in document.topics:
+        if topic.title:
+            pdf.chapter_title(topic.title)
+        for card in topic.cards:
+            pdf.set_font('', 'B')
+            safe_multicell(pdf, f"Q: {card.question}")
+            pdf.ln(2)
+            pdf.set_font('', '')
+            safe_multicell(pdf, f"A: {card.answer}")
+            pdf.ln(2)
+    return bytes(pdf.output())
+
+# format -> renderer(document) -> bytes; adding an output format is one entry here (plus a mimetype below)
+SUMMARY_RENDERERS = {
+    "pdf": render_summary_pdf,
+    "md": lambda document: render_markdown(document, "Query Quokka Learning Summary"),
+}
+FLASHCARD_RENDERERS = {
+    "pdf": render_flashcards_pdf,
+    "html": lambda document: generate_flashcards_html(document).encode("utf-8"),
+    "md": lambda document: render_markdown(document, "Query Quokka Flashcards"),
+    "csv": render_csv,
+    "tsv": render_tsv,
+}
+EXPORT_KINDS = {
+    # kind: (prompt builder, prompt version, renderers)
+    "summary": (build_summary_messages, SUMMARY_PROMPT_VERSION, SUMMARY_RENDERERS),
+    "flashcards": (build_flashcard_messages, FLASHCARD_PROMPT_VERSION, FLASHCARD_RENDERERS),
+}
+
+# UI labels accepted for each format
+FORMAT_ALIASES = {
+    "pdf": "pdf",
+    "html": "html", "html (interactive)": "html",
+    "md": "md", "markdown": "md",
+    "csv": "csv", "csv (anki)": "csv",
+    "tsv": "tsv", "tsv (anki)": "tsv",
+}
+
+def normalize_export_format(kind, file_format):
+    """Maps the UI's format label to a renderer key for this export kind; None if unsupported."""
+    file_format = FORMAT_ALIASES.get((file_format or "pdf").strip().lower())
+    return file_format if file_format in EXPORT_KINDS[kind][2] else None
+
+def get_export_text(kind, conversation_history):
+    """Raw LLM output for this export kind and history, from the cache when the chat hasn't changed."""
+    build_messages, prompt_version, _ = EXPORT_KINDS[kind]
+    key = history_key(kind, conversation_history, prompt_version)
+    text = artifact_cache.get(key)
+    if text is None:
+        def generate():
+            text = ask_groq(build_messages(conversation_history), task=kind, deadline=time.monotonic() + EXPORT_DEADLINE)
+            print(f"Generated {kind}:\n{text}")
+            if text not in LLM_ERROR_MESSAGES:
+                artifact_cache.set(key, text)
+            return text
+        # Two formats of the same export requested together share one LLM call
+        text = inflight.do(key, generate)
+    return text
+
+def get_export_document(kind, conversation_history):
+    """The parsed document, shared by every output format: a second format costs no LLM call and no re-parse."""
+    _, prompt_version, _ = EXPORT_KINDS[kind]
+    key = history_key(kind, conversation_history, prompt_version, "document")
+    document = artifact_cache.get(key)
+    if document is None:
+        text = get_export_text(kind, conversation_history)
+        if text in LLM_ERROR_MESSAGES:
+            raise RuntimeError(text)
+        document = parse_document(text)
+        artifact_cache.set(key, document, size=len(text.encode("utf-8")))  # roughly what the parsed form holds
+    return document
+
+def build_export_artifact(kind, conversation_history, file_format, progress=None):
+    """Rendered export bytes; a repeat request for an unchanged chat skips Groq, the parser and the renderer."""
+    _, prompt_version, renderers = EXPORT_KINDS[kind]
+    key = history_key(kind, conversation_history, prompt_version, file_format)
+    artifact = artifact_cache.get(key)
+    if artifact is None:
+        def render():
+            if progress:
+                progress(10, f"Writing the {kind}...")
+            document = get_export_document(kind, conversation_history)
+            if progress:
+                progress(70, f"Rendering {file_format.upper()}...")
+            artifact = renderers[file_format](document)
+            artifact_cache.set(key, artifact)
+            return artifact
+        artifact = inflight.do(key, render)
+    return artifact
+
+# send_file adds "; charset=utf-8" to text/* types itself
+EXPORT_MIMETYPES = {
+    "pdf": "application/pdf",
+    "html": "text/html",
+    "md": "text/markdown",
+    "csv": "text/csv",
+    "tsv": "text/tab-separated-values",
+}
+
+def store_artifact(data, kind, file_format):
+    """Puts rendered bytes in the download store and returns the job result the UI downloads from."""
+    filename = f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{file_format}"
+    artifact_id = download_store.put(data, EXPORT_MIMETYPES[file_format], filename)
+    return {"artifact_id": artifact_id, "filename": filename, "size": len(data),
+            "download_url": f"/artifacts/{artifact_id}"}
+
+# --- Background Export Jobs ---
+def export_params(db, user_id, data):
+    """Works out where an export's chat history comes from.
+
+    Prefers reading the conversation straight from the messages table (conversation_id, with an
+    optional from_message_id / to_message_id range); an uploaded 'history' list is the fallback.
+    Returns (params, None) or (None, error_response).
+    """
+    conversation_id = data.get("conversation_id")
+    if conversation_id is None:
+        return {"history": data.get("history", [])}, None
+
+    try:
+        conversation_id = int(conversation_id)
+        from_id = int(data["from_message_id"]) if data.get("from_message_id") is not None else None
+        to_id = int(data["to_message_id"]) if data.get("to_message_id") is not None else None
+    except (TypeError, ValueError):
+        return None, (jsonify({"success": False, "message": "Invalid conversation or message id."}), 400)
+
+    conv = db.execute("SELECT id FROM conversations WHERE id = ? AND user_id = ?", (conversation_id, user_id)).fetchone()
+    if not conv:
+        return None, (jsonify({"success": False, "message": "Conversation not found."}), 404)
+    return {"conversation_id": conversation_id, "from_id": from_id, "to_id": to_id}, None
+
+def export_dedupe_key(db, user_id, kind, params):
+    """Identifies an export request by (user, endpoint, history, format), so identical requests made
+    while one is still running share its job. A stored conversation stands in for its history by its
+    message count and newest message id, which change whenever the history does."""
+    history = params.get("history")
+    if "conversation_id" in params:
+        history = list(db.execute("SELECT COUNT(*), MAX(id) FROM messages WHERE conversation_id = ?",
+                                  (params["conversation_id"],)).fetchone())
+    material = json.dumps([user_id, kind, {k: v for k, v in params.items() if k != "history"}, history],
+                          sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def load_export_history(params):
+    """The history a job should export, read from SQLite unless it was uploaded with the request."""
+    if "conversation_id" not in params:
+        history = params.get("history", [])
+    else:
+        conn = connect_db()
+        try:
+            history = list(iter_conversation_history(conn, params["conversation_id"], params.get("from_id"), params.get("to_id")))
+        finally:
+            conn.close()
+    if not history:
+        raise RuntimeError("Chat is empty, nothing to export.")
+    return history
+
+def run_summary_job(params, progress):
+    file_format = params.get("format", "pdf")  # jobs queued before formats existed are PDFs
+    artifact = build_export_artifact("summary", load_export_history(params), file_format, progress)
+    return store_artifact(artifact, "summary", file_format)
+
+def run_flashcards_job(params, progress):
+    file_format = params["format"]
+    artifact = build_export_artifact("flashcards", load_export_history(params), file_format, progress)
+    return store_artifact(artifact, "flashcards", file_format)
+
+register_job_handler("summary", run_summary_job)
+register_job_handler("flashcards", run_flashcards_job)
+if SERVING_PROCESS:
+    resume_pending_jobs()
+
+def auth_error_status(message):
+    """429 when throttled, 503 when the password hash pool is saturated, 200 for ordinary failures."""
+    if message == THROTTLED_MESSAGE:
+        return 429
+    if message == BUSY_MESSAGE:
+        return 503
+    return 200
+
 # --- Flask Routes ---
+# How long a user waits on /chat before getting an honest error instead of a spinner (for /chat/stream:
+# until the first token). Replies that mean "the AI isn't answering" get a status code; no error reply is saved.
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", "25"))
+LLM_UNAVAILABLE_STATUS = {CIRCUIT_OPEN_MESSAGE: 503, DEADLINE_MESSAGE: 504, RATE_LIMITED_MESSAGE: 429}
+
+# Every UI request reaches Flask from the Gradio server; only from these addresses is the
+# X-Forwarded-For header it sets trusted to name the real client
+TRUSTED_PROXIES = {ip.strip() for ip in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if ip.strip()}
+
+def client_ip():
+    """The address login throttling is keyed on: the forwarded browser address behind a trusted proxy."""
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded and request.remote_addr in TRUSTED_PROXIES:
+        return forwarded.split(",")[-1].strip()  # the entry the trusted proxy itself appended
+    return request.remote_addr
+
+def internal_caller(remote_addr, forwarded=None):
+    """True for the Gradio server and local tooling; /stats is not for the browsers they forward."""
+    return remote_addr in TRUSTED_PROXIES and not forwarded
+
 @app.route("/signup", methods=["POST"])
 # def signup():
 #     data = request.json
@@ -192,26 +621,34 @@ def generate_flashcards_html(flashcards_text):
 #     return jsonify({"success": True, "message": "Signup successful!"})
 def signup():
     data = request.json
-    success, message = create_user(data.get("username"), data.get("password"))
+    success, message = create_user(data.get("username"), data.get("password"), ip=client_ip())
     if not success:
-        return jsonify({"success": False, "message": message})
+        return jsonify({"success": False, "message": message}), auth_error_status(message)
     return jsonify({"success": True, "message": "Signup successful! You can now log in."})
 
 @app.route("/login", methods=["POST"])
 def login():
     data = request.json
-    uid = verify_user(data.get("username"), data.get("password"))
+    uid, message = verify_user(data.get("username"), data.get("password"), ip=client_ip())
     if uid:
         session["user_id"] = uid
-        session.permanent = data.get("remember_me", False)
+        session.permanent = bool(data.get("remember_me", False))
         if session.permanent:
-            app.permanent_session_lifetime = timedelta(hours=24)
-        session["current_conversation_id"] = get_or_create_default_conversation(uid)
+            g.remember_token = issue_remember_token(get_db(), uid)
+        session["current_conversation_id"] = None  # start in a fresh chat; its row is created with the first message
         return jsonify({"success": True, "message": "Login successful!"})
-    return jsonify({"success": False, "message": "Invalid credentials."})
+    return jsonify({"success": False, "message": message}), auth_error_status(message)
 
 @app.route("/logout", methods=["POST"])
 def logout():
+    """Ends the session and revokes the remember-me token; {"all_devices": true} revokes every token the user has."""
+    data = request.get_json(silent=True) or {}
+    db = get_db()
+    if data.get("all_devices") and "user_id" in session:
+        revoke_remember_tokens(db, user_id=session["user_id"])
+    elif request.cookies.get(REMEMBER_COOKIE):
+        revoke_remember_tokens(db, token=request.cookies.get(REMEMBER_COOKIE))
+    g.remember_token = ""
     session.clear()
     return jsonify({"success": True, "message": "Logged out successfully!"})
 
@@ -226,23 +663,11 @@ def new_conversation():
     if "user_id" not in session:
         return jsonify({"success": False, "response": "Please log in first."}), 401
     
-    user_id = session["user_id"]
-    db = get_db()
-    
-    timestamp_str = datetime.now().strftime('%Y-%m-%d %H:%M')
-    new_title = f"New Chat {timestamp_str}"
-
-    cursor = db.execute("INSERT INTO conversations (user_id, title) VALUES (?, ?)", (user_id, new_title))
-    new_conv_id = cursor.lastrowid
-    db.commit() 
-    
-    # --- ADD THIS LINE ---
-    time.sleep(0.05) # Add a small delay (e.g., 50 milliseconds)
-    # ---------------------
-    
-    session["current_conversation_id"] = new_conv_id
-    print(f"Backend /new_conversation: Created new conversation with ID {new_conv_id}")
-    return jsonify({"success": True, "conversation_id": new_conv_id})
+    # Nothing is written here: /chat creates the conversation when the first message arrives,
+    # so clicking "New Chat" repeatedly no longer leaves empty rows behind
+    session["current_conversation_id"] = None
+    print("Backend /new_conversation: Started a new (not yet saved) conversation")
+    return jsonify({"success": True, "conversation_id": None})
 
 @app.route("/get_current_chat_history", methods=["GET"])
 def get_current_chat_history():
@@ -250,197 +675,84 @@ def get_current_chat_history():
         return jsonify({"success": False, "history": []})
 
     user_id = session["user_id"]
-    conv_id = get_or_create_default_conversation(user_id)
+    conv_id = get_current_conversation(user_id)
     session["current_conversation_id"] = conv_id
+    if conv_id is None:
+        return jsonify({"success": True, "history": [], "has_more": False, "oldest_id": None, "current_conversation_id": None})
     
     db = get_db()
-    messages = db.execute("SELECT message, response, timestamp FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC",
-                          (conv_id,)).fetchall()
-    history = [[m["message"], m["response"]] for m in messages]
-    return jsonify({"success": True, "history": history, "current_conversation_id": conv_id})
+    history, page = load_history_page(db, conv_id, *history_page_args())
+    return jsonify({"success": True, "history": history, **page, "current_conversation_id": conv_id})
 
 @app.route('/summarize_chat', methods=['POST'])
 def summarize_chat():
+    """Queues a summary job (PDF or Markdown); poll /jobs/<job_id> for progress and the file."""
     if "user_id" not in session:
         return jsonify({"success": False, "message": "User not logged in"}), 401
     
     data = request.json
-    conversation_history = data.get('history', [])
-    
-    messages_for_groq = []
-    for h_msg in conversation_history:
-        messages_for_groq.append({"role": "user", "content": h_msg["message"]})
-        messages_for_groq.append({"role": "assistant", "content": h_msg["response"]})
+    file_format = normalize_export_format("summary", data.get("format", "pdf"))
+    if file_format is None:
+        return jsonify({"success": False, "message": "Unsupported file format."}), 400
 
-    summarize_prompt = (
-        "You are an academic tutor and curriculum writer tasked with generating a detailed, structured learning report from the following conversation. "
-        "Your objective is to extract all educational content, group it by topic, and provide an in-depth explanation of each topic as if teaching it to a student. "
-        "Do not summarize the conversation or reference specific dialogue. Instead, reconstruct the content into a clear, well-organized report that fully explains each subject discussed. "
-        "Include additional context, definitions, and examples where needed. Fill in any gaps where a concept was mentioned but not thoroughly explained. "
-        "If practical examples, case studies, **code**, logic, syntax, functions, methods, pseudocode, scenarios, or analogies were discussed in the conversation, include them in the relevant sections. "
-        "If such examples were not provided, **GENERATE appropriate examples**, illustrations, or simplified explanations to help reinforce understanding. These can be from real-world situations, sample problems, or thought experiments. "
-        "Where helpful, include memory techniques, mnemonics, diagrams (as descriptions), or analogies to enhance understanding and retention.\n\n"
-        
-        "For formatting: "
-        "Use plain text only, EXCEPT for the subheadings (Explanation, Examples / Applications, Tips / Mnemonics) which MUST be bolded as shown in the structure below. Do not use other markdown like asterisks (*), backticks (`), or other symbols for emphasis. "
-        "For lists, use numbered bullets like '1.', '2.', '3.' instead of asterisks or dashes. "
-        "Ignore small talk, greetings, or tool usage unless directly relevant to the learning content.\n\n"
-        
-        "Important: Structure the report, exactly as below, and ensure EVERY topic (including any introductory sections) contains ALL three subsections. If content is not directly available from the conversation for 'Examples / Applications' or 'Tips / Mnemonics', you MUST generate relevant content for those sections:\n\n"
-        "=== [Topic Title] ===\n"
-        "**Explanation:**\nFull teaching-style explanation here.\n\n"
-        "**Examples / Applications:**\nReal-world or code examples (if relevant). If no direct examples from the conversation, generate new ones.\n\n"
-        "**Tips / Mnemonics:**\nUseful memory aids or tricks. If no direct tips/mnemonics from the conversation, generate new ones.\n\n"
-        "Conversation:\n" +
-        "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages_for_groq])
-    )
-    messages_for_groq.append({"role": "user", "content": summarize_prompt})
-    
-    summary_text = ask_groq(messages_for_groq)
-    summary_text = re.sub(r'\*\*(.*?)\*\*', r'\1', summary_text)  # strip **bold**
-    summary_text = re.sub(r'\_(.*?)\_', r'\1', summary_text)      # strip _italic_
-    summary_text = re.sub(r'\`(.*?)\`', r'\1', summary_text)      # strip `code`
-    summary_text = re.sub(r'^\s+', '', summary_text, flags=re.MULTILINE)  # strip leading spaces on all lines
-    print(f"Generated summary:\n{summary_text}")  
-
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp:
-            pdf = CustomPDF()
-            pdf.add_page()
-            section_pattern = re.compile(r"(Explanation|Examples / Applications|Tips / Mnemonics)[:：]?\s*(.*)", re.IGNORECASE)
-            last_section = None
-            seen_lines = set()
-
-            for line in summary_text.split('\n'):
-                line = line.strip()
-                if not line or line in seen_lines:
-                    continue
-
-                seen_lines.add(line)
-
-                # === Section titles ===
-                if line.startswith("=== ") and line.endswith(" ==="):
-                    pdf.ensure_space(20)
-                    pdf.chapter_title(line.replace("===", "").strip())
-                    pdf.ln(4)
-                    continue
-
-                # === Sub-section labels like Explanation: ===
-                match = section_pattern.match(line)
-                if match:
-                    label = match.group(1).strip()
-                    content = match.group(2).strip()
-
-                    # Avoid double printing label headers
-                    if last_section == label:
-                        continue
-                    last_section = label
-
-                    pdf.ensure_space(15)
-                    pdf.set_font('', 'B')
-                    safe_multicell(pdf, label + ":")
-                    pdf.set_font('', '')
-                    if content:
-                        safe_multicell(pdf, content)
-                    pdf.ln(3)
-                    continue
-
-                # Clean up bad front spacing and asterisks
-                line = re.sub(r'^\*+\s*', '• ', line)
-                line = re.sub(r'\s{2,}', ' ', line)
-
-                pdf.set_font('', '')
-                pdf.ensure_space(10)
-                safe_multicell(pdf, line)
-                pdf.ln(2)
+    db = get_db()
+    params, error = export_params(db, session["user_id"], data)
+    if error:
+        return error
+    params["format"] = file_format
 
-            pdf.output(temp.name)
-            file_path = temp.name
-        
-        delete_file_later(file_path)
-        return jsonify({"success": True, "file_path": file_path})
-    except Exception as e:
-        app.logger.error(f"Error creating summary file: {e}")
-        return jsonify({"success": False, "message": f"Error creating summary file: {e}"}), 500
+    job_id = submit_job(db, session["user_id"], "summary", params,
+                        dedupe_key=export_dedupe_key(db, session["user_id"], "summary", params))
+    if job_id is None:
+        return jsonify({"success": False, "message": "The export queue is full. Please try again in a minute."}), 503
+    return jsonify({"success": True, "job_id": job_id}), 202
 
 
 @app.route('/generate_flashcards', methods=['POST'])
 def generate_flashcards():
+    """Queues a flashcards job (PDF, HTML, Markdown or Anki CSV/TSV); poll /jobs/<job_id> for progress and the file."""
     if "user_id" not in session:
         return jsonify({"success": False, "message": "User not logged in"}), 401
     
     data = request.json
-    conversation_history = data.get('history', [])
-    file_format = data.get("format", "pdf")
+    file_format = normalize_export_format("flashcards", data.get("format", "pdf"))
+    if file_format is None:
+        return jsonify({"success": False, "message": "Unsupported file format."}), 400
 
-    messages_for_groq = []
-    for h_msg in conversation_history:
-        messages_for_groq.append({"role": "user", "content": h_msg["message"]})
-        messages_for_groq.append({"role": "assistant", "content": h_msg["response"]})
+    db = get_db()
+    params, error = export_params(db, session["user_id"], data)
+    if error:
+        return error
+    params["format"] = file_format
 
-    flashcard_prompt = (
-            "You are an instructional designer and subject matter expert. Your task is to generate high-quality educational flashcards from the following conversation. "
-            "Ignore greetings, social chat, and tool-related comments. Focus solely on extracting learning content from the conversation, even if it spans multiple topics. "
-            "Group flashcards by topic, and ensure each card tests important concepts, definitions, processes, or problem-solving methods discussed. "
-            "Where relevant, include flashcards for concepts that were only briefly mentioned or implied but are necessary for complete understanding. "
-            "\n\nFlashcards must include a **mix** of question types depending on the subject and content:\n"
-            "- Conceptual: definitions, distinctions, 'what' and 'why'\n"
-            "- Applied: case studies, real-world examples, diagnosis-based, analysis questions\n"
-            "- Practical: code snippets, pseudo-scenarios, data interpretation, step-by-step problems\n"
-            "- Process-oriented: questions about sequences, protocols, workflows\n"
-            "- Mnemonics & memory hacks: where helpful, embed memory aids or analogies\n"
-            "Use simple yet precise language for both questions and answers. Provide mnemonics, analogies, or real-world examples where they can enhance understanding or retention. "
-            "Use plain text only. Do not use markdown (e.g., no **bold**, *, or backticks). "
-            "For lists, use numbered bullets like '1.', '2.', '3.' instead of asterisks or dashes. "
-            "Do not reference specific user messages — focus on converting the knowledge into effective active recall material.\n\n"
-            "Format the output as follows:\n\n"
-            "=== [Topic Name] ===\n"
-            "Q: ...\n"
-            "A: ... [Answer in no more than 190 characters total. If the full explanation is longer, split it into multiple Q&A pairs to keep each answer within the limit.]\n\n"
-            "Conversation:\n" +
-            "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages_for_groq])
-        )
-    messages_for_groq.append({"role": "user", "content": flashcard_prompt})
+    job_id = submit_job(db, session["user_id"], "flashcards", params,
+                        dedupe_key=export_dedupe_key(db, session["user_id"], "flashcards", params))
+    if job_id is None:
+        return jsonify({"success": False, "message": "The export queue is full. Please try again in a minute."}), 503
+    return jsonify({"success": True, "job_id": job_id}), 202
 
-    flashcards_text = ask_groq(messages_for_groq)
-    
-    file_path = None
-    try:
-        if file_format == "pdf":
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp:
-                pdf = CustomPDF()
-                pdf.add_page()
-                for line in flashcards_text.split('\n'):
-                    if line.startswith("=== ") and line.endswith(" ==="):
-                        pdf.chapter_title(line.replace("===", "").strip())
-                    elif line.startswith("Q:") or line.startswith("A:"):
-                        pdf.set_font('', 'B' if line.startswith("Q:") else '')
-                        safe_multicell(pdf, line)
-                        pdf.ln(2)
-                pdf.output(temp.name)
-                file_path = temp.name
-        
-        elif file_format.lower() in ["html", "html (interactive)"]:
-             with tempfile.NamedTemporaryFile(delete=False, suffix=".html", mode="w", encoding="utf-8") as temp:
-                html_content = generate_flashcards_html(flashcards_text)
-                temp.write(html_content)
-                file_path = temp.name
-        
-        if file_path:
-            delete_file_later(file_path)
-            return jsonify({"success": True, "file_path": file_path})
-        else:
-            return jsonify({"success": False, "message": "Unsupported file format."}), 400
 
-    except Exception as e:
-        app.logger.error(f"Error creating flashcard file: {e}")
-        return jsonify({"success": False, "message": f"Error creating flashcard file: {e}"}), 500
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "User not logged in"}), 401
+
+    job = get_job(get_db(), job_id, session["user_id"])
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    return jsonify({"success": True, **job})
 
 
-@app.route('/files/<path:filename>')
-def download_file(filename):
-    # Serve files from the system's temporary directory.
-    return send_from_directory(tempfile.gettempdir(), filename, as_attachment=True)
+@app.route('/artifacts/<artifact_id>')
+def download_artifact(artifact_id):
+    """Streams a finished export from memory; conditional=True adds ETag / If-None-Match and Range support."""
+    artifact = download_store.get(artifact_id)
+    if artifact is None:
+        return jsonify({"success": False, "message": "This download has expired. Please generate it again."}), 404
+    # HTML flashcards open in the browser tab; PDFs download
+    return send_file(io.BytesIO(artifact.data), mimetype=artifact.mimetype, download_name=artifact.filename,
+                     as_attachment=not artifact.mimetype.startswith("text/html"), etag=artifact.etag,
+                     conditional=True, max_age=0)
 
 
 # @app.route("/get_conversations", methods=["GET"])
@@ -474,12 +786,14 @@ def get_conversations():
     user_id = session["user_id"]
     print(f"Backend /get_conversations: User ID from session: {user_id}")
     db = get_db()
+    # message_count / last_message_at / preview are maintained by triggers on messages (see db.MIGRATIONS),
+    # so this is a single range scan of idx_conversations_user_recent
     convs = db.execute(
         """
-        SELECT c.id, c.title, (SELECT message FROM messages WHERE conversation_id = c.id ORDER BY timestamp ASC LIMIT 1) as preview
-        FROM conversations c
-        WHERE c.user_id = ? AND (SELECT COUNT(*) FROM messages WHERE conversation_id = c.id) > 0
-        ORDER BY (SELECT MAX(timestamp) FROM messages WHERE conversation_id = c.id) DESC
+        SELECT id, title, preview
+        FROM conversations
+        WHERE user_id = ? AND message_count > 0
+        ORDER BY last_message_at DESC
         """, (user_id,)
     ).fetchall()
     
@@ -514,43 +828,141 @@ def load_conversation(conversation_id):
         return jsonify({"success": False, "message": "Conversation not found."}), 404
 
     session["current_conversation_id"] = conversation_id
-    messages = db.execute("SELECT message, response FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC",
-                          (conversation_id,)).fetchall()
-    history = [[m["message"], m["response"]] for m in messages]
-    return jsonify({"success": True, "history": history, "conversation_id": conversation_id})
+    history, page = load_history_page(db, conversation_id, *history_page_args())
+    return jsonify({"success": True, "history": history, **page, "conversation_id": conversation_id})
 
-@app.route("/chat", methods=["POST"])
-def chat():
+@app.route("/search", methods=["GET"])
+def search():
     if "user_id" not in session:
-        return jsonify({"success": False, "response": "Please log in first."}), 401
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    text = request.args.get("q", "").strip()
+    if not text:
+        return jsonify({"success": False, "message": "Please enter something to search for."}), 400
+    limit = max(1, min(request.args.get("limit", SEARCH_PAGE_SIZE, type=int), MAX_SEARCH_PAGE_SIZE))
+    try:
+        results, page = search_messages(get_db(), session["user_id"], text, request.args.get("cursor"), limit)
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ Search for {text!r} failed: {e}")
+        return jsonify({"success": False, "message": "Search is unavailable right now."}), 500
+    return jsonify({"success": True, "results": results, **page})
+
+# --- Chat Turns ---
+# The steps of /chat and /chat/stream, run inside the request's Flask context both by the views below and
+# by the coroutines asgi.py serves the two routes with, so hooks, cookies and responses are the same.
+# coalesce_key: the same message sent twice while the first is still being answered (a double click)
+# gets the first one's reply, and the turn is stored once.
+ChatTurn = namedtuple("ChatTurn", "user_id conv_id user_msg coalesce_key")
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # stop proxies from holding chunks back
+
+def begin_chat_turn(check_breaker=False):
+    """(ChatTurn, None) for a valid chat request, or (None, error response). Creates the conversation if needed."""
+    if "user_id" not in session:
+        return None, (jsonify({"success": False, "response": "Please log in first."}), 401)
 
     user_id = session["user_id"]
-    data = request.json
-    user_msg = data.get("message")
+    data = request.get_json(silent=True)
+    user_msg = data.get("message") if isinstance(data, dict) else None
     if not user_msg:
-        return jsonify({"success": False, "response": "Empty message."}), 400
+        return None, (jsonify({"success": False, "response": "Empty message."}), 400)
+
+    if check_breaker:
+        llm_status = get_llm_client().status()
+        if not llm_status["available"]:  # fail before a stream starts, so the client gets a real status code
+            return None, (jsonify({"success": False, "response": CIRCUIT_OPEN_MESSAGE, "llm": llm_status}), 503)
 
     conv_id = get_or_create_default_conversation(user_id)
     session["current_conversation_id"] = conv_id
-    
-    db = get_db()
-    historical_msgs = db.execute("SELECT message, response FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC",
-                                 (conv_id,)).fetchall()
-    
-    messages_for_groq = []
-    for h_msg in historical_msgs:
-        messages_for_groq.append({"role": "user", "content": h_msg["message"]})
-        messages_for_groq.append({"role": "assistant", "content": h_msg["response"]})
-    messages_for_groq.append({"role": "user", "content": user_msg})
-    
-    reply = ask_groq(messages_for_groq)
+    last_message_id = get_db().execute("SELECT MAX(id) FROM messages WHERE conversation_id = ?", (conv_id,)).fetchone()[0]
+    return ChatTurn(user_id, conv_id, user_msg, ("chat", user_id, conv_id, last_message_id, user_msg)), None
 
-    db.execute("INSERT INTO messages (conversation_id, user_id, message, response) VALUES (?, ?, ?, ?)",
-               (conv_id, user_id, user_msg, reply))
-    db.commit()
+def chat_turn_messages(turn):
+    return build_chat_messages(get_db(), turn.conv_id, turn.user_msg, turn.user_id)
+
+def finish_chat_turn(turn, reply, conn=None):
+    """Stores the turn, unless the reply is one of the LLM error messages."""
+    if reply not in LLM_ERROR_MESSAGES:
+        store_turn(conn or get_db(), turn.conv_id, turn.user_id, turn.user_msg, reply)
 
+def chat_reply_response(reply):
+    if reply in LLM_UNAVAILABLE_STATUS:
+        return jsonify({"success": False, "response": reply, "llm": get_llm_client().status()}), LLM_UNAVAILABLE_STATUS[reply]
     return jsonify({"success": True, "response": reply})
 
+def stream_delta_line(delta):
+    return json.dumps({"delta": delta}) + "\n"
+
+def stream_done_line(turn, reply):
+    if reply in LLM_ERROR_MESSAGES:
+        return json.dumps({"done": True, "error": reply, "conversation_id": turn.conv_id}) + "\n"
+    return json.dumps({"done": True, "conversation_id": turn.conv_id}) + "\n"
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    turn, error = begin_chat_turn()
+    if error:
+        return error
+
+    def answer():
+        reply = ask_groq(chat_turn_messages(turn), deadline=time.monotonic() + CHAT_DEADLINE)
+        finish_chat_turn(turn, reply)
+        return reply
+
+    return chat_reply_response(inflight.do(turn.coalesce_key, answer))
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Same as /chat, but streams the reply back as NDJSON lines while Groq generates it."""
+    turn, error = begin_chat_turn(check_breaker=True)
+    if error:
+        return error
+
+    messages_for_groq = chat_turn_messages(turn)
+    deadline = time.monotonic() + CHAT_DEADLINE
+
+    def generate():
+        parts = []
+        for delta in stream_groq(messages_for_groq, deadline=deadline):
+            parts.append(delta)
+            yield stream_delta_line(delta)
+
+        # Persist the full reply only once the stream has finished. The request's own connection
+        # may already be torn down by now, so use a dedicated one.
+        reply = "".join(parts)
+        conn = db_pool.acquire()
+        try:
+            finish_chat_turn(turn, reply, conn)
+        finally:
+            db_pool.release(conn)
+        yield stream_done_line(turn, reply)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson", headers=STREAM_HEADERS)
+
+
+@app.route("/llm_status", methods=["GET"])
+def llm_status():
+    """Whether the AI is reachable right now (circuit breaker state), so the UI can say so up front."""
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    return jsonify({"success": True, **get_llm_client().status()})
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Internal counters for tuning: connection reuse and lock waits, export cache hits, pending LLM retries, password hashing load, finished downloads held in memory, coalesced duplicate requests."""
+    if not internal_caller(request.remote_addr, request.headers.get("X-Forwarded-For")):
+        return jsonify({"success": False, "message": "Forbidden"}), 403
+    return jsonify({
+        "db": db_pool.stats(),
+        "auth": auth_stats(),
+        "downloads": download_store.stats(),
+        "artifact_cache": artifact_cache.stats(),
+        "llm": get_llm_client().stats(),
+        "completion_cache": completion_cache.stats(),
+        "retrieval": retrieval_index.stats(),
+        "coalesced": {**inflight.stats(), "jobs": job_stats()["coalesced"]},
+    })
+
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,190 @@
+# asgi.py
+import asyncio
+import io
+import os
+import time
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import Response
+from app import (app as flask_app, begin_chat_turn, chat_turn_messages, finish_chat_turn, chat_reply_response,
+                 stream_delta_line, stream_done_line, internal_caller, CHAT_DEADLINE, STREAM_HEADERS)
+from auth import shutdown_hash_pool
+from cache import inflight
+from chatbot import ask_groq_async, astream_groq, close_client as close_llm_client
+from db import close_db
+
+# --- Async Serving ---
+# Run with:  uvicorn asgi:app --host 0.0.0.0 --port 5000
+# POST /chat and /chat/stream are answered by coroutines: while the LLM is generating, a chat is a suspended
+# task on the event loop rather than a blocked thread, so one worker can hold hundreds of them open. They run
+# the same steps as the Flask views (app.py, "Chat Turns") inside a real Flask request context, with the
+# database work on threads. Every other route is the Flask app on a pool of FLASK_THREADS threads; export
+# jobs still wait on the LLM from the job workers' threads.
+# One uvicorn worker only: finished exports (cache.download_store) live in process memory, so with
+# several workers a download poll can land on a process that doesn't have the file.
+ASYNC_MAX_PENDING = int(os.getenv("ASYNC_MAX_PENDING", "500"))  # chats in progress; beyond it new ones get 503
+ASYNC_BUSY_MESSAGE = "⏳ The server is handling too many chats right now. Please try again in a few seconds."
+FLASK_THREADS = int(os.getenv("FLASK_THREADS", "32"))  # requests to the other Flask routes served at once
+MAX_BODY_BYTES = 1024 * 1024
+
+flask_asgi = WSGIMiddleware(flask_app, workers=FLASK_THREADS)
+
+_pending = 0  # chats (streams included) this worker is answering; only touched from the event loop
+_counters = {"chats": 0, "streams": 0, "rejected": 0}
+
+
+async def _send_json(send, status, payload, headers=()):
+    body = flask_app.json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                            *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get("more_body"):
+            return body
+
+
+async def _on_thread(fn, *args):
+    """Runs fn on a thread inside the current Flask request context (asyncio.to_thread copies it). The pooled
+    database connection goes back after every call, so a chat waiting on the LLM doesn't hold one."""
+    def run():
+        try:
+            return fn(*args)
+        finally:
+            close_db()
+    return await asyncio.to_thread(run)
+
+
+# --- Chat ---
+async def _chat():
+    turn, error = await _on_thread(begin_chat_turn)
+    if error:
+        return error, None
+    _counters["chats"] += 1
+
+    async def answer():
+        messages = await _on_thread(chat_turn_messages, turn)
+        reply = await ask_groq_async(messages, deadline=time.monotonic() + CHAT_DEADLINE)
+        await _on_thread(finish_chat_turn, turn, reply)
+        return reply
+
+    return chat_reply_response(await inflight.ado(turn.coalesce_key, answer)), None
+
+
+async def _chat_stream():
+    turn, error = await _on_thread(begin_chat_turn, True)
+    if error:
+        return error, None
+    _counters["streams"] += 1
+    messages = await _on_thread(chat_turn_messages, turn)
+    deadline = time.monotonic() + CHAT_DEADLINE
+
+    async def lines():
+        parts = []
+        async for delta in astream_groq(messages, deadline=deadline):
+            parts.append(delta)
+            yield stream_delta_line(delta)
+        reply = "".join(parts)
+        await _on_thread(finish_chat_turn, turn, reply)
+        yield stream_done_line(turn, reply)
+
+    return Response(mimetype="application/x-ndjson", headers=STREAM_HEADERS), lines()
+
+
+async def _send_response(send, response, lines=None):
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    if lines is None:
+        await send({"type": "http.response.body", "body": response.get_data()})
+        return
+    try:
+        async for line in lines:
+            await send({"type": "http.response.body", "body": line.encode("utf-8"), "more_body": True})
+    except Exception as e:  # the status line is already out; end the body rather than the connection
+        print(f"⚠️ Chat stream failed: {e!r}")
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def serve_chat(scope, receive, send, view):
+    """Serves a chat route like Flask's own dispatch would (before/after_request hooks, session cookie, error
+    handlers) while the view's wait for the LLM stays on the event loop."""
+    global _pending
+    if _pending >= ASYNC_MAX_PENDING:
+        # Shed load up front rather than queueing chats that would only time out
+        _counters["rejected"] += 1
+        return await _send_json(send, 503, {"success": False, "response": ASYNC_BUSY_MESSAGE}, [(b"retry-after", b"2")])
+
+    _pending += 1
+    try:
+        body = await _read_body(receive)
+        if body is None:
+            return await _send_json(send, 413, {"success": False, "response": "Message too long."})
+        ctx = flask_app.request_context(build_environ(scope, io.BytesIO(body)))
+        ctx.push()  # into this task's context only; concurrent chats each have their own
+        try:
+            lines = None
+            try:
+                try:
+                    rv = await _on_thread(flask_app.preprocess_request)  # e.g. restoring a remember-me login
+                    if rv is None:
+                        rv, lines = await view()
+                except Exception as e:
+                    rv = flask_app.handle_user_exception(e)  # HTTP errors become responses, the rest re-raise
+                response = await _on_thread(flask_app.finalize_request, rv)  # after_request hooks, session cookie
+            except Exception as e:
+                lines = None
+                response = flask_app.handle_exception(e)  # logs it and answers 500, as Flask would
+            await _send_response(send, response, lines)
+        finally:
+            ctx.pop()
+    finally:
+        _pending -= 1
+
+
+def async_stats():
+    return {**_counters, "pending": _pending, "max_pending": ASYNC_MAX_PENDING, "coalesced": inflight.stats()["coalesced"]}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(shutdown_hash_pool)
+            await asyncio.to_thread(close_llm_client)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+ASYNC_ROUTES = {("POST", "/chat"): _chat, ("POST", "/chat/stream"): _chat_stream}
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "http":
+        view = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        if view is not None:
+            return await serve_chat(scope, receive, send, view)
+        if scope["method"] == "GET" and scope["path"] == "/stats/async":
+            forwarded = any(name == b"x-forwarded-for" for name, _ in scope["headers"])
+            if not internal_caller((scope.get("client") or ("",))[0], forwarded):
+                return await _send_json(send, 403, {"success": False, "message": "Forbidden"})
+            return await _send_json(send, 200, async_stats())
+    return await flask_asgi(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host="0.0.0.0", port=5000)
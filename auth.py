@@ -1,10 +1,178 @@
 import bcrypt
 from db import get_db
 import re
+import os
+import hashlib
+import multiprocessing
+import secrets
 import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+# --- Password Hashing Pool ---
+# bcrypt is deliberately slow (~250 ms of CPU), so it runs in its own small process pool instead of
+# on the request threads. Once HASH_WORKERS are busy and MAX_HASH_QUEUE more calls are waiting,
+# further logins/signups are turned away immediately rather than queueing behind a burst.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+MAX_HASH_QUEUE = int(os.getenv("MAX_HASH_QUEUE", "8"))
+HASH_TIMEOUT = 10  # seconds
+
+# --- Login Throttling ---
+MAX_FAILURES_PER_USERNAME = 10   # failed logins per username...
+USERNAME_WINDOW = 15 * 60        # ...within this many seconds
+MAX_ATTEMPTS_PER_IP = int(os.getenv("MAX_LOGIN_ATTEMPTS_PER_IP", "30"))  # failed logins/signups per IP...
+IP_WINDOW = 5 * 60               # ...within this many seconds
+
+# --- Remember-me Tokens ---
+REMEMBER_TOKEN_HOURS = int(os.getenv("REMEMBER_TOKEN_HOURS", "24"))
+REMEMBER_COOKIE = "remember_token"
+
+BUSY_MESSAGE = "The server is busy right now. Please try again in a few seconds."
+THROTTLED_MESSAGE = "Too many attempts. Please wait a few minutes and try again."
+
+_hash_pool = None
+_hash_lock = threading.Lock()
+_hash_pending = 0
+_hash_latencies = deque(maxlen=200)
+_auth_counters = {"rejected_busy": 0, "throttled": 0}
+
+
+def _hashpw(password_bytes):
+    return bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+
+def _checkpw(password_bytes, hashed):
+    return bcrypt.checkpw(password_bytes, hashed)
+
+
+def _new_hash_pool():
+    # forkserver rather than fork: a fork of this multithreaded server could copy a lock some other thread holds
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["auth"])  # bcrypt is imported once, not the server's own main module
+    return ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=context)
+
+
+def start_hash_pool():
+    """Creates the hash pool at startup rather than inside the first login."""
+    global _hash_pool
+    with _hash_lock:
+        if _hash_pool is None:
+            _hash_pool = _new_hash_pool()
+
+
+def _hash_done(future):
+    global _hash_pending
+    with _hash_lock:
+        _hash_pending -= 1
+
+
+def _run_hash(fn, *args):
+    """Runs a bcrypt call in the hash pool. Returns (ok, result); ok is False when the pool is saturated."""
+    global _hash_pool, _hash_pending
+    with _hash_lock:
+        if _hash_pending >= HASH_WORKERS + MAX_HASH_QUEUE:
+            _auth_counters["rejected_busy"] += 1
+            return False, None
+        _hash_pending += 1
+        if _hash_pool is None:
+            _hash_pool = _new_hash_pool()
+        pool = _hash_pool
+    start = time.perf_counter()
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        _hash_done(None)
+        raise
+    # The slot is given back when bcrypt finishes, not when we stop waiting: a timed-out call still holds a worker
+    future.add_done_callback(_hash_done)
+    try:
+        return True, future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        with _hash_lock:
+            _auth_counters["rejected_busy"] += 1
+        return False, None
+    finally:
+        with _hash_lock:
+            _hash_latencies.append(time.perf_counter() - start)
+
+
+def shutdown_hash_pool():
+    """Stops the hash workers. uvicorn exits by re-raising SIGTERM, which skips the pool's own atexit cleanup
+    and would leave the workers holding the listening socket."""
+    global _hash_pool
+    with _hash_lock:
+        pool, _hash_pool = _hash_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class _SlidingWindow:
+    """Counts events per key over the last `window` seconds."""
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._events = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        events = self._events[key]
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def exceeded(self, key):
+        with self._lock:
+            events = self._prune(key, time.monotonic())
+            return events is not None and len(events) >= self.limit
+
+    def add(self, key):
+        with self._lock:
+            self._events[key].append(time.monotonic())
+
+    def reset(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+_username_failures = _SlidingWindow(MAX_FAILURES_PER_USERNAME, USERNAME_WINDOW)
+_ip_failures = _SlidingWindow(MAX_ATTEMPTS_PER_IP, IP_WINDOW)
+
+
+def _throttled(username=None, ip=None):
+    """True (and counted) if this username or IP has used up its failed attempts."""
+    if (ip and _ip_failures.exceeded(ip)) or (username and _username_failures.exceeded(username.lower())):
+        with _hash_lock:
+            _auth_counters["throttled"] += 1
+        return True
+    return False
+
+
+def _record_failure(username=None, ip=None):
+    # Only failures count: logins that succeed never use up the IP's attempts
+    if username:
+        _username_failures.add(username.lower())
+    if ip:
+        _ip_failures.add(ip)
+
+
+def auth_stats():
+    with _hash_lock:
+        latencies = sorted(_hash_latencies)
+        stats = {"hash_workers": HASH_WORKERS, "hash_queue_depth": _hash_pending, **_auth_counters}
+    if latencies:
+        stats["hash_latency_ms"] = {
+            "avg": round(sum(latencies) / len(latencies) * 1000, 1),
+            "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            "last": round(_hash_latencies[-1] * 1000, 1),
+        }
+    return stats
+
 
 # --- Auth Functions ---
-def create_user(username, password):
+def create_user(username, password, ip=None):
     # Password policy checks
     if len(password) < 12:
         return False, "Password must be at least 12 characters long."
@@ -17,22 +185,79 @@ def create_user(username, password):
     if not re.search(r"[!@#$%^&*(),.?\":{}|<>]", password):
         return False, "Password must contain at least one special character (!@#$%^&*(),.?:{}|<>)."
 
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    if _throttled(ip=ip):
+        return False, THROTTLED_MESSAGE
+    ok, hashed = _run_hash(_hashpw, password.encode('utf-8'))
+    if not ok:
+        return False, BUSY_MESSAGE
     db = get_db()
     try:
         db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed))
         db.commit()
         return True, "User created successfully."
     except sqlite3.IntegrityError:
+        _record_failure(ip=ip)
         return False, "Username already exists."
     except Exception as e:
         print(f"Error creating user: {e}")
         db.rollback()
         return False, "Server error during user creation."
 
-def verify_user(username, password):
+def verify_user(username, password, ip=None):
+    """Returns (user_id, None) on success, or (None, message) explaining why the login was refused."""
+    if not username or not password:
+        return None, "Invalid credentials."
+    if _throttled(username=username, ip=ip):
+        return None, THROTTLED_MESSAGE
+
     db = get_db()
     user = db.execute("SELECT id, password FROM users WHERE username = ?", (username,)).fetchone()
-    if user and bcrypt.checkpw(password.encode('utf-8'), user["password"]):
-        return user["id"]
-    return None
\ No newline at end of file
+    if user:
+        ok, matches = _run_hash(_checkpw, password.encode('utf-8'), user["password"])
+        if not ok:
+            return None, BUSY_MESSAGE
+        if matches:
+            _username_failures.reset(username.lower())
+            return user["id"], None
+    _record_failure(username, ip)
+    return None, "Invalid credentials."
+
+
+# --- Remember-me Tokens ---
+# The browser holds a random token; only its SHA-256 is stored, so a leaked database can't be replayed.
+# Tokens are single use: every successful restore swaps the old token for a new one.
+def _token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def issue_remember_token(db, user_id):
+    """Creates a token for user_id and returns the plaintext (for the cookie)."""
+    token = secrets.token_urlsafe(32)
+    db.execute("INSERT INTO remember_tokens (user_id, token, expires_at) VALUES (?, ?, datetime('now', ?))",
+               (user_id, _token_hash(token), f"+{REMEMBER_TOKEN_HOURS} hours"))
+    db.commit()
+    return token
+
+def consume_remember_token(db, token):
+    """Returns (user_id, replacement_token) for a valid token, or (None, None). One indexed lookup, no bcrypt."""
+    if not token:
+        return None, None
+    row = db.execute("SELECT id, user_id FROM remember_tokens WHERE token = ? AND expires_at > datetime('now')",
+                     (_token_hash(token),)).fetchone()
+    if not row:
+        return None, None
+    # Deleting by id doubles as a claim: if a concurrent request already rotated it, this one loses
+    if not db.execute("DELETE FROM remember_tokens WHERE id = ?", (row["id"],)).rowcount:
+        db.commit()
+        return None, None
+    return row["user_id"], issue_remember_token(db, row["user_id"])
+
+def revoke_remember_tokens(db, user_id=None, token=None):
+    """Revokes one token, or every token a user has (e.g. "log out everywhere"). Returns how many went."""
+    if token:
+        revoked = db.execute("DELETE FROM remember_tokens WHERE token = ?", (_token_hash(token),)).rowcount
+    elif user_id is not None:
+        revoked = db.execute("DELETE FROM remember_tokens WHERE user_id = ?", (user_id,)).rowcount
+    else:
+        return 0
+    db.commit()
+    return revoked
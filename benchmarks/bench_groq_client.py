@@ -0,0 +1,62 @@
+# benchmarks/bench_groq_client.py
+# Per-call overhead of a fresh requests.post per turn (the old ask_groq) vs the pooled GroqClient.
+# Run from the project root: python benchmarks/bench_groq_client.py [calls] [--tls]
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+import urllib3
+from chatbot import GroqClient
+from fake_groq import start_fake_groq
+
+MESSAGES = [{"role": "user", "content": "explain recursion"}]
+
+
+def time_calls(fn, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    tls = "--tls" in sys.argv
+    calls = int(args[0]) if args else 500
+    server, url = start_fake_groq(tls=tls)
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)  # self-signed stub cert
+
+    def unpooled():
+        # What ask_groq used to do: module-level requests.post, new connection every time
+        r = requests.post(url, headers={"Authorization": "Bearer test"},
+                          json={"model": "llama-3.3-70b-versatile", "messages": MESSAGES}, timeout=30,
+                          verify=False)
+        r.json()['choices'][0]['message']['content']
+
+    client = GroqClient(api_key="test", endpoint=url, verify=False)
+    try:
+        time_calls(unpooled, 20)  # warm up
+        time_calls(lambda: client.chat(MESSAGES), 20)
+
+        print(f"{calls} sequential calls against {url}")
+        report("requests.post per call", time_calls(unpooled, calls))
+        report("GroqClient (pooled)", time_calls(lambda: client.chat(MESSAGES), calls))
+    finally:
+        client.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
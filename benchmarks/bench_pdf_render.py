@@ -0,0 +1,66 @@
+# benchmarks/bench_pdf_render.py
+# Render time per summary PDF when every document parses the DejaVu TTFs itself (the old CustomPDF)
+# vs. taking them from the process-wide font registry.
+# Run from the project root: python benchmarks/bench_pdf_render.py [renders]
+import os
+import sys
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+from pdf_fonts import font_registry, FONT_FAMILY, FONT_FILES
+
+SUMMARY_TEXT = "\n\n".join(
+    f"Topic {i}\n" + "Recursion solves a problem by reducing it to smaller copies of itself. " * 12
+    for i in range(6)
+)
+
+
+def render(install_fonts):
+    pdf = FPDF()
+    family = install_fonts(pdf)
+    pdf.add_page()
+    for block in SUMMARY_TEXT.split("\n\n"):
+        title, body = block.split("\n", 1)
+        pdf.set_font(family, "B", 12)
+        pdf.cell(0, 10, title)
+        pdf.ln(12)
+        pdf.set_font(family, "", 10)
+        pdf.multi_cell(0, 5, body)
+    return bytes(pdf.output())
+
+
+def add_fonts_per_document(pdf):
+    for style, path in FONT_FILES.items():
+        pdf.add_font(FONT_FAMILY, style, path)
+    return FONT_FAMILY
+
+
+def time_renders(install_fonts, renders):
+    timings = []
+    for _ in range(renders):
+        start = time.perf_counter()
+        render(install_fonts)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"{label:<28} mean {statistics.mean(timings):7.2f} ms   p50 {statistics.median(timings):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    start = time.perf_counter()
+    font_registry.warm_up()
+    print(f"registry warm-up (once)      {(time.perf_counter() - start) * 1000:7.2f} ms")
+    report("add_font per document", time_renders(add_fonts_per_document, renders))
+    report("font registry", time_renders(font_registry.install, renders))
+
+
+if __name__ == "__main__":
+    main()
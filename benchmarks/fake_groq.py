@@ -0,0 +1,224 @@
+# benchmarks/fake_groq.py
+# A tiny OpenAI-compatible stand-in for the Groq chat completions endpoint, used by the benchmarks.
+# Latency, streaming speed and 429 injection are configurable so load tests can model a slow or
+# rate-limited provider: python benchmarks/fake_groq.py --latency lognormal:0.4,0.5 --rate-limit 0.05
+# With --rpm / --tpm it enforces per-minute limits like Groq does and reports them in x-ratelimit-* headers.
+import argparse
+import json
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_REPLY = "Recursion is when a function calls itself on a smaller piece of the problem."
+# Export prompts get replies in the format the app parses, so exports render real content
+CANNED_SUMMARY = """=== Recursion ===
+**Explanation:**
+A recursive function solves a problem by calling itself on a smaller input until it reaches a base case.
+**Examples / Applications:**
+1. factorial(n) = n * factorial(n - 1), with factorial(0) = 1.
+2. Walking a directory tree.
+**Tips / Mnemonics:**
+Base case first, then shrink the problem.
+"""
+CANNED_FLASHCARDS = """=== Recursion ===
+Q: What is recursion?
+A: A function calling itself on a smaller version of the problem.
+Q: What stops a recursive function?
+A: The base case.
+=== Stacks ===
+Q: Why can deep recursion fail?
+A: Each call uses stack space; too many calls overflow the stack.
+"""
+
+
+def parse_latency(spec):
+    """Turns "fixed:0.2", "uniform:0.1,0.5" or "lognormal:MEDIAN,SIGMA" (seconds) into a sampler."""
+    kind, _, args = (spec or "fixed:0").partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        # median and sigma of the underlying normal, so most replies sit near the median with a long tail
+        median, sigma = values
+        return lambda: random.lognormvariate(0, sigma) * median
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def canned_reply(data):
+    prompt = (data.get("messages") or [{}])[-1].get("content", "")
+    if "flashcards" in prompt:
+        return CANNED_FLASHCARDS
+    if "learning report" in prompt:
+        return CANNED_SUMMARY
+    return CANNED_REPLY
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # otherwise delayed ACKs add ~40 ms to every keep-alive reply
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        server.count("requests")
+        reply = canned_reply(data)
+        prompt_tokens = len(json.dumps(data.get("messages", []))) // 4
+        completion_tokens = len(reply) // 4
+        within_limits, limit_headers = server.take_quota(prompt_tokens + completion_tokens)
+
+        if not within_limits or (server.rate_limit and random.random() < server.rate_limit):
+            server.count("rate_limited")
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}}).encode()
+            self.send_response(429)
+            self.send_header("Retry-After", str(server.retry_after))
+            for name, value in limit_headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        time.sleep(server.latency())  # time to first token
+
+        if data.get("stream"):
+            self.send_response(200)
+            for name, value in limit_headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for word in reply.split(" "):
+                if server.token_delay:
+                    time.sleep(server.token_delay)
+                chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        if server.token_delay:
+            time.sleep(server.token_delay * len(reply.split(" ")))  # non-streamed replies still take generation time
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        body = json.dumps({"choices": [{"message": {"role": "assistant", "content": reply}}], "usage": usage}).encode()
+        self.send_response(200)
+        for name, value in limit_headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, text):
+        raw = text.encode()
+        self.wfile.write(f"{len(raw):X}\r\n".encode() + raw + b"\r\n")
+        self.wfile.flush()
+
+
+def _self_signed_context():
+    """Builds a server TLS context from a throwaway self-signed cert (needs the openssl CLI)."""
+    cert_dir = tempfile.mkdtemp(prefix="fake_groq_")
+    cert, key = os.path.join(cert_dir, "cert.pem"), os.path.join(cert_dir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class FakeGroqServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency="fixed:0", token_delay=0.0, rate_limit=0.0, retry_after=1, rpm=0, tpm=0):
+        super().__init__(address, FakeGroqHandler)
+        self.latency = parse_latency(latency)
+        self.token_delay = token_delay    # seconds per streamed word
+        self.rate_limit = rate_limit      # fraction of requests answered with 429
+        self.retry_after = retry_after    # seconds, sent in the Retry-After header
+        self.rpm = rpm                    # requests per minute before 429s (0 = unlimited)
+        self.tpm = tpm                    # tokens per minute before 429s (0 = unlimited)
+        self._levels = {"requests": rpm, "tokens": tpm}
+        self._refilled = time.monotonic()
+        self.stats = {"requests": 0, "rate_limited": 0}
+        self._stats_lock = threading.Lock()
+
+    def take_quota(self, tokens):
+        """Counts a request against the per-minute limits, which refill continuously like Groq's.
+        Returns (allowed, x-ratelimit-* headers)."""
+        if not (self.rpm or self.tpm):
+            return True, {}
+        with self._stats_lock:
+            now = time.monotonic()
+            for kind, limit in (("requests", self.rpm), ("tokens", self.tpm)):
+                if limit:
+                    self._levels[kind] = min(limit, self._levels[kind] + (now - self._refilled) * limit / 60)
+            self._refilled = now
+            costs = {"requests": 1, "tokens": tokens}
+            allowed = all(self._levels[kind] >= costs[kind] for kind, limit in (("requests", self.rpm),
+                                                                              ("tokens", self.tpm)) if limit)
+            headers = {}
+            for kind, limit in (("requests", self.rpm), ("tokens", self.tpm)):
+                if not limit:
+                    continue
+                if allowed:
+                    self._levels[kind] -= costs[kind]
+                level = max(0.0, self._levels[kind])
+                headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(int(level))
+                headers[f"x-ratelimit-reset-{kind}"] = f"{(limit - level) * 60 / limit:.2f}s"  # until full again
+            return allowed, headers
+
+    def handle_error(self, request, client_address):
+        pass  # clients hanging up mid-reply (e.g. the app shutting down) are expected in load tests
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+
+def start_fake_groq(host="127.0.0.1", port=0, tls=False, **behaviour):
+    """Starts the stub on a background thread and returns (server, endpoint_url).
+
+    behaviour: latency (distribution spec), token_delay, rate_limit, retry_after, rpm, tpm - see FakeGroqServer.
+    """
+    server = FakeGroqServer((host, port), **behaviour)
+    scheme = "http"
+    if tls:
+        # Real Groq traffic is HTTPS, and the TLS handshake is most of what pooling saves
+        server.socket = _self_signed_context().wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://{host}:{server.server_address[1]}/openai/v1/chat/completions"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub for local benchmarks")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:LO,HI | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds per streamed word")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests that get a 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute before 429s (0 = unlimited)")
+    parser.add_argument("--tls", action="store_true")
+    args = parser.parse_args()
+    server, url = start_fake_groq(port=args.port, tls=args.tls, latency=args.latency, token_delay=args.token_delay,
+                                  rate_limit=args.rate_limit, retry_after=args.retry_after, rpm=args.rpm, tpm=args.tpm)
+    print(f"Fake Groq listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
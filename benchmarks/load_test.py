@@ -0,0 +1,263 @@
+# benchmarks/load_test.py
+# Drives a realistic mix of login / chat / list / load / export traffic against app.py, with the
+# fake Groq stub standing in for the LLM, and reports throughput, latency percentiles and errors per route.
+# Run from the project root:
+#   python benchmarks/load_test.py --users 20 --duration 30 --latency lognormal:0.4,0.5 --rate-limit 0.02
+# By default a fresh app.py is started in a scratch directory; --url targets one that is already running
+# (point its GROQ_ENDPOINT at benchmarks/fake_groq.py yourself).
+import argparse
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests
+from fake_groq import start_fake_groq
+
+PASSWORD = "LoadTest-Pass123!"
+# route -> relative weight of each virtual-user action
+DEFAULT_MIX = {"chat": 40, "chat_stream": 15, "list": 15, "load": 15, "export": 5, "login": 5, "new_chat": 5}
+CHAT_PROMPTS = ["Explain recursion with an example.", "What is a hash table?", "How does TCP handle packet loss?",
+                "Give me a mnemonic for the OSI layers.", "What's the difference between a process and a thread?"]
+EXPORT_POLL_INTERVAL = 0.2
+EXPORT_TIMEOUT = 60
+
+
+class Recorder:
+    """Collects (latency, ok, status) per route from every virtual user."""
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok, status):
+        with self._lock:
+            self._samples[route].append((seconds, ok))
+            self._statuses[route][status] += 1
+
+    def report(self, elapsed):
+        print(f"\n{'route':<12} {'reqs':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  statuses")
+        total = errors = 0
+        for route in sorted(self._samples):
+            samples = self._samples[route]
+            latencies = sorted(s for s, _ in samples) or [0.0]
+            failed = sum(1 for _, ok in samples if not ok)
+            total += len(samples)
+            errors += failed
+            statuses = " ".join(f"{k}:{v}" for k, v in sorted(self._statuses[route].items(), key=str))
+            print(f"{route:<12} {len(samples):>6} {len(samples) / elapsed:>7.1f} {percentile(latencies, 50):>8.1f} "
+                  f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f} {failed / len(samples):>6.1%}  {statuses}")
+        print(f"\n{total} requests in {elapsed:.1f} s = {total / elapsed:.1f} req/s, error rate {errors / max(total, 1):.1%}")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile, in milliseconds."""
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index] * 1000
+
+
+class VirtualUser:
+    def __init__(self, base_url, name, recorder, mix):
+        self.base_url = base_url
+        self.name = name
+        self.recorder = recorder
+        self.routes, self.weights = zip(*mix.items())
+        self.session = requests.Session()
+        self.conversation_ids = []
+
+    def call(self, route, method, path, ok_statuses=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=120, **kwargs)
+            if kwargs.get("stream"):
+                for _ in response.iter_content(chunk_size=None):
+                    pass  # time the whole stream, not just the headers
+            status = response.status_code
+        except requests.RequestException as e:
+            response, status = None, type(e).__name__
+        self.recorder.record(route, time.perf_counter() - start, status in ok_statuses, status)
+        return response if status in ok_statuses else None
+
+    def setup(self):
+        self.call("signup", "POST", "/signup", json={"username": self.name, "password": PASSWORD})
+        return self.login()
+
+    def login(self):
+        response = self.call("login", "POST", "/login", json={"username": self.name, "password": PASSWORD})
+        return response is not None and response.json().get("success")
+
+    def run(self, stop_at):
+        while time.monotonic() < stop_at:
+            route = random.choices(self.routes, self.weights)[0]
+            getattr(self, f"do_{route}")()
+
+    def do_login(self):
+        self.login()
+
+    def do_new_chat(self):
+        self.call("new_chat", "POST", "/new_conversation")
+
+    def do_chat(self):
+        self.call("chat", "POST", "/chat", json={"message": random.choice(CHAT_PROMPTS)})
+
+    def do_chat_stream(self):
+        self.call("chat_stream", "POST", "/chat/stream", json={"message": random.choice(CHAT_PROMPTS)}, stream=True)
+
+    def do_list(self):
+        response = self.call("list", "GET", "/get_conversations")
+        if response is not None:
+            self.conversation_ids = [c["id"] for c in response.json().get("conversations", [])]
+
+    def known_conversation(self):
+        """A conversation id to load or export, chatting first if the user has none yet."""
+        if not self.conversation_ids:
+            self.do_list()
+        if not self.conversation_ids:
+            self.do_chat()
+            return None
+        return random.choice(self.conversation_ids)
+
+    def do_load(self):
+        conv_id = self.known_conversation()
+        if conv_id is None:
+            return
+        self.call("load", "GET", f"/load_conversation/{conv_id}")
+
+    def do_export(self):
+        """Queues a summary or flashcard job, polls it, downloads the result; recorded end to end as 'export'."""
+        conv_id = self.known_conversation()
+        if conv_id is None:
+            return
+        path = random.choice(["/summarize_chat", "/generate_flashcards"])
+        body = {"conversation_id": conv_id, "format": random.choice(["pdf", "md"])}
+        start = time.perf_counter()
+        status = "failed"
+        try:
+            response = self.session.post(self.base_url + path, json=body, timeout=30)
+            status = response.status_code
+            if status == 202:
+                job_id = response.json()["job_id"]
+                deadline = time.monotonic() + EXPORT_TIMEOUT
+                while time.monotonic() < deadline:
+                    job = self.session.get(f"{self.base_url}/jobs/{job_id}", timeout=30).json()
+                    if job.get("status") == "done":
+                        status = self.session.get(self.base_url + job["download_url"], timeout=30).status_code
+                        break
+                    if job.get("status") == "failed":
+                        status = "job_failed"
+                        break
+                    time.sleep(EXPORT_POLL_INTERVAL)
+                else:
+                    status = "timeout"
+        except requests.RequestException as e:
+            status = type(e).__name__
+        self.recorder.record("export", time.perf_counter() - start, status == 200, status)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(groq_url, rpm=0, tpm=0):
+    """Runs app.py in a scratch directory (fresh chat.db) and waits until it answers."""
+    workdir = tempfile.mkdtemp(prefix="qq_load_")
+    for name in ("schema.sql", "DejaVuSans.ttf", "DejaVuSans-Bold.ttf"):
+        shutil.copy(os.path.join(ROOT, name), workdir)
+    port = free_port()
+    env = dict(os.environ, GROQ_ENDPOINT=groq_url, GROQ_API_KEY="load-test", PYTHONPATH=ROOT)
+    # The app's rate limiter starts from Groq's free-tier limits; give it the fake server's instead
+    if rpm or tpm:
+        env.update(GROQ_RPM=str(rpm or 10 ** 6), GROQ_TPM=str(tpm or 10 ** 9))
+    else:
+        env["LLM_RATE_LIMIT"] = "0"
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + "/check_login_status", timeout=1)
+            return process, base_url, workdir
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("app.py did not start")
+
+
+def parse_mix(spec):
+    """"chat=50,list=20" -> {"chat": 50, "list": 20}"""
+    mix = {}
+    for item in spec.split(","):
+        route, _, weight = item.partition("=")
+        if route not in DEFAULT_MIX:
+            raise ValueError(f"Unknown route in mix: {route}")
+        mix[route] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the Query Quokka backend")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of traffic after setup")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. chat=60,list=20,export=5")
+    parser.add_argument("--latency", default="lognormal:0.3,0.4", help="fake Groq latency distribution")
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of LLM calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--rpm", type=int, default=0, help="fake Groq requests-per-minute limit (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="fake Groq tokens-per-minute limit (0 = unlimited)")
+    parser.add_argument("--url", help="use an already running backend instead of starting one")
+    args = parser.parse_args()
+
+    groq, groq_url = start_fake_groq(latency=args.latency, token_delay=args.token_delay,
+                                     rate_limit=args.rate_limit, retry_after=args.retry_after, rpm=args.rpm, tpm=args.tpm)
+    process = workdir = None
+    base_url = args.url
+    if not base_url:
+        process, base_url, workdir = start_app(groq_url, args.rpm, args.tpm)
+    print(f"Backend {base_url}, fake Groq {groq_url} ({args.latency}, 429 rate {args.rate_limit:.0%})")
+
+    recorder = Recorder()
+    run_id = int(time.time())
+    users = [VirtualUser(base_url, f"load{run_id}_{i}", Recorder(), args.mix) for i in range(args.users)]
+    try:
+        print(f"Setting up {len(users)} users...")
+        users = [u for u in users if u.setup()]
+        for user in users:
+            user.recorder = recorder  # signups and first logins aren't part of the measured run
+        print(f"Running {len(users)} users for {args.duration:.0f} s...")
+        stop_at = time.monotonic() + args.duration
+        started = time.perf_counter()
+        threads = [threading.Thread(target=u.run, args=(stop_at,)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        recorder.report(time.perf_counter() - started)
+        print(f"Fake Groq saw {groq.stats['requests']} requests, {groq.stats['rate_limited']} answered 429")
+        try:
+            print("Backend /stats:", requests.get(base_url + "/stats", timeout=5).json())
+        except (requests.RequestException, ValueError):
+            pass
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+            shutil.rmtree(workdir, ignore_errors=True)
+        groq.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
+# --- Export Cache Settings ---
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ARTIFACT_CACHE_TTL = int(os.getenv("ARTIFACT_CACHE_TTL", "3600"))  # seconds
+
+# --- Download Store Settings ---
+DOWNLOAD_STORE_MAX_BYTES = int(os.getenv("DOWNLOAD_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOWNLOAD_TTL = int(os.getenv("DOWNLOAD_TTL", "900"))  # seconds a finished export stays downloadable
+MAX_ARTIFACT_BYTES = int(os.getenv("MAX_ARTIFACT_BYTES", str(20 * 1024 * 1024)))  # largest single export
+
+# --- LLM Completion Cache Settings ---
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE", "1") == "1"
+COMPLETION_CACHE_DB = os.getenv("COMPLETION_CACHE_DB", "completions.db")  # shared by every worker process
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))  # memory tier
+COMPLETION_CACHE_MAX_ROWS = int(os.getenv("COMPLETION_CACHE_MAX_ROWS", "20000"))  # SQLite tier
+COMPLETION_CACHE_TTL = int(os.getenv("COMPLETION_CACHE_TTL", str(24 * 3600)))  # seconds
+COMPLETION_CACHE_MAX_ENTRY_BYTES = 32 * 1024  # longer replies aren't worth the space
+COMPLETION_CACHE_PRUNE_EVERY = 200  # stores between sweeps of expired / surplus rows
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by total size in bytes, with a per-entry time-to-live."""
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+        if size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+def history_key(kind, history, prompt_version, file_format=None):
+    """Content address for an export: same chat, prompt and format -> same key.
+
+    Whitespace around each message is ignored, so re-sending an unchanged chat always hits.
+    """
+    normalized = [[(h.get("message") or "").strip(), (h.get("response") or "").strip()] for h in history]
+    material = json.dumps([kind, prompt_version, file_format, normalized], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+Artifact = namedtuple("Artifact", "data mimetype filename etag")
+
+
+class ArtifactStore:
+    """Finished exports held in memory under unguessable ids, for /artifacts/<id> to serve.
+
+    The id is the only credential (so links work in a new browser tab); entries expire after
+    DOWNLOAD_TTL and the oldest are dropped first once the store is over its byte budget.
+    """
+    def __init__(self, max_bytes, ttl, max_artifact_bytes):
+        self.max_artifact_bytes = max_artifact_bytes
+        self._cache = LRUCache(max_bytes, ttl)
+
+    def put(self, data, mimetype, filename):
+        """Stores the bytes and returns the new artifact id. Raises ValueError if they are over the per-artifact limit."""
+        if len(data) > self.max_artifact_bytes:
+            raise ValueError(f"Export is too large ({len(data)} bytes).")
+        artifact_id = secrets.token_urlsafe(16)
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        self._cache.set(artifact_id, Artifact(data, mimetype, filename, etag), size=len(data))
+        return artifact_id
+
+    def get(self, artifact_id):
+        return self._cache.get(artifact_id)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class SingleFlight:
+    """Runs one call per key at a time: callers asking for a key that is already being computed
+    wait for that computation and get its result (or its exception) instead of repeating it."""
+    def __init__(self):
+        self._calls = {}  # key -> Future of the call in flight
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key, coro_fn):
+        """do() for coroutines: waits without holding a thread, and coalesces with do() callers of the same key."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+
+def completion_key(model, messages_list, params=None):
+    """Canonical hash of one completion request: same model, messages and sampling params -> same key."""
+    messages = [{"role": m.get("role"), "content": m.get("content")} for m in messages_list]
+    material = json.dumps({"model": model, "messages": messages, "params": params or {}},
+                          sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Exact-match cache of LLM replies: an in-memory LRU in front of a SQLite table every worker shares.
+
+    Replies found in SQLite are promoted to the memory tier. Both tiers expire entries after `ttl`;
+    the table is trimmed to `max_rows` (soonest-expiring first) every COMPLETION_CACHE_PRUNE_EVERY stores.
+    """
+    def __init__(self, path, max_bytes, max_rows, ttl, max_entry_bytes):
+        self.path = path
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self._memory = LRUCache(max_bytes, ttl)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "too_large": 0}
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_expires ON completions (expires_at)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+            return self._counters[name]
+
+    def get(self, key):
+        reply = self._memory.get(key)
+        if reply is not None:
+            self._count("memory_hits")
+            return reply
+        try:
+            row = self._conn().execute("SELECT reply, expires_at FROM completions WHERE key = ? AND expires_at > ?",
+                                       (key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: completion cache lookup failed: {e}")
+            row = None
+        if row is None:
+            self._count("misses")
+            return None
+        self._memory.set(key, row[0])
+        self._count("db_hits")
+        return row[0]
+
+    def set(self, key, reply):
+        if len(reply.encode("utf-8")) > self.max_entry_bytes:
+            self._count("too_large")
+            return
+        self._memory.set(key, reply)
+        try:
+            conn = self._conn()
+            conn.execute("INSERT OR REPLACE INTO completions (key, reply, expires_at) VALUES (?, ?, ?)",
+                         (key, reply, time.time() + self.ttl))
+            if self._count("stores") % COMPLETION_CACHE_PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM completions WHERE expires_at <= ?", (time.time(),))
+                conn.execute("""DELETE FROM completions WHERE key IN (
+                    SELECT key FROM completions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)""", (self.max_rows,))
+        except sqlite3.Error as e:
+            print(f"Warning: completion cache store failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["db_hits"]) / lookups, 3) if lookups else 0.0
+        stats["memory"] = self._memory.stats()
+        return stats
+
+
+# Post-processed LLM text (str) and rendered artifacts (bytes) share one size budget
+artifact_cache = LRUCache(ARTIFACT_CACHE_MAX_BYTES, ARTIFACT_CACHE_TTL)
+
+download_store = ArtifactStore(DOWNLOAD_STORE_MAX_BYTES, DOWNLOAD_TTL, MAX_ARTIFACT_BYTES)
+
+completion_cache = CompletionCache(COMPLETION_CACHE_DB, COMPLETION_CACHE_MAX_BYTES, COMPLETION_CACHE_MAX_ROWS,
+                                   COMPLETION_CACHE_TTL, COMPLETION_CACHE_MAX_ENTRY_BYTES)
+
+# Identical LLM calls, renders and chat turns that are running at the same time in this process
+inflight = SingleFlight()
@@ -1,53 +1,910 @@
-import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+import aiohttp
+import asyncio
+import atexit
+import contextlib
+import heapq
+import itertools
+import threading
 import time
 import os
+import json
+import ssl
+from collections import deque, namedtuple
+from multidict import CIMultiDict
+from ratelimit import RateLimiter, estimate_tokens, RATE_LIMIT_ENABLED
+from cache import completion_cache, completion_key, COMPLETION_CACHE_ENABLED
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_ENDPOINT = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_ENDPOINT = os.getenv("GROQ_ENDPOINT", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+GROQ_FAST_MODEL = os.getenv("GROQ_FAST_MODEL", "llama-3.1-8b-instant")
+# Sampling params sent with every request (and part of the completion cache key); unset = the API's defaults
+LLM_TEMPERATURE = os.getenv("LLM_TEMPERATURE")
+
+# --- Providers ---
+# Comma-separated, in order of preference: "groq", "local" (any OpenAI-compatible server, e.g. llama.cpp
+# or vLLM) and "echo" (deterministic, in-process; for offline development and tests).
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "groq")
+LOCAL_LLM_ENDPOINT = os.getenv("LOCAL_LLM_ENDPOINT", "http://127.0.0.1:8080/v1/chat/completions")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "local")
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "none")
+
+# Which model each kind of work uses on Groq: the big model where quality shows, the small fast one
+# for flashcards and the background rolling summaries
+GROQ_TASK_MODELS = {
+    "chat": GROQ_MODEL,
+    "summary": GROQ_MODEL,
+    "flashcards": GROQ_FAST_MODEL,
+    "context": GROQ_FAST_MODEL,
+}
+
+# --- Routing ---
+ROUTER_WINDOW = 50            # recent calls per provider used for its latency / error rate
+ROUTER_MIN_SAMPLES = 5        # calls before a provider's error rate is trusted
+ROUTER_MAX_ERROR_RATE = 0.5   # above this a provider is only tried after the healthy ones
+
+# --- Deadlines, Retry Budget, Hedging, Circuit Breaker ---
+DEFAULT_DEADLINE = float(os.getenv("LLM_DEADLINE", "60"))  # seconds, for calls whose caller gave no deadline
+RETRY_BUDGET_RATIO = 0.2      # retries allowed per recent call...
+RETRY_BUDGET_MIN = 3          # ...plus this many, so a quiet server can still retry
+RETRY_BUDGET_WINDOW = 10      # seconds of history the budget looks at
+HEDGE_REQUESTS = os.getenv("LLM_HEDGE", "0") == "1"  # send a second request when the first is slower than p95
+HEDGE_MIN_SAMPLES = 20        # successful calls before a provider's p95 is trusted as the hedge delay
+BREAKER_FAILURES = 5          # consecutive failures that open a provider's circuit breaker
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds before an open breaker lets a probe through
+RATE_LIMIT_RECHECK = 1.0      # seconds; a call waiting on the rate limiter looks again at least this often
 
 MAX_RETRIES = 3
 
-def ask_groq(messages_list):
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "llama-3.3-70b-versatile",
-        "messages": messages_list
-    }
-
-    for attempt in range(MAX_RETRIES):
+# Connection pool / timeout settings for the shared client (overridable from the environment)
+POOL_SIZE = int(os.getenv("GROQ_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "30"))
+
+# --- Async I/O ---
+# Requests (streaming or not) are sent from one asyncio event loop per process, so hundreds of calls can wait
+# on the network at once; the executor threads only do the quick bookkeeping between attempts.
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "256"))  # open HTTP requests per provider; more wait for a slot
+
+CONNECT_ERROR_MESSAGE = "❌ Unable to connect to the AI after multiple attempts. Please try again later."
+UNEXPECTED_RESPONSE_MESSAGE = "⚠️ Received unexpected response from AI. Please try again."
+RETRIES_EXHAUSTED_MESSAGE = "❌ Failed to get a response after multiple attempts."
+DEADLINE_MESSAGE = "⏱️ The AI is taking too long to answer right now. Please try again."
+CIRCUIT_OPEN_MESSAGE = "🚧 The AI service is unavailable right now. Please try again in a little while."
+# Our own rate limiter refused the call; says nothing about the provider's health
+RATE_LIMITED_MESSAGE = "🕒 The AI is handling too many requests right now. Please try again in a minute."
+STREAM_INTERRUPTED_MESSAGE = "\n\n⚠️ The connection to the AI was interrupted."
+# ask_groq returns these in place of a reply; callers use this to avoid storing or caching them
+LLM_ERROR_MESSAGES = (CONNECT_ERROR_MESSAGE, UNEXPECTED_RESPONSE_MESSAGE, RETRIES_EXHAUSTED_MESSAGE,
+                      DEADLINE_MESSAGE, CIRCUIT_OPEN_MESSAGE, RATE_LIMITED_MESSAGE)
+
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before the next attempt, honouring Retry-After when Groq sends it."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
         try:
-            response = requests.post(GROQ_ENDPOINT, headers=headers, json=data, timeout=30)
+            return int(retry_after)
+        except ValueError:
+            pass  # fallback if malformed
+    return 2 ** attempt
+
+
+class RetryScheduler:
+    """Runs callbacks after a delay from a single timer thread, so backoff never parks a worker."""
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, fn, *args):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), fn, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-retry-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, fn, args = self._heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ Retry scheduler callback failed: {e}")
+
+
+class RetryBudget:
+    """Caps retries at RETRY_BUDGET_RATIO of the calls made in the last RETRY_BUDGET_WINDOW seconds
+    (plus a small floor), so that during an outage retries can't multiply the traffic."""
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, minimum=RETRY_BUDGET_MIN, window=RETRY_BUDGET_WINDOW):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._calls = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+        self.denied = 0
+
+    def _prune(self, now):
+        for events in (self._calls, self._retries):
+            while events and events[0] <= now - self.window:
+                events.popleft()
+
+    def record_call(self):
+        with self._lock:
+            self._calls.append(time.monotonic())
+
+    def try_spend(self):
+        """True (and counted) if a retry fits in the budget."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            if len(self._retries) >= self.minimum + self.ratio * len(self._calls):
+                self.denied += 1
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """Fails calls fast while a provider is down.
+
+    Closed: calls go through. After BREAKER_FAILURES consecutive failures it opens and refuses calls;
+    once BREAKER_COOLDOWN has passed it lets a single probe through (half open), whose outcome
+    closes the breaker again or re-opens it for another cooldown.
+    """
+    def __init__(self, name, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return self.state == "closed"
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                if self.state != "closed":
+                    print(f"✅ LLM provider '{self.name}' recovered; circuit closed")
+                self.state = "closed"
+                self._consecutive = 0
+                self._probing = False
+                return
+            self._consecutive += 1
+            if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+                print(f"🚧 LLM provider '{self.name}' is failing; circuit open for {self.cooldown:.0f} s")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """Hands back the probe of a call that never reached the provider (turned away by the rate limiter):
+        neither a success nor a failure, and the next call may probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def retry_in(self):
+        """Seconds until an open breaker lets a probe through; 0 otherwise."""
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def stats(self):
+        return {"state": self.state, "retry_in": round(self.retry_in(), 1)}
+
+
+# One completion request as it moves through attempts: limit_key is "provider:model", tokens the
+# estimate charged to the rate limiter, interactive whether it may use the bucket reserve (/chat)
+_Call = namedtuple("_Call", "future data deadline limit_key tokens interactive")
+# What an attempt brings back from the event loop; the body is parsed on the executor
+_Response = namedtuple("_Response", "status_code headers body")
+# Network failures of an attempt (HTTP error statuses are raised as aiohttp.ClientError too)
+_TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def llm_loop():
+    """The process-wide event loop the LLM HTTP requests run on, started in a daemon thread on first use."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-io", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+_END = object()
+
+async def _next_piece(pieces):
+    try:
+        return await pieces.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+async def _close_pieces(pieces):
+    await pieces.aclose()
+
+
+def _iterate_blocking(pieces):
+    """Iterates an async generator that has to run on llm_loop() (its aiohttp session lives there) from a thread."""
+    loop = llm_loop()
+    try:
+        while True:
+            piece = asyncio.run_coroutine_threadsafe(_next_piece(pieces), loop).result()
+            if piece is _END:
+                return
+            yield piece
+    finally:
+        asyncio.run_coroutine_threadsafe(_close_pieces(pieces), loop)
+
+
+async def _iterate_async(pieces):
+    """The same for a coroutine on another event loop (uvicorn's): waiting for a piece holds no thread."""
+    loop = llm_loop()
+    try:
+        while True:
+            piece = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_next_piece(pieces), loop))
+            if piece is _END:
+                return
+            yield piece
+    finally:
+        asyncio.run_coroutine_threadsafe(_close_pieces(pieces), loop)
+
+
+class GroqClient:
+    """Reusable client for Groq or any other OpenAI-compatible chat completions endpoint.
+
+    Requests are sent with aiohttp from the shared llm_loop(), at most LLM_MAX_IN_FLIGHT at once; a small
+    executor does the bookkeeping around each attempt. When an attempt fails or hits a 429 the next one is
+    handed to the RetryScheduler instead of sleeping, so no thread waits on the network or on a backoff.
+    A stream is an async generator on the same loop (astream); stream() is its blocking version.
+
+    With a rate_limiter, every attempt first takes its request and estimated tokens from the shared
+    buckets; if they are empty the attempt is rescheduled for when they will have refilled.
+
+    Every provider (this class, EchoClient) offers submit / chat / stream / astream taking a task name,
+    which picks the model from task_models, and a deadline (time.monotonic() value) that bounds
+    every attempt's timeout and whether a retry is still worth starting.
+    """
+    def __init__(self, api_key=None, endpoint=None, model=GROQ_MODEL, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES, verify=True,
+                 name="groq", task_models=None, rate_limiter=None):
+        self.name = name
+        self.rate_limiter = rate_limiter  # shared cross-process buckets; None for servers without limits
+        self.endpoint = endpoint or GROQ_ENDPOINT
+        self.model = model
+        self.task_models = task_models or {}
+        self.sampling = {"temperature": float(LLM_TEMPERATURE)} if LLM_TEMPERATURE else {}
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.verify = verify  # TLS verification; a CA bundle path works too
+
+        self.headers = {
+            "Authorization": f"Bearer {api_key or GROQ_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        self._aio_session = None  # created on the event loop by the first request
+        self._in_flight = asyncio.Semaphore(LLM_MAX_IN_FLIGHT)
+        self._open_requests = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=name)
+        self._scheduler = RetryScheduler()
+        self.retry_budget = RetryBudget()
+
+    def model_for(self, task):
+        return self.task_models.get(task, self.model)
+
+    def _payload(self, messages_list, stream=False, task=None):
+        data = {"model": self.model_for(task), "messages": messages_list, **self.sampling}
+        if stream:
+            data["stream"] = True
+        return data
+
+    # --- Non-streaming ---
+    def _timeout(self, deadline):
+        """(connect, read) timeouts, shortened so an attempt can't outlive the call's deadline."""
+        remaining = max(0.1, deadline - time.monotonic())
+        return (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+    def _may_retry(self, attempt, wait_time, deadline):
+        """Whether another attempt fits the attempt limit, the remaining time and the retry budget."""
+        return (attempt < self.max_retries - 1 and time.monotonic() + wait_time < deadline
+                and self.retry_budget.try_spend())
+
+    def _call(self, messages_list, task, deadline, future=None, stream=False):
+        data = self._payload(messages_list, stream=stream, task=task)
+        return _Call(future, data, deadline or time.monotonic() + DEFAULT_DEADLINE, f"{self.name}:{data['model']}",
+                     estimate_tokens(messages_list, task), task in (None, "chat"))
+
+    def _rate_limit_wait(self, call):
+        """0 if this attempt may go out now, otherwise seconds until the shared buckets allow it."""
+        if self.rate_limiter is None:
+            return 0.0
+        return self.rate_limiter.try_acquire(call.limit_key, call.tokens, call.interactive)
+
+    def submit(self, messages_list, task=None, deadline=None):
+        """Starts a completion and returns a Future that resolves to the reply text."""
+        call = self._call(messages_list, task, deadline, future=Future())
+        self.retry_budget.record_call()
+        self._executor.submit(self._attempt, call, 0)
+        return call.future
+
+    def chat(self, messages_list, task=None, deadline=None):
+        return self.submit(messages_list, task, deadline).result()
+
+    def _attempt(self, call, attempt):
+        future = call.future
+        if time.monotonic() >= call.deadline:
+            future.set_result(DEADLINE_MESSAGE)
+            return
+        try:
+            wait_time = self._rate_limit_wait(call)
+            if wait_time:
+                if time.monotonic() + wait_time >= call.deadline:
+                    future.set_result(RATE_LIMITED_MESSAGE)
+                    return
+                # Not a retry: check again once the buckets should have refilled (sooner if others give tokens back)
+                self._scheduler.call_later(min(wait_time, RATE_LIMIT_RECHECK), self._executor.submit,
+                                           self._attempt, call, attempt)
+                return
+
+            # The request waits on the event loop; this thread goes back to the pool right away
+            sent = asyncio.run_coroutine_threadsafe(self._post(call), llm_loop())
+            sent.add_done_callback(lambda f: self._executor.submit(self._finish, call, attempt, f))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _ssl(self):
+        if self.verify is True:
+            return True
+        return ssl.create_default_context(cafile=self.verify) if self.verify else False
+
+    @contextlib.asynccontextmanager
+    async def _request(self, call, timeout):
+        """POSTs call.data on llm_loop(), holding one of the LLM_MAX_IN_FLIGHT slots until the response is closed."""
+        if self._aio_session is None:
+            self._aio_session = aiohttp.ClientSession(
+                headers=self.headers, connector=aiohttp.TCPConnector(limit=LLM_MAX_IN_FLIGHT, ssl=self._ssl()))
+        # Waiting for a free slot counts against the deadline like the request itself
+        await asyncio.wait_for(self._in_flight.acquire(), max(0.1, call.deadline - time.monotonic()))
+        self._open_requests += 1
+        try:
+            async with self._aio_session.post(self.endpoint, json=call.data, timeout=timeout) as response:
+                yield response
+        finally:
+            self._open_requests -= 1
+            self._in_flight.release()
+
+    async def _post(self, call):
+        """One HTTP attempt, run on llm_loop(); waiting here costs a coroutine, not a thread."""
+        connect, read = self._timeout(call.deadline)
+        timeout = aiohttp.ClientTimeout(total=max(0.1, call.deadline - time.monotonic()),
+                                        sock_connect=connect, sock_read=read)
+        async with self._request(call, timeout) as response:
+            return _Response(response.status, CIMultiDict(response.headers), await response.read())
+
+    def _finish(self, call, attempt, sent):
+        """Handles the outcome of one attempt on the executor: the reply, a retry or an error message."""
+        future = call.future
+        try:
+            response = sent.result()
+            if self.rate_limiter:
+                self.rate_limiter.learn(call.limit_key, response.headers)
 
             if response.status_code == 429:
-                retry_after = response.headers.get("Retry-After")
-                if retry_after:
-                    try:
-                        wait_time = int(retry_after)
-                    except ValueError:
-                        wait_time = 2 ** attempt  # fallback if malformed
-                else:
-                    wait_time = 2 ** attempt  # fallback if header missing
+                wait_time = _retry_delay(response, attempt)
+                if self.rate_limiter:
+                    self.rate_limiter.block(call.limit_key, wait_time)
+                if not self._may_retry(attempt, wait_time, call.deadline):
+                    future.set_result(RETRIES_EXHAUSTED_MESSAGE)
+                    return
+                print(f"🕒 Rate limit hit (429). Retrying in {wait_time} seconds...")
+                self._retry_later(call, attempt, wait_time)
+                return
+
+            if response.status_code >= 400:
+                raise aiohttp.ClientError(f"HTTP {response.status_code} from {self.name}")
+            body = json.loads(response.body)
+            if self.rate_limiter:
+                self.rate_limiter.settle(call.limit_key, call.tokens, (body.get("usage") or {}).get("total_tokens"))
+            future.set_result(body['choices'][0]['message']['content'])
+
+        except _TRANSPORT_ERRORS as e:
+            wait_time = 2 ** attempt
+            if not self._may_retry(attempt, wait_time, call.deadline):
+                print(f"Request failed after {attempt + 1} attempts: {e!r}")
+                future.set_result(DEADLINE_MESSAGE if time.monotonic() + wait_time >= call.deadline
+                                  else CONNECT_ERROR_MESSAGE)
+            else:
+                print(f"⚠️ Request error. Retrying in {wait_time} seconds...")
+                self._retry_later(call, attempt, wait_time)
 
+        except (KeyError, IndexError, TypeError, ValueError):
+            future.set_result(UNEXPECTED_RESPONSE_MESSAGE)
+
+        except Exception as e:
+            future.set_exception(e)
+
+    def _retry_later(self, call, attempt, delay):
+        self._scheduler.call_later(delay, self._executor.submit, self._attempt, call, attempt + 1)
+
+    # --- Streaming ---
+    def stream(self, messages_list, task=None, deadline=None):
+        """Blocking version of astream, for threads."""
+        return _iterate_blocking(self.astream(messages_list, task, deadline))
+
+    async def _off_loop(self, fn, *args):
+        """Runs fn (rate limiter SQLite work) on the executor, so the event loop never waits on a lock."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def astream(self, messages_list, task=None, deadline=None):
+        """Yields the reply piece by piece as the tokens arrive; runs on llm_loop(). The deadline bounds the
+        wait for the first token."""
+        call = self._call(messages_list, task, deadline, stream=True)
+        deadline = call.deadline
+        self.retry_budget.record_call()
+        received = False
+        for attempt in range(self.max_retries):
+            # The consumer is waiting on this generator anyway, so rate-limit waits happen here
+            wait_time = await self._off_loop(self._rate_limit_wait, call)
+            while wait_time:
+                if time.monotonic() + wait_time >= deadline:
+                    yield RATE_LIMITED_MESSAGE
+                    return
+                await asyncio.sleep(min(wait_time, RATE_LIMIT_RECHECK))
+                wait_time = await self._off_loop(self._rate_limit_wait, call)
+            try:
+                connect, read = self._timeout(deadline)
+                async with self._request(call, aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)) as response:
+                    if self.rate_limiter:
+                        await self._off_loop(self.rate_limiter.learn, call.limit_key, response.headers)
+                    if response.status == 429:
+                        wait_time = _retry_delay(response, attempt)
+                        if self.rate_limiter:
+                            await self._off_loop(self.rate_limiter.block, call.limit_key, wait_time)
+                    else:
+                        response.raise_for_status()
+                        # Groq streams OpenAI-style server-sent events: "data: {...}" lines ending with "data: [DONE]"
+                        async for line in response.content:
+                            line = line.decode("utf-8").strip()
+                            if not line.startswith("data:"):
+                                continue
+                            payload = line[len("data:"):].strip()
+                            if payload == "[DONE]":
+                                return
+                            delta = json.loads(payload)['choices'][0].get('delta', {}).get('content')
+                            if delta:
+                                received = True
+                                yield delta
+                        return
+                # A 429: the connection is back in the pool before the backoff starts
+                if not self._may_retry(attempt, wait_time, deadline):
+                    yield RETRIES_EXHAUSTED_MESSAGE
+                    return
                 print(f"🕒 Rate limit hit (429). Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
+
+            except _TRANSPORT_ERRORS as e:
+                if received:
+                    # Part of the answer is already on screen, so retrying would repeat it
+                    print(f"Stream interrupted: {e!r}")
+                    yield STREAM_INTERRUPTED_MESSAGE
+                    return
+                wait_time = 2 ** attempt
+                if not self._may_retry(attempt, wait_time, deadline):
+                    print(f"Streaming request failed after {attempt + 1} attempts: {e!r}")
+                    yield DEADLINE_MESSAGE if time.monotonic() + wait_time >= deadline else CONNECT_ERROR_MESSAGE
+                    return
+                print(f"⚠️ Streaming request error. Retrying in {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+
+            except (KeyError, IndexError, ValueError):
+                yield UNEXPECTED_RESPONSE_MESSAGE
+                return
+
+        yield RETRIES_EXHAUSTED_MESSAGE
+
+    def close(self):
+        """Closes the connection pool; a later request opens a new one."""
+        session, self._aio_session = self._aio_session, None
+        if session is not None:
+            asyncio.run_coroutine_threadsafe(session.close(), llm_loop()).result(timeout=5)
+
+    def stats(self):
+        stats = {"pending_retries": self._scheduler.pending(), "retries_denied": self.retry_budget.denied,
+                 "open_requests": self._open_requests}
+        if self.rate_limiter:
+            stats["rate_limit"] = self.rate_limiter.stats()
+        return stats
+
+
+class EchoClient:
+    """Deterministic in-process provider: replies with the last user message. No network, no key."""
+    name = "echo"
+    sampling = {}
+
+    def model_for(self, task):
+        return "echo"
+
+    def _reply(self, messages_list):
+        last_user = next((m["content"] for m in reversed(messages_list) if m.get("role") == "user"), "")
+        return f"Echo: {last_user[:500]}"
+
+    def submit(self, messages_list, task=None, deadline=None):
+        future = Future()
+        future.set_result(self._reply(messages_list))
+        return future
+
+    def chat(self, messages_list, task=None, deadline=None):
+        return self._reply(messages_list)
+
+    def stream(self, messages_list, task=None, deadline=None):
+        for word in self._reply(messages_list).split(" "):
+            yield word + " "
+
+    async def astream(self, messages_list, task=None, deadline=None):
+        for piece in self.stream(messages_list, task, deadline):
+            yield piece
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class ProviderHealth:
+    """Rolling latency and error rate of one provider over its last ROUTER_WINDOW calls."""
+    def __init__(self, window=ROUTER_WINDOW):
+        self._calls = deque(maxlen=window)  # (ok, seconds)
+        self._lock = threading.Lock()
+
+    def record(self, ok, seconds):
+        with self._lock:
+            self._calls.append((ok, seconds))
+
+    def error_rate(self):
+        with self._lock:
+            if len(self._calls) < ROUTER_MIN_SAMPLES:
+                return 0.0
+            return sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+
+    def latency(self, percentile=50, min_samples=1):
+        """Latency of recent successful calls at this percentile; None with fewer than min_samples."""
+        with self._lock:
+            latencies = sorted(seconds for ok, seconds in self._calls if ok)
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def healthy(self):
+        return self.error_rate() <= ROUTER_MAX_ERROR_RATE
+
+    def stats(self):
+        with self._lock:
+            calls = len(self._calls)
+        p50 = self.latency()
+        return {"calls": calls, "error_rate": round(self.error_rate(), 3),
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None}
+
+
+class LLMRouter:
+    """Sends each call to the first healthy provider, in LLM_PROVIDERS order, and fails over to the next on error.
+
+    Latency never reorders providers (a fast fallback such as echo must not take over the traffic).
+    Providers whose recent error rate is too high are still tried, but only after the healthy ones;
+    providers whose circuit breaker is open are skipped. With LLM_HEDGE=1 a call that is still
+    unanswered after its provider's p95 latency is sent again (to the next provider, if there is
+    one) and the first answer wins; hedges come out of a retry budget.
+    """
+    def __init__(self, providers):
+        self.providers = providers
+        self.health = {p.name: ProviderHealth() for p in providers}
+        self.breakers = {p.name: CircuitBreaker(p.name) for p in providers}
+        self.hedge_budget = RetryBudget()
+        self._counters = {"failovers": 0, "fast_failures": 0, "hedges": 0, "hedge_wins": 0}
+
+    def candidates(self):
+        # sorted() is stable, so the configured order holds among the healthy and among the unhealthy
+        return sorted(self.providers, key=lambda p: not self.health[p.name].healthy())
+
+    def _next_allowed(self, candidates):
+        """Pops candidates until one whose breaker lets a call through; None if none does."""
+        while candidates:
+            provider = candidates.pop(0)
+            if self.breakers[provider.name].allow():
+                return provider
+        return None
+
+    def _record(self, provider, ok, seconds):
+        self.health[provider.name].record(ok, seconds)
+        self.breakers[provider.name].record(ok)
+
+    def _launch(self, provider, messages_list, task, deadline, pending):
+        start = time.perf_counter()
+        future = provider.submit(messages_list, task, deadline)
+
+        # Recorded on completion, so a hedge that loses (or outlives the caller) still counts
+        def record(f):
+            if f.exception() is None and f.result() == RATE_LIMITED_MESSAGE:
+                self.breakers[provider.name].release()  # never reached the provider
+                return
+            ok = f.exception() is None and f.result() not in LLM_ERROR_MESSAGES
+            self._record(provider, ok, time.perf_counter() - start)
+        future.add_done_callback(record)
+        waiter = asyncio.wrap_future(future)
+        pending[waiter] = provider
+        return waiter
+
+    def _hedge_at(self, provider):
+        if not HEDGE_REQUESTS:
+            return None
+        p95 = self.health[provider.name].latency(95, min_samples=HEDGE_MIN_SAMPLES)
+        return time.monotonic() + p95 if p95 is not None else None
+
+    def chat(self, messages_list, task="chat", deadline=None):
+        return self.answer(messages_list, task, deadline)[0]
+
+    async def achat(self, messages_list, task="chat", deadline=None):
+        return (await self.aanswer(messages_list, task, deadline))[0]
+
+    def answer(self, messages_list, task="chat", deadline=None):
+        """Blocking version of aanswer, for threads; the call itself is driven from llm_loop()."""
+        return asyncio.run_coroutine_threadsafe(self.aanswer(messages_list, task, deadline), llm_loop()).result()
+
+    async def aanswer(self, messages_list, task="chat", deadline=None):
+        """(reply, name of the provider that gave it) for one call: failover, hedging and the deadline,
+        awaited without holding a thread. The name is None when the reply is one of the error messages."""
+        deadline = deadline or time.monotonic() + DEFAULT_DEADLINE
+        candidates = self.candidates()
+        provider = self._next_allowed(candidates)
+        if provider is None:
+            self._counters["fast_failures"] += 1
+            return CIRCUIT_OPEN_MESSAGE, None
+        self.hedge_budget.record_call()
+        pending = {}
+        self._launch(provider, messages_list, task, deadline, pending)
+        hedge_at = self._hedge_at(provider)
+        hedge = None
+        reply = RETRIES_EXHAUSTED_MESSAGE
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                return DEADLINE_MESSAGE, None
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, _ = await asyncio.wait(pending, timeout=wake - now, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    if self.hedge_budget.try_spend():
+                        target = self._next_allowed(candidates) or provider
+                        self._counters["hedges"] += 1
+                        print(f"🏁 Hedging slow LLM call with '{target.name}'")
+                        hedge = self._launch(target, messages_list, task, deadline, pending)
                 continue
+            for future in done:
+                answered_by = pending.pop(future)
+                result = future.result()
+                if result not in LLM_ERROR_MESSAGES:
+                    if future is hedge:
+                        self._counters["hedge_wins"] += 1
+                    return result, answered_by.name
+                reply = result
+            if not pending:
+                provider = self._next_allowed(candidates)
+                if provider is not None:
+                    self._counters["failovers"] += 1
+                    print(f"🔀 Failing over to LLM provider '{provider.name}'")
+                    self._launch(provider, messages_list, task, deadline, pending)
+        return reply, None
+
+    def stream(self, messages_list, task="chat", deadline=None):
+        for _, piece in self.stream_answer(messages_list, task, deadline):
+            yield piece
+
+    def stream_answer(self, messages_list, task="chat", deadline=None):
+        """Blocking version of astream_answer, for threads; the stream itself runs on llm_loop()."""
+        return _iterate_blocking(self._stream_answer(messages_list, task, deadline))
 
-            response.raise_for_status()
-            return response.json()['choices'][0]['message']['content']
+    def astream_answer(self, messages_list, task="chat", deadline=None):
+        """Yields (provider name, piece), streamed from the first provider that produces output; latency is
+        measured to the first token. An error message comes with None for the name. Works from any event loop."""
+        return _iterate_async(self._stream_answer(messages_list, task, deadline))
 
-        except requests.exceptions.RequestException as e:
-            if attempt == MAX_RETRIES - 1:
-                print(f"Request failed after {MAX_RETRIES} attempts: {e}")
-                return "❌ Unable to connect to the AI after multiple attempts. Please try again later."
+    async def _stream_answer(self, messages_list, task, deadline):
+        deadline = deadline or time.monotonic() + DEFAULT_DEADLINE
+        candidates = self.candidates()
+        error = CIRCUIT_OPEN_MESSAGE
+        provider = self._next_allowed(candidates)
+        if provider is None:
+            self._counters["fast_failures"] += 1
+        while provider is not None:
+            start = time.perf_counter()
+            pieces = provider.astream(messages_list, task, deadline)
+            first = await anext(pieces, RETRIES_EXHAUSTED_MESSAGE)
+            ok = first not in LLM_ERROR_MESSAGES
+            if first == RATE_LIMITED_MESSAGE:  # that one never reached the provider
+                self.breakers[provider.name].release()
             else:
-                wait_time = 2 ** attempt
-                print(f"⚠️ Request error. Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+                self._record(provider, ok, time.perf_counter() - start)
+            if ok:
+                yield provider.name, first
+                async for piece in pieces:
+                    yield provider.name, piece
+                return
+            error = first
+            provider = self._next_allowed(candidates)
+            if provider is not None:
+                self._counters["failovers"] += 1
+                print(f"🔀 Failing over to LLM provider '{provider.name}'")
+        yield None, error
+
+    def cache_identity(self, task):
+        """(model, sampling params) for the completion cache key: those of the preferred provider, so
+        switching providers or models never serves another model's replies."""
+        primary = self.providers[0]
+        return f"{primary.name}:{primary.model_for(task)}", primary.sampling
+
+    def cacheable(self, provider_name):
+        """Whether a reply from this provider may be stored under cache_identity's key: a failover, hedge or
+        fallback reply must not be served later as the preferred model's."""
+        return provider_name == self.providers[0].name
+
+    def close(self):
+        for provider in self.providers:
+            provider.close()
+
+    def status(self):
+        """What the UI shows: whether any provider is taking calls, and if not, when one will be tried again."""
+        breakers = {name: breaker.stats() for name, breaker in self.breakers.items()}
+        available = any(b["state"] != "open" or b["retry_in"] == 0 for b in breakers.values())
+        retry_in = 0 if available else min(b["retry_in"] for b in breakers.values())
+        return {"available": available, "retry_in": retry_in, "providers": breakers}
+
+    def stats(self):
+        stats = {**self._counters, "hedges_denied": self.hedge_budget.denied, "providers": {}}
+        for provider in self.providers:
+            stats["providers"][provider.name] = {**self.health[provider.name].stats(), **provider.stats(),
+                                                 "breaker": self.breakers[provider.name].stats()}
+        # kept at the top level for existing dashboards
+        stats["pending_retries"] = sum(p.get("pending_retries", 0) for p in stats["providers"].values())
+        return stats
+
+
+def build_provider(name):
+    if name == "groq":
+        return GroqClient(task_models=GROQ_TASK_MODELS, rate_limiter=RateLimiter() if RATE_LIMIT_ENABLED else None)
+    if name == "local":
+        return GroqClient(name="local", api_key=LOCAL_LLM_API_KEY, endpoint=LOCAL_LLM_ENDPOINT, model=LOCAL_LLM_MODEL)
+    if name == "echo":
+        return EchoClient()
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the process-wide LLMRouter over LLM_PROVIDERS, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMRouter([build_provider(n.strip()) for n in LLM_PROVIDERS.split(",") if n.strip()])
+    return _client
+
+
+def close_client():
+    """Closes the router's connections. Runs at exit; asgi.py calls it too, as uvicorn exits without atexit."""
+    with _client_lock:
+        client = _client
+    if client is not None:
+        client.close()
+
+atexit.register(close_client)
+
+
+def _cache_key(messages_list, task, cache):
+    if not (cache and COMPLETION_CACHE_ENABLED):
+        return None
+    model, params = get_client().cache_identity(task)
+    return completion_key(model, messages_list, params)
+
+
+def ask_groq(messages_list, task="chat", deadline=None, cache=True):
+    """The reply text for messages_list; task ("chat", "summary", "flashcards", "context") picks the model.
+
+    deadline is a time.monotonic() value; past it the call gives up with DEADLINE_MESSAGE.
+    Identical requests are answered from the completion cache unless cache=False.
+    """
+    key = _cache_key(messages_list, task, cache)
+    if key:
+        reply = completion_cache.get(key)
+        if reply is not None:
+            return reply
+    client = get_client()
+    reply, provider = client.answer(messages_list, task, deadline)
+    if key and client.cacheable(provider):
+        completion_cache.set(key, reply)
+    return reply
+
+
+async def ask_groq_async(messages_list, task="chat", deadline=None, cache=True):
+    """ask_groq for coroutines (asgi.py): the wait for the reply holds no thread."""
+    key = _cache_key(messages_list, task, cache)
+    if key:
+        reply = await asyncio.to_thread(completion_cache.get, key)  # may touch SQLite
+        if reply is not None:
+            return reply
+    client = get_client()
+    reply, provider = await client.aanswer(messages_list, task, deadline)
+    if key and client.cacheable(provider):
+        await asyncio.to_thread(completion_cache.set, key, reply)
+    return reply
+
+
+def stream_groq(messages_list, task="chat", deadline=None, cache=True):
+    """Yields the reply piece by piece as the tokens arrive; a cached reply comes back as one piece."""
+    key = _cache_key(messages_list, task, cache)
+    if key:
+        reply = completion_cache.get(key)
+        if reply is not None:
+            yield reply
+            return
+    client = get_client()
+    pieces, provider = [], None
+    for provider, piece in client.stream_answer(messages_list, task, deadline):
+        pieces.append(piece)
+        yield piece
+    reply = "".join(pieces)
+    if key and client.cacheable(provider) and not reply.endswith(STREAM_INTERRUPTED_MESSAGE):
+        completion_cache.set(key, reply)
 
-        except KeyError:
-            return "⚠️ Received unexpected response from AI. Please try again."
 
-    return "❌ Failed to get a response after multiple attempts."
+async def astream_groq(messages_list, task="chat", deadline=None, cache=True):
+    """stream_groq for coroutines (asgi.py): no thread waits for the tokens."""
+    key = _cache_key(messages_list, task, cache)
+    if key:
+        reply = await asyncio.to_thread(completion_cache.get, key)  # may touch SQLite
+        if reply is not None:
+            yield reply
+            return
+    client = get_client()
+    pieces, provider = [], None
+    async for provider, piece in client.astream_answer(messages_list, task, deadline):
+        pieces.append(piece)
+        yield piece
+    reply = "".join(pieces)
+    if key and client.cacheable(provider) and not reply.endswith(STREAM_INTERRUPTED_MESSAGE):
+        await asyncio.to_thread(completion_cache.set, key, reply)
@@ -0,0 +1,159 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from chatbot import ask_groq, LLM_ERROR_MESSAGES
+from db import connect_db
+from retrieval import retrieval_index, RETRIEVAL_ENABLED, SNIPPET_MESSAGE_CHARS, SNIPPET_RESPONSE_CHARS
+
+# --- Context Window Settings ---
+# Rough token budget for the history part of a /chat prompt (summary + related excerpts + verbatim turns + new message)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# This many recent turns are resent word for word; older ones are folded into the summary (and stay
+# verbatim, budget permitting, until the summary has caught up with them)
+RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "8"))
+# Unsummarized turns per summary call; a pass keeps making calls until it is caught up
+SUMMARY_BATCH_TURNS = 20
+
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """Cheap token estimate (~4 characters per token for English with llama tokenizers)."""
+    if not text:
+        return 0
+    return len(text) // 4 + 1
+
+
+def _turn_tokens(turn):
+    # A few extra tokens per message for the role/formatting overhead
+    return count_tokens(turn["message"]) + count_tokens(turn["response"]) + 8
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def related_excerpts(db, user_id, conv_id, user_msg):
+    """System message with the user's earlier exchanges (from other chats) that resemble user_msg, or None."""
+    if not RETRIEVAL_ENABLED or user_id is None:
+        return None
+    try:
+        related = retrieval_index.related(db, user_id, user_msg, exclude_conversation=conv_id)
+    except Exception as e:  # memory is a nice-to-have; never let it fail a chat
+        print(f"⚠️ Retrieval for user {user_id} failed: {e}")
+        return None
+    if not related:
+        return None
+    excerpts = "\n\n".join(f"Student: {_clip(r['message'], SNIPPET_MESSAGE_CHARS)}\n"
+                            f"Assistant: {_clip(r['response'], SNIPPET_RESPONSE_CHARS)}" for r in related)
+    return {"role": "system", "content": "Excerpts from the student's earlier conversations that may be relevant. "
+                                         f"Use them only if they help with the new question:\n{excerpts}"}
+
+
+def build_chat_messages(db, conv_id, user_msg, user_id=None):
+    """Builds the Groq message list for a new turn within the token budget.
+
+    The prompt is: rolling summary of older turns (as a system message), excerpts of related exchanges
+    from the user's other conversations, then the most recent turns verbatim, then the new user message.
+    Turns older than the last RECENT_TURNS are folded into the summary in the background, so the prompt
+    size stays flat however long the chat gets; until then they are kept verbatim as far as the budget allows.
+    """
+    excerpts = related_excerpts(db, user_id, conv_id, user_msg)
+    summary_row = db.execute("SELECT summary, summarized_through_id FROM conversation_summaries WHERE conversation_id = ?",
+                             (conv_id,)).fetchone()
+    summary = summary_row["summary"] if summary_row else ""
+    summarized_through_id = summary_row["summarized_through_id"] if summary_row else 0
+
+    budget = CONTEXT_TOKEN_BUDGET - count_tokens(summary) - count_tokens(user_msg)
+    if excerpts:
+        budget -= count_tokens(excerpts["content"])
+
+    # Newest first, every turn the summary doesn't cover yet; rows are read only until the budget runs out
+    unsummarized = db.execute("SELECT id, message, response FROM messages WHERE conversation_id = ? AND id > ? ORDER BY id DESC",
+                              (conv_id, summarized_through_id))
+    kept = []
+    older_left = False
+    for turn in unsummarized:
+        cost = _turn_tokens(turn)
+        if kept and cost > budget:
+            older_left = True
+            break
+        kept.append(turn)
+        budget -= cost
+    unsummarized.close()
+
+    window = kept[:RECENT_TURNS]
+    if older_left or len(kept) > len(window):
+        # Everything before the recent window belongs in the summary
+        schedule_summary_update(conv_id, window[-1]["id"] - 1)
+    kept.reverse()
+
+    messages_for_groq = []
+    if summary:
+        messages_for_groq.append({"role": "system", "content": f"Summary of the earlier part of this conversation:\n{summary}"})
+    if excerpts:
+        messages_for_groq.append(excerpts)
+    for turn in kept:
+        messages_for_groq.append({"role": "user", "content": turn["message"]})
+        messages_for_groq.append({"role": "assistant", "content": turn["response"]})
+    messages_for_groq.append({"role": "user", "content": user_msg})
+    return messages_for_groq
+
+
+def schedule_summary_update(conv_id, through_id):
+    """Queues a background pass that folds turns up to through_id into the conversation summary."""
+    with _summarizing_lock:
+        if conv_id in _summarizing:
+            return  # a pass is already running for this chat; the next turn will pick up anything newer
+        _summarizing.add(conv_id)
+    _summary_executor.submit(_update_summary, conv_id, through_id)
+
+
+def _update_summary(conv_id, through_id):
+    """Folds the turns up to through_id into the summary, SUMMARY_BATCH_TURNS per LLM call, until caught up."""
+    conn = connect_db()
+    try:
+        while True:
+            row = conn.execute("SELECT summary, summarized_through_id FROM conversation_summaries WHERE conversation_id = ?",
+                               (conv_id,)).fetchone()
+            summary = row["summary"] if row else ""
+            start_id = row["summarized_through_id"] if row else 0
+
+            turns = conn.execute("SELECT id, message, response FROM messages WHERE conversation_id = ? AND id > ? AND id <= ? ORDER BY id ASC LIMIT ?",
+                                 (conv_id, start_id, through_id, SUMMARY_BATCH_TURNS)).fetchall()
+            if not turns:
+                return
+
+            transcript = "\n".join(f"user: {t['message']}\nassistant: {t['response']}" for t in turns)
+            prompt = (
+                "You maintain a running summary of a tutoring conversation so it can be continued without the full transcript. "
+                "Update the summary with the new exchanges below. Keep every topic, definition, decision, code detail and open question "
+                "the student may refer back to; drop greetings and small talk. Write plain text, at most 300 words.\n\n"
+                f"Current summary:\n{summary or '(none yet)'}\n\n"
+                f"New exchanges:\n{transcript}"
+            )
+            new_summary = ask_groq([{"role": "user", "content": prompt}], task="context", cache=False)  # never repeats
+            if new_summary in LLM_ERROR_MESSAGES:
+                print(f"⚠️ Summary update for conversation {conv_id} failed: {new_summary}")
+                return  # the turns stay in the prompt; the next chat turn schedules another pass
+
+            conn.execute(
+                """
+                INSERT INTO conversation_summaries (conversation_id, summary, summarized_through_id, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(conversation_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    summarized_through_id = excluded.summarized_through_id,
+                    updated_at = excluded.updated_at
+                """, (conv_id, new_summary.strip(), turns[-1]["id"])
+            )
+            conn.commit()
+            print(f"📝 Folded {len(turns)} turns into the summary of conversation {conv_id}")
+    except Exception as e:
+        print(f"Error updating summary for conversation {conv_id}: {e}")
+    finally:
+        conn.close()
+        with _summarizing_lock:
+            _summarizing.discard(conv_id)
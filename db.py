@@ -1,23 +1,291 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
 from flask import g
 # --- Database Functions ---
 DATABASE = "chat.db"
 
+# --- Connection Settings ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))           # idle connections kept for reuse
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))  # page cache per connection
+DB_CACHED_STATEMENTS = 512
+# A write slower than this is counted as having waited on the write lock
+LOCK_WAIT_THRESHOLD = 0.05  # seconds
+
+# --- Schema Migrations ---
+# Applied in order, each exactly once; PRAGMA user_version records the last one that ran.
+# Never edit a migration that has shipped - add a new one instead.
+# Version 1 is schema.sql itself (all IF NOT EXISTS, so it is safe on databases created before migrations existed).
+MIGRATIONS = [
+    (1, "base schema", None),
+    (2, "conversation list indexes and denormalized counters", """
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp ON messages (conversation_id, timestamp);
+
+        ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE conversations ADD COLUMN last_message_at DATETIME;
+        ALTER TABLE conversations ADD COLUMN preview TEXT; -- start of the first message
+
+        UPDATE conversations SET
+            message_count = (SELECT COUNT(*) FROM messages WHERE conversation_id = conversations.id),
+            last_message_at = (SELECT MAX(timestamp) FROM messages WHERE conversation_id = conversations.id),
+            preview = (SELECT substr(message, 1, 200) FROM messages WHERE conversation_id = conversations.id
+                       ORDER BY timestamp ASC, id ASC LIMIT 1);
+
+        -- get_conversations only lists chats that have messages, newest first: one range scan of this index
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_recent
+            ON conversations (user_id, last_message_at DESC) WHERE message_count > 0;
+
+        CREATE TRIGGER IF NOT EXISTS messages_counters_after_insert AFTER INSERT ON messages
+        BEGIN
+            UPDATE conversations SET
+                message_count = message_count + 1,
+                last_message_at = NEW.timestamp,
+                preview = COALESCE(preview, substr(NEW.message, 1, 200))
+            WHERE id = NEW.conversation_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS messages_counters_after_delete AFTER DELETE ON messages
+        BEGIN
+            UPDATE conversations SET
+                message_count = message_count - 1,
+                last_message_at = (SELECT MAX(timestamp) FROM messages WHERE conversation_id = OLD.conversation_id)
+            WHERE id = OLD.conversation_id;
+        END;
+    """),
+    (3, "keyset pagination index for conversation history", """
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id, id);
+    """),
+    (4, "index for sweeping empty conversations", """
+        CREATE INDEX IF NOT EXISTS idx_conversations_empty ON conversations (timestamp) WHERE message_count = 0;
+    """),
+    (5, "remember-me token lookups", """
+        -- token itself is UNIQUE (and so already indexed); these serve bulk revocation and the expiry purge
+        CREATE INDEX IF NOT EXISTS idx_remember_tokens_user ON remember_tokens (user_id);
+        CREATE INDEX IF NOT EXISTS idx_remember_tokens_expires ON remember_tokens (expires_at);
+    """),
+    (6, "coalescing of identical in-flight export jobs", """
+        ALTER TABLE jobs ADD COLUMN dedupe_key TEXT; -- hash of (user, kind, history, format); NULL = never coalesced
+        -- At most one queued/running job per key, across every worker process
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_inflight_dedupe ON jobs (dedupe_key)
+            WHERE status IN ('queued', 'running');
+    """),
+    (7, "full-text search over messages", """
+        -- What the search index reads back for snippets. owner tags every row with its user, so a search
+        -- only walks that user's postings instead of filtering everyone's matches afterwards
+        CREATE VIEW IF NOT EXISTS messages_search_source AS
+            SELECT id, message, response, 'u' || user_id AS owner FROM messages;
+
+        -- External content: the text itself stays in messages, the index only holds postings
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message, response, owner,
+            content='messages_search_source', content_rowid='id',
+            tokenize='porter unicode61 remove_diacritics 2'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS messages_fts_after_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, message, response, owner)
+            VALUES (NEW.id, NEW.message, NEW.response, 'u' || NEW.user_id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS messages_fts_after_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message, response, owner)
+            VALUES ('delete', OLD.id, OLD.message, OLD.response, 'u' || OLD.user_id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS messages_fts_after_update AFTER UPDATE OF message, response, user_id ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message, response, owner)
+            VALUES ('delete', OLD.id, OLD.message, OLD.response, 'u' || OLD.user_id);
+            INSERT INTO messages_fts (rowid, message, response, owner)
+            VALUES (NEW.id, NEW.message, NEW.response, 'u' || NEW.user_id);
+        END;
+
+        -- Backfill: index every message stored before this migration
+        INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+    """),
+    (8, "retrieval vectors for long-term memory", """
+        -- Hashed term vector of each exchange (float32 x retrieval.RETRIEVAL_DIM), written with the message.
+        -- Messages stored before this migration are vectorized lazily by retrieval.py on first lookup.
+        CREATE TABLE IF NOT EXISTS message_vectors (
+            message_id INTEGER PRIMARY KEY,
+            vector BLOB NOT NULL,
+            FOREIGN KEY (message_id) REFERENCES messages(id) ON DELETE CASCADE
+        );
+        -- Loading (and catching up on) one user's messages in id order
+        CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id);
+    """),
+]
+
+def _split_sql(script):
+    """Splits a SQL script into single statements (trigger bodies included) for use inside a transaction."""
+    statements, current = [], ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ""
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+def migrate(database=None):
+    """Brings the database up to the latest migration. Safe to call from several processes at once."""
+    conn = sqlite3.connect(database or DATABASE, isolation_level=None)
+    try:
+        for version, description, sql in MIGRATIONS:
+            if sql is None:
+                # Assuming schema.sql exists and is correctly defined
+                with open("schema.sql", "r") as f:
+                    sql = f.read()
+            # BEGIN IMMEDIATE takes the write lock, so only one process applies each migration
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                for statement in _split_sql(sql):
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.execute("COMMIT")
+                print(f"🗃️ Applied migration {version}: {description}")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+
 def init_db():
-    if not os.path.exists(DATABASE):
-        with sqlite3.connect(DATABASE) as conn:
-            # Assuming schema.sql exists and is correctly defined
-            with open("schema.sql", "r") as f:
-                conn.executescript(f.read())
+    migrate()
+    # WAL is a property of the database file, so it only needs setting once; readers then never block the writer
+    with sqlite3.connect(DATABASE) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+
+# --- Connections ---
+_lock_stats = {"lock_waits": 0, "lock_wait_seconds": 0.0, "locked_errors": 0}
+_lock_stats_lock = threading.Lock()
+_WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLAC", "BEGIN")
+
+def _record_write(elapsed, locked=False):
+    if elapsed < LOCK_WAIT_THRESHOLD and not locked:
+        return
+    with _lock_stats_lock:
+        if locked:
+            _lock_stats["locked_errors"] += 1
+        else:
+            _lock_stats["lock_waits"] += 1
+            _lock_stats["lock_wait_seconds"] += elapsed
+
+class TrackedConnection(sqlite3.Connection):
+    """sqlite3 connection that notes writes that had to wait for the database write lock."""
+    def execute(self, sql, parameters=()):
+        if not sql.lstrip()[:6].upper().startswith(_WRITE_PREFIXES):
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        locked = False
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            locked = "locked" in str(e)
+            raise
+        finally:
+            _record_write(time.perf_counter() - start, locked)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _record_write(time.perf_counter() - start)
+
+def connect_db():
+    """Opens a new tuned connection. Request handlers use get_db(); this is for background threads."""
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT_MS / 1000, factory=TrackedConnection,
+                           cached_statements=DB_CACHED_STATEMENTS, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")  # safe with WAL; commits no longer fsync every time
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+class ConnectionPool:
+    """Keeps tuned connections open between requests instead of reconnecting for every one."""
+    def __init__(self, size):
+        self._idle = queue.LifoQueue(maxsize=size)  # LIFO so the warmest connection is reused first
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "reused": 0, "closed": 0, "in_use": 0}
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = connect_db()
+            reused = False
+        with self._lock:
+            self._stats["reused" if reused else "opened"] += 1
+            self._stats["in_use"] += 1
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            self._stats["in_use"] -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # never hand the next request a half-finished transaction
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+            with self._lock:
+                self._stats["closed"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["idle"] = self._idle.qsize()
+        with _lock_stats_lock:
+            stats.update(_lock_stats)
+        return stats
+
+pool = ConnectionPool(DB_POOL_SIZE)
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        g.db = pool.acquire()
     return g.db
 
 def close_db(e=None):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        pool.release(db)
+
+def iter_conversation_history(conn, conversation_id, from_id=None, to_id=None, batch_size=500):
+    """Yields {"message", "response"} dicts for a conversation in order, fetching rows in batches.
+
+    from_id / to_id optionally limit it to an inclusive range of message ids.
+    """
+    query = "SELECT id, message, response FROM messages WHERE conversation_id = ?"
+    args = [conversation_id]
+    if from_id is not None:
+        query += " AND id >= ?"
+        args.append(from_id)
+    if to_id is not None:
+        query += " AND id <= ?"
+        args.append(to_id)
+    query += " ORDER BY id ASC"
+
+    cursor = conn.execute(query, args)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield {"message": row["message"], "response": row["response"]}
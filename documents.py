@@ -0,0 +1,127 @@
+import csv
+import io
+import re
+from collections import namedtuple
+
+# --- Export Document Model ---
+# LLM output for summaries and flashcards is parsed once into this structure; every output format
+# (PDF, HTML, Markdown, CSV/TSV) renders from it instead of re-scanning the raw text.
+Document = namedtuple("Document", "topics")
+Topic = namedtuple("Topic", "title sections cards")  # title is "" for text before the first === heading
+Section = namedtuple("Section", "label lines")       # label is None for text outside a labelled section
+Card = namedtuple("Card", "question answer")
+
+SECTION_LABELS = ("Explanation", "Examples / Applications", "Tips / Mnemonics")
+
+# One pattern per line decides what the line is; the named group that matched says which kind
+_LINE = re.compile(r"""
+      ^===\s*(?P<topic>.+?)\s*===$
+    | ^(?P<label>Explanation|Examples\s*/\s*Applications|Tips\s*/\s*Mnemonics)\s*[:：]?\s*(?P<label_text>.*)$
+    | ^Q:\s*(?P<question>.*)$
+    | ^A:\s*(?P<answer>.*)$
+""", re.IGNORECASE | re.VERBOSE)
+# **bold**, _italic_ (not the underscores inside snake_case names), `code`
+_INLINE_MARKUP = re.compile(r"\*\*(.*?)\*\*|(?<!\w)_(.+?)_(?!\w)|`(.*?)`")
+_BULLET = re.compile(r"^[*\-•]+\s*")
+_SPACES = re.compile(r"\s{2,}")
+_CANONICAL_LABELS = {re.sub(r"\s+", "", label.lower()): label for label in SECTION_LABELS}
+
+
+def _strip_markup(line):
+    return _INLINE_MARKUP.sub(lambda m: m.group(1) or m.group(2) or m.group(3) or "", line)
+
+
+def parse_document(text):
+    """Parses summary or flashcard text into a Document in a single pass over its lines."""
+    topics = []
+    by_title = {}
+    seen_lines = set()
+    topic = section = question = None
+
+    def current_topic():
+        nonlocal topic
+        if topic is None:
+            topic = Topic("", [], [])
+            topics.append(topic)
+        return topic
+
+    for raw_line in text.splitlines():
+        line = _strip_markup(raw_line).strip()
+        if not line:
+            continue
+        match = _LINE.match(line)
+        kind = match.lastgroup if match else None
+        if kind == "label_text":  # lastgroup is the last group that took part; the label line has both
+            kind = "label"
+
+        if kind == "topic":
+            title = match.group("topic")
+            topic = by_title.get(title.lower())
+            if topic is None:
+                topic = by_title[title.lower()] = Topic(title, [], [])
+                topics.append(topic)
+            section = question = None
+        elif kind == "label":
+            label = _CANONICAL_LABELS.get(re.sub(r"\s+", "", match.group("label").lower()), match.group("label"))
+            owner = current_topic()
+            # The model sometimes repeats a heading; keep adding to the section it already opened
+            section = next((s for s in owner.sections if s.label == label), None)
+            if section is None:
+                section = Section(label, [])
+                owner.sections.append(section)
+            if match.group("label_text"):
+                section.lines.append(match.group("label_text"))
+        elif kind == "question":
+            question = match.group("question")
+        elif kind == "answer":
+            if question is not None:
+                current_topic().cards.append(Card(question, match.group("answer")))
+                question = None
+        else:
+            if line in seen_lines:
+                continue  # the model occasionally repeats whole lines
+            seen_lines.add(line)
+            if section is None:
+                section = Section(None, [])
+                current_topic().sections.append(section)
+            section.lines.append(_SPACES.sub(" ", _BULLET.sub("• ", line)))
+
+    return Document(topics)
+
+
+# --- Text Renderers ---
+def render_markdown(document, title):
+    """Markdown with a heading per topic; flashcards become bold questions with their answers."""
+    out = [f"# {title}", ""]
+    for topic in document.topics:
+        if topic.title:
+            out += [f"## {topic.title}", ""]
+        for section in topic.sections:
+            if section.label:
+                out += [f"### {section.label}", ""]
+            out += [line.replace("• ", "- ", 1) if line.startswith("• ") else line for line in section.lines]
+            out.append("")
+        for card in topic.cards:
+            out += [f"**Q:** {card.question}", "", f"**A:** {card.answer}", ""]
+    return "\n".join(out).encode("utf-8")
+
+
+def _render_delimited(document, delimiter, separator_name):
+    """Anki-importable rows: front, back, tags (the topic, with spaces replaced since Anki tags can't contain them)."""
+    buffer = io.StringIO()
+    # Anki reads these header lines to set up the import without asking
+    buffer.write(f"#separator:{separator_name}\n#html:false\n#tags column:3\n")
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\n")
+    for topic in document.topics:
+        tag = re.sub(r"\s+", "_", topic.title.strip())
+        for card in topic.cards:
+            writer.writerow([card.question, card.answer, tag])
+    return buffer.getvalue().encode("utf-8")
+
+
+def render_csv(document):
+    return _render_delimited(document, ",", "Comma")
+
+
+def render_tsv(document):
+    return _render_delimited(document, "\t", "Tab")
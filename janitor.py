@@ -0,0 +1,113 @@
+import heapq
+import os
+import shutil
+import threading
+import time
+
+
+class FileJanitor:
+    """Deletes downloaded files when they expire, from one thread and a heap of expiry times.
+
+    Also keeps the directory under max_bytes by removing the oldest entries first, and on start()
+    clears out whatever a previous process left behind. An entry is a file or a directory (removed whole).
+    """
+    def __init__(self, directory, ttl, max_bytes, name="file-janitor"):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.name = name
+        self._heap = []    # (expires_at, path); entries for paths already removed are skipped when popped
+        self._sizes = {}   # path -> size for entries still on disk
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._removed = {"expired": 0, "over_cap": 0, "startup": 0}
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sweep_leftovers()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _sweep_leftovers(self):
+        """Removes expired entries from earlier runs and adopts recent ones (another process may still be serving them)."""
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if mtime + self.ttl <= now:
+                self._delete(entry.path, "startup")
+            else:
+                self.track(entry.path, expires_in=mtime + self.ttl - now)
+        if self._removed["startup"]:
+            print(f"🧹 Removed {self._removed['startup']} old file(s) from {self.directory}")
+
+    def track(self, path, expires_in=None):
+        """Schedules path for deletion after the TTL, evicting the oldest entries if the cap is exceeded."""
+        size = _size_of(path)
+        expires_at = time.monotonic() + (self.ttl if expires_in is None else expires_in)
+        with self._cond:
+            heapq.heappush(self._heap, (expires_at, path))
+            self._sizes[path] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._heap:
+                _, oldest = heapq.heappop(self._heap)
+                if oldest == path:  # never evict the entry we were just asked to keep
+                    heapq.heappush(self._heap, (expires_at, path))
+                    break
+                self._forget_and_delete(oldest, "over_cap")
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                expires_at, path = self._heap[0]
+                delay = expires_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)  # woken early if a sooner entry is tracked
+                    continue
+                heapq.heappop(self._heap)
+                self._forget_and_delete(path, "expired")
+
+    def _forget_and_delete(self, path, reason):
+        size = self._sizes.pop(path, None)
+        if size is None:
+            return  # already removed
+        self._bytes -= size
+        self._delete(path, reason)
+
+    def _delete(self, path, reason):
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            self._removed[reason] += 1
+        except FileNotFoundError:
+            pass  # another process got there first
+        except OSError as e:
+            print(f"Error deleting {path}: {e}")
+
+    def stats(self):
+        with self._cond:
+            return {"pending": len(self._sizes), "bytes": self._bytes,
+                    "removed": dict(self._removed)}
+
+
+def _size_of(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
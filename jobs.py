@@ -0,0 +1,190 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from db import connect_db
+from maintenance import run_periodically
+
+# --- Background Job Settings ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# New jobs are refused once this many are waiting or running, instead of piling up forever
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", "50"))
+# A 'running' job is leased: the process running it renews updated_at every JOB_HEARTBEAT_SECONDS.
+# Once JOB_LEASE_SECONDS pass without a renewal its worker is gone (a crash or restart mid-render)
+# and the job is queued again.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_SECONDS = max(1, JOB_LEASE_SECONDS // 4)
+
+_handlers = {}
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="jobs")
+_running = set()  # ids of the jobs this process is running, whose leases the heartbeat renews
+_running_lock = threading.Lock()
+_counters = {"coalesced": 0, "reclaimed": 0}
+_counters_lock = threading.Lock()
+
+
+def register_handler(kind, fn):
+    """fn(params, progress) does the work and returns a JSON-able result dict.
+
+    progress(percent, message) may be called along the way; raising marks the job as failed.
+    """
+    _handlers[kind] = fn
+
+
+def _inflight_job(db, dedupe_key):
+    row = db.execute("SELECT id, status, updated_at < datetime('now', ?) AS lease_expired FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                     (_lease_expired(), dedupe_key)).fetchone()
+    if row is None:
+        return None
+    if row["status"] == "running" and row["lease_expired"]:
+        # Nobody is working on it any more: take it over (or find that another process just did) rather than
+        # pile more requests onto a job that would never finish
+        _reclaim(db, row["id"])
+    with _counters_lock:
+        _counters["coalesced"] += 1
+    print(f"🔗 Coalesced a duplicate request into job {row['id']}")
+    return row["id"]
+
+
+def submit_job(db, user_id, kind, params, dedupe_key=None):
+    """Persists a queued job and hands it to the worker pool. Returns the job id, or None if the queue is full.
+
+    If a job with the same dedupe_key is still queued or running, its id is returned instead, so
+    identical requests (a double click, two tabs) share one computation and one result. A running job
+    whose lease has expired is queued again first, so it is only ever shared with a live worker.
+    """
+    if dedupe_key:
+        job_id = _inflight_job(db, dedupe_key)
+        if job_id:
+            return job_id
+
+    pending = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+    if pending >= MAX_PENDING_JOBS:
+        return None
+
+    job_id = secrets.token_hex(16)
+    try:
+        db.execute("INSERT INTO jobs (id, user_id, kind, params, status, progress, message, dedupe_key) VALUES (?, ?, ?, ?, 'queued', 0, 'Queued', ?)",
+                   (job_id, user_id, kind, json.dumps(params), dedupe_key))
+        db.commit()
+    except sqlite3.IntegrityError:
+        # An identical request (maybe in another worker) inserted its job between our check and insert
+        db.rollback()
+        return _inflight_job(db, dedupe_key) or submit_job(db, user_id, kind, params)
+    _executor.submit(_run_job, job_id)
+    return job_id
+
+
+def job_stats():
+    with _counters_lock:
+        return dict(_counters)
+
+
+def get_job(db, job_id, user_id):
+    """The job as a dict for the API, or None if it doesn't exist or belongs to someone else."""
+    row = db.execute("SELECT id, kind, status, progress, message, result, error FROM jobs WHERE id = ? AND user_id = ?",
+                     (job_id, user_id)).fetchone()
+    if not row:
+        return None
+    job = {"job_id": row["id"], "kind": row["kind"], "status": row["status"],
+           "progress": row["progress"], "message": row["message"]}
+    if row["status"] == "done" and row["result"]:
+        job.update(json.loads(row["result"]))
+    if row["status"] == "failed":
+        job["error"] = row["error"]
+    return job
+
+
+def _lease_expired():
+    return f"-{JOB_LEASE_SECONDS} seconds"
+
+
+def _reclaim(db, job_id):
+    """Queues a running job whose lease has run out again and runs it here; False if another process got it first."""
+    claimed = db.execute("UPDATE jobs SET status = 'queued', message = 'Restarting...' WHERE id = ? AND status = 'running' AND updated_at < datetime('now', ?)",
+                         (job_id, _lease_expired())).rowcount
+    db.commit()
+    if claimed:
+        with _counters_lock:
+            _counters["reclaimed"] += 1
+        _executor.submit(_run_job, job_id)
+    return bool(claimed)
+
+
+def renew_and_reclaim_jobs():
+    """Renews the leases of this process's running jobs, then takes over any whose worker has died."""
+    with _running_lock:
+        running = list(_running)
+    conn = connect_db()
+    try:
+        if running:
+            conn.execute(f"UPDATE jobs SET updated_at = CURRENT_TIMESTAMP WHERE status = 'running' AND id IN ({','.join('?' * len(running))})",
+                         running)
+            conn.commit()
+        expired = conn.execute("SELECT id FROM jobs WHERE status = 'running' AND updated_at < datetime('now', ?)",
+                               (_lease_expired(),)).fetchall()
+        reclaimed = sum(_reclaim(conn, row["id"]) for row in expired)
+    finally:
+        conn.close()
+    if reclaimed:
+        print(f"🔁 Re-queued {reclaimed} job(s) whose worker stopped mid-run")
+
+
+def resume_pending_jobs():
+    """Called at startup: re-queues work that was waiting when the process stopped, and starts the lease
+    heartbeat, which also takes over jobs that were mid-run once their leases run out."""
+    conn = connect_db()
+    try:
+        # Finished jobs only need to live long enough for the UI to collect the result
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < datetime('now', '-1 day')")
+        conn.commit()
+        queued = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at ASC").fetchall()
+    finally:
+        conn.close()
+
+    for row in queued:
+        _executor.submit(_run_job, row["id"])
+    if queued:
+        print(f"🔁 Resumed {len(queued)} queued job(s)")
+    run_periodically("job-lease-heartbeat", JOB_HEARTBEAT_SECONDS, renew_and_reclaim_jobs)
+
+
+def _run_job(job_id):
+    conn = connect_db()
+    try:
+        # Claim the job; if another worker (or process) got there first, leave it alone
+        claimed = conn.execute("UPDATE jobs SET status = 'running', message = 'Starting...', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'queued'",
+                               (job_id,)).rowcount
+        conn.commit()
+        if not claimed:
+            return
+        with _running_lock:
+            _running.add(job_id)
+        row = conn.execute("SELECT kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        def progress(percent, message):
+            conn.execute("UPDATE jobs SET progress = ?, message = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                         (percent, message, job_id))
+            conn.commit()
+
+        try:
+            handler = _handlers[row["kind"]]
+            result = handler(json.loads(row["params"]), progress)
+        except Exception as e:
+            print(f"Job {job_id} ({row['kind']}) failed: {e}")
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, message = 'Failed', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                         (str(e), job_id))
+            conn.commit()
+            return
+
+        conn.execute("UPDATE jobs SET status = 'done', progress = 100, message = 'Done', result = ?, params = '{}', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                     (json.dumps(result), job_id))
+        conn.commit()
+    except Exception as e:
+        print(f"Error running job {job_id}: {e}")
+    finally:
+        with _running_lock:
+            _running.discard(job_id)
+        conn.close()
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from db import connect_db
+
+# --- Housekeeping Settings ---
+EMPTY_CONVERSATION_MAX_AGE_HOURS = int(os.getenv("EMPTY_CONVERSATION_MAX_AGE_HOURS", "24"))
+EMPTY_CONVERSATION_SWEEP_INTERVAL = int(os.getenv("EMPTY_CONVERSATION_SWEEP_INTERVAL", "3600"))  # seconds
+SWEEP_BATCH_SIZE = 500
+REMEMBER_TOKEN_PURGE_INTERVAL = int(os.getenv("REMEMBER_TOKEN_PURGE_INTERVAL", "3600"))  # seconds
+
+
+def run_periodically(name, interval, fn):
+    """Runs fn() every `interval` seconds on one daemon thread; errors are logged, not fatal."""
+    def _loop():
+        while True:
+            try:
+                fn()
+            except Exception as e:
+                print(f"⚠️ {name} failed: {e}")
+            time.sleep(interval)
+    thread = threading.Thread(target=_loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def sweep_empty_conversations(max_age_hours=EMPTY_CONVERSATION_MAX_AGE_HOURS, batch_size=SWEEP_BATCH_SIZE):
+    """Deletes conversations that never got a message, in small batches so writers aren't blocked for long."""
+    conn = connect_db()
+    removed = 0
+    try:
+        while True:
+            deleted = conn.execute(
+                """
+                DELETE FROM conversations WHERE id IN (
+                    SELECT id FROM conversations
+                    WHERE message_count = 0 AND timestamp < datetime('now', ?)
+                    LIMIT ?
+                )
+                """, (f"-{max_age_hours} hours", batch_size)
+            ).rowcount
+            conn.commit()
+            removed += deleted
+            if deleted < batch_size:
+                break
+    finally:
+        conn.close()
+    if removed:
+        print(f"🧹 Removed {removed} empty conversation(s)")
+    return removed
+
+
+def purge_expired_remember_tokens(batch_size=SWEEP_BATCH_SIZE):
+    """Deletes expired remember-me tokens in batches, walking idx_remember_tokens_expires."""
+    conn = connect_db()
+    removed = 0
+    try:
+        while True:
+            deleted = conn.execute(
+                """
+                DELETE FROM remember_tokens WHERE id IN (
+                    SELECT id FROM remember_tokens WHERE expires_at <= datetime('now') LIMIT ?
+                )
+                """, (batch_size,)
+            ).rowcount
+            conn.commit()
+            removed += deleted
+            if deleted < batch_size:
+                break
+    finally:
+        conn.close()
+    if removed:
+        print(f"🧹 Purged {removed} expired remember-me token(s)")
+    return removed
+
+
+def start_background_maintenance():
+    run_periodically("empty-conversation-sweeper", EMPTY_CONVERSATION_SWEEP_INTERVAL, sweep_empty_conversations)
+    run_periodically("remember-token-purge", REMEMBER_TOKEN_PURGE_INTERVAL, purge_expired_remember_tokens)
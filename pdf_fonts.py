@@ -0,0 +1,131 @@
+import copy
+import io
+import threading
+from fontTools import ttLib
+from fpdf import FPDF
+try:  # fpdf2 internals the shared-template path relies on (the version tested is pinned in requirements.txt)
+    from fpdf.fonts import TTFFont, SubsetMap
+    from fpdf.font_type_3 import get_color_font_object
+except ImportError:
+    TTFFont = None  # every PDF parses the fonts itself with add_font()
+
+# --- PDF Font Registry ---
+# FPDF.add_font re-reads the TTF and rebuilds its width/glyph tables (~50 ms per face) for every
+# document. The registry does that once per process and hands each new PDF a cheap copy that shares
+# the parsed tables; only per-document state (glyph subset, font number, the fontTools handle that
+# output() subsets in place) is made fresh.
+# The file is also slimmed once at warm-up: output() re-reads it for every document, and tables it
+# would drop anyway (or never embeds, like glyph names) only cost parse time there.
+FONT_FAMILY = "DejaVuSans"
+FONT_FILES = {"": "DejaVuSans.ttf", "B": "DejaVuSans-Bold.ttf"}
+FALLBACK_FAMILY = "Helvetica"
+# fpdf drops the first six when embedding; PDF text is positioned explicitly, so kerning data is never used
+UNUSED_TABLES = ["FFTM", "GDEF", "GPOS", "GSUB", "MATH", "hdmx", "kern"]
+KEPT_CMAPS = {(3, 1), (3, 10)}  # Windows Unicode BMP / full repertoire; the other subtables duplicate them
+
+
+def _slim_font(data):
+    """Returns the TTF bytes without the tables, cmap subtables and glyph names a PDF export never uses."""
+    font = ttLib.TTFont(io.BytesIO(data), recalcTimestamp=False)
+    for tag in UNUSED_TABLES:
+        if tag in font:
+            del font[tag]
+    font["post"].formatType = 3.0
+    subtables = [t for t in font["cmap"].tables if (t.platformID, t.platEncID) in KEPT_CMAPS]
+    if subtables:
+        font["cmap"].tables = subtables
+    out = io.BytesIO()
+    font.save(out)
+    return out.getvalue()
+
+
+def _decode_shared_tables(ttfont):
+    """Decodes the tables install() copies, while warm_up() holds the lock: fontTools decodes lazily
+    on first access, and two exports doing that at once on the shared template can break each other."""
+    ttfont["hmtx"].metrics
+    for subtable in ttfont["cmap"].tables:
+        subtable.cmap
+
+
+def _copy_parsed_tables(source, target):
+    """Gives target its own copies of the already-decoded metrics and cmap tables.
+
+    The fontTools subsetter replaces the dicts inside these tables rather than editing them, so copying
+    the containers is enough; glyf is left to load lazily, since its glyph objects are modified in place.
+    """
+    hmtx = copy.copy(source["hmtx"])
+    hmtx.metrics = dict(hmtx.metrics)
+    cmap = copy.copy(source["cmap"])
+    cmap.tables = []
+    for subtable in source["cmap"].tables:
+        copied = copy.copy(subtable)
+        copied.cmap = dict(subtable.cmap)
+        cmap.tables.append(copied)
+    target["hmtx"] = hmtx
+    target["cmap"] = cmap
+
+
+class FontRegistry:
+    def __init__(self, family, files):
+        self.family = family
+        self.files = files
+        self._templates = None  # fontkey -> (style, parsed TTFFont, raw file bytes); {} if the fonts are missing
+        self._shared = TTFFont is not None  # False: hand out fonts with plain add_font() instead
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """Parses the font files (once). Returns True if they are usable, False to fall back to a core font."""
+        with self._lock:
+            if self._templates is None:
+                self._templates = {}
+                scratch = FPDF()
+                try:
+                    for style, path in self.files.items():
+                        with open(path, "rb") as f:
+                            data = f.read()
+                        fontkey = f"{self.family.lower()}{style}"
+                        template = None
+                        if self._shared:
+                            data = _slim_font(data)
+                            template = TTFFont(scratch, io.BytesIO(data), fontkey, style)
+                            _decode_shared_tables(template.ttfont)
+                        self._templates[fontkey] = (style, template, data)
+                    print(f"🔤 Loaded PDF fonts: {', '.join(self.files.values())}")
+                except (OSError, RuntimeError) as e:
+                    print(f"Warning: DejaVu fonts not usable ({e}). Falling back to {FALLBACK_FAMILY}.")
+                    self._templates = {}
+            return bool(self._templates)
+
+    def install(self, pdf):
+        """Adds the registered fonts to pdf and returns the family name to use with set_font()."""
+        if not self.warm_up():
+            return FALLBACK_FAMILY
+        for fontkey, (style, template, data) in self._templates.items():
+            if fontkey in pdf.fonts:
+                continue
+            if self._shared:
+                try:
+                    pdf.fonts[fontkey] = self._copy_font(pdf, template, data)
+                    continue
+                except AttributeError as e:  # an fpdf2 release whose TTFFont no longer looks like this
+                    print(f"⚠️ Shared PDF fonts unsupported by this fpdf2 ({e}); using add_font() from now on.")
+                    self._shared = False
+            pdf.add_font(self.family, style, self.files[style])
+        return self.family
+
+    def _copy_font(self, pdf, template, data):
+        font = copy.copy(template)  # shares cw / cmap / glyph_ids / descriptor with the template
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = ttLib.TTFont(io.BytesIO(data), recalcTimestamp=False, lazy=True)
+        font.ttfont.setGlyphOrder(list(template.ttfont.getGlyphOrder()))  # skip rebuilding glyph names
+        _copy_parsed_tables(template.ttfont, font.ttfont)
+        font._hbfont = None
+        font.biggest_size_pt = 0
+        font.missing_glyphs = []
+        font.subset = SubsetMap(font)
+        if template.color_font is not None:  # colour glyph data is tied to its document
+            font.color_font = get_color_font_object(pdf, font, font.palette_index)
+        return font
+
+
+font_registry = FontRegistry(FONT_FAMILY, FONT_FILES)
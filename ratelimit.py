@@ -0,0 +1,174 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# --- Outbound LLM Rate Limiting ---
+# Groq limits requests and tokens per minute per model. Instead of every worker finding that out from
+# its own 429s, all processes draw from shared token buckets - one for requests, one for tokens, per
+# provider and model - kept in a small SQLite file. The buckets are per-minute: they start from the
+# settings below (Groq's free-tier limits; set your plan's) and adopt any per-minute limit the
+# x-ratelimit-* headers report. A longer window in the headers (Groq's requests per day) only caps what is
+# left, never the burst size.
+RATE_LIMIT_ENABLED = os.getenv("LLM_RATE_LIMIT", "1") == "1"
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "ratelimit.db")  # separate from chat.db so its locks never block chats
+DEFAULT_RPM = float(os.getenv("GROQ_RPM", "30"))
+DEFAULT_TPM = float(os.getenv("GROQ_TPM", "12000"))
+MAX_BURST_WINDOW = 120  # seconds; a header limit over a longer window is a budget, not a bucket size
+INTERACTIVE_RESERVE = 0.2  # share of each bucket kept for interactive /chat calls; exports wait instead
+# Rough completion size per task, charged up front and corrected from the response's usage
+EXPECTED_OUTPUT_TOKENS = {"chat": 500, "summary": 1500, "flashcards": 1500, "context": 300}
+DEFAULT_OUTPUT_TOKENS = 500
+
+# Groq/OpenAI reset headers look like "7.66s", "2m59.56s" or "120ms"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+
+def _parse_duration(value):
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def estimate_tokens(messages_list, task=None):
+    """Prompt tokens (~4 characters each, as in context.count_tokens) plus the expected completion."""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages_list)
+    return prompt_chars // 4 + 4 * len(messages_list) + EXPECTED_OUTPUT_TOKENS.get(task, DEFAULT_OUTPUT_TOKENS)
+
+
+class RateLimiter:
+    """Request and token buckets shared by every worker process through SQLite.
+
+    Keys are "provider:model". A bucket holds up to `capacity` and refills at `rate` per second;
+    non-interactive calls may not take it below INTERACTIVE_RESERVE of its capacity. After a 429 the
+    key is blocked for everyone until the server's Retry-After has passed.
+    """
+    def __init__(self, path=RATE_LIMIT_DB, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, reserve=INTERACTIVE_RESERVE):
+        self.path = path
+        self.defaults = {"requests": rpm, "tokens": tpm}
+        self.reserve = reserve
+        self._local = threading.local()
+        self._counters = {"granted": 0, "delayed": 0, "blocked": 0, "learned": 0}  # this process only
+        self._counter_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                capacity REAL NOT NULL,
+                rate REAL NOT NULL,
+                level REAL NOT NULL,
+                updated REAL NOT NULL,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )""")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._counter_lock:
+            self._counters[name] += 1
+
+    def _load(self, conn, name, kind, now):
+        """[capacity, rate, level, blocked_until] with the refill since the last update applied."""
+        row = conn.execute("SELECT capacity, rate, level, updated, blocked_until FROM buckets WHERE name = ?",
+                           (name,)).fetchone()
+        if row is None:
+            capacity = self.defaults[kind]
+            conn.execute("INSERT INTO buckets (name, capacity, rate, level, updated) VALUES (?, ?, ?, ?, ?)",
+                         (name, capacity, capacity / 60, capacity, now))
+            return [capacity, capacity / 60, capacity, 0.0]
+        capacity, rate, level, updated, blocked_until = row
+        return [capacity, rate, min(capacity, level + max(0.0, now - updated) * rate), blocked_until]
+
+    def try_acquire(self, key, tokens, interactive=True):
+        """Takes one request and `tokens` tokens for key. Returns 0 if granted, otherwise the seconds
+        to wait before asking again (nothing is taken then)."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            buckets = {kind: self._load(conn, f"{key}:{kind}", kind, now) for kind in ("requests", "tokens")}
+            wait = 0.0
+            costs = {}
+            for kind, cost in (("requests", 1), ("tokens", tokens)):
+                capacity, rate, level, blocked_until = buckets[kind]
+                floor = 0 if interactive else capacity * self.reserve
+                # a prompt bigger than the bucket could otherwise never be sent
+                costs[kind] = cost = min(cost, max(1.0, capacity - floor))
+                shortfall = floor + cost - level
+                wait = max(wait, blocked_until - now, shortfall / rate if shortfall > 0 and rate > 0 else 0.0)
+            for kind, (capacity, rate, level, blocked_until) in buckets.items():
+                if wait <= 0:
+                    level -= costs[kind]
+                conn.execute("UPDATE buckets SET level = ?, updated = ? WHERE name = ?", (level, now, f"{key}:{kind}"))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("granted" if wait <= 0 else "delayed")
+        return max(0.0, wait)
+
+    def settle(self, key, estimated, actual):
+        """Gives back (or charges) the difference between the estimated and the real token count."""
+        if actual is None:
+            return
+        self._conn().execute("UPDATE buckets SET level = MIN(capacity, level + ?) WHERE name = ?",
+                             (estimated - actual, f"{key}:tokens"))
+
+    def learn(self, key, headers):
+        """Adopts the per-minute limits the API reports in its x-ratelimit-{limit,remaining,reset}-{requests,tokens} headers."""
+        now = time.time()
+        conn = self._conn()
+        learned = False
+        for kind in ("requests", "tokens"):
+            try:
+                limit = float(headers[f"x-ratelimit-limit-{kind}"])
+                remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                capacity, rate, level, _ = self._load(conn, f"{key}:{kind}", kind, now)
+                # The reset header says when the used part will have refilled, which tells the limit's window
+                used = limit - remaining
+                if reset and used > 0 and limit * reset / used <= MAX_BURST_WINDOW:
+                    capacity, rate = limit, used / reset
+                # Over a longer window (Groq's request limit is per day) the bucket keeps its per-minute size
+                # and refill; it just never holds more than the day has left
+                conn.execute("UPDATE buckets SET capacity = ?, rate = ?, level = ?, updated = ? WHERE name = ?",
+                             (capacity, rate, min(level, remaining), now, f"{key}:{kind}"))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            learned = True
+        if learned:
+            self._count("learned")
+
+    def block(self, key, seconds):
+        """After a 429: no worker sends anything for key until `seconds` have passed."""
+        self._conn().execute("UPDATE buckets SET blocked_until = MAX(blocked_until, ?) WHERE name IN (?, ?)",
+                             (time.time() + seconds, f"{key}:requests", f"{key}:tokens"))
+        self._count("blocked")
+
+    def stats(self):
+        now = time.time()
+        rows = self._conn().execute("SELECT name, capacity, rate, level, updated FROM buckets").fetchall()
+        with self._counter_lock:
+            stats = dict(self._counters)
+        stats["buckets"] = {
+            name: {"level": round(min(capacity, level + max(0.0, now - updated) * rate), 1),
+                   "capacity": capacity, "per_minute": round(rate * 60, 1)}
+            for name, capacity, rate, level, updated in rows
+        }
+        return stats
@@ -0,0 +1,235 @@
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+import numpy as np
+
+# --- Long-Term Memory (Retrieval) Settings ---
+# Every stored exchange gets a small hashed term vector (no model, no network). A new /chat turn is compared
+# against all of the user's earlier exchanges and the closest few from other conversations go into the prompt.
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL", "1") == "1"
+RETRIEVAL_DIM = int(os.getenv("RETRIEVAL_DIM", "256"))  # float32 buckets per message: 1 KB each
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.3"))  # cosine similarity, 0-1
+RETRIEVAL_MAX_BYTES = int(os.getenv("RETRIEVAL_MAX_BYTES", str(256 * 1024 * 1024)))  # loaded indexes, all users
+RETRIEVAL_BACKFILL_BATCH = 2000  # messages without a stored vector that one lookup will vectorize
+RETRIEVAL_IDF_REFRESH = 0.1  # recompute idf and row norms once the index has grown by this fraction
+SNIPPET_MESSAGE_CHARS = 200
+SNIPPET_RESPONSE_CHARS = 400
+
+_TOKEN = re.compile(r"\w+")
+# Words that would otherwise share a hash bucket with (and drag down the weight of) useful ones
+STOPWORDS = frozenset("""a about an and are as at be been but by can could did do does for from had has have how i
+    if in into is it its just me my no not of on or so than that the their them then there these they this to
+    was we were what when where which who why will with would you your""".split())
+
+
+def _terms(text):
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def vectorize(text, dim=RETRIEVAL_DIM):
+    """Signed feature hashing of the words in text with sublinear term frequency, L2-normalized float32.
+
+    crc32 rather than hash() so every process (and every restart) puts a word in the same bucket.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    counts = Counter(_terms(text))
+    if not counts:
+        return vector
+    hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in counts), dtype=np.uint32, count=len(counts))
+    weights = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)  # collisions cancel out on average
+    np.add.at(vector, hashes % dim, signs * weights)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def exchange_text(message, response):
+    return f"{message}\n{response}"
+
+
+class UserIndex:
+    """One user's message vectors as a float32 matrix that grows in place, with their ids and conversations.
+
+    Documents are weighted by idf at query time. The idf and the weighted row norms are frozen between
+    refreshes (every RETRIEVAL_IDF_REFRESH of growth), so a lookup is a single matrix-vector product.
+    """
+    def __init__(self, dim):
+        self.dim = dim
+        self.vectors = np.zeros((64, dim), dtype=np.float32)
+        self.ids = np.zeros(64, dtype=np.int64)
+        self.conversations = np.zeros(64, dtype=np.int64)
+        self.norms = np.zeros(64, dtype=np.float32)
+        self.df = np.zeros(dim, dtype=np.int64)
+        self.idf = None
+        self.idf_size = 0
+        self.size = 0
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.ids.nbytes + self.conversations.nbytes + self.norms.nbytes
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self.ids))
+        for name in ("vectors", "ids", "conversations", "norms"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _row_norms(self, start, end):
+        # In chunks, so squaring the rows never allocates a copy of the whole matrix
+        weights = self.idf * self.idf
+        for i in range(start, end, 8192):
+            j = min(end, i + 8192)
+            self.norms[i:j] = np.sqrt(np.square(self.vectors[i:j]) @ weights)
+
+    def append(self, ids, conversations, vectors):
+        n = len(ids)
+        if not n:
+            return
+        start = self.size
+        if start + n > len(self.ids):
+            self._grow(start + n)
+        self.vectors[start:start + n] = vectors
+        self.ids[start:start + n] = ids
+        self.conversations[start:start + n] = conversations
+        self.df += np.count_nonzero(vectors, axis=0)
+        self.size += n
+        self.last_id = int(ids[-1])
+        if self.idf is None or self.size > self.idf_size * (1 + RETRIEVAL_IDF_REFRESH):
+            self.idf = (np.log((1 + self.size) / (1 + self.df)) + 1).astype(np.float32)
+            self.idf_size = self.size
+            self._row_norms(0, self.size)
+        else:
+            self._row_norms(start, self.size)
+
+    def search(self, query, k, exclude_conversation=None):
+        """[(message id, score)] of the k rows most similar to query, best first."""
+        if not self.size:
+            return []
+        weighted = query * self.idf
+        query_norm = np.linalg.norm(weighted)
+        if not query_norm:
+            return []
+        scores = self.vectors[:self.size] @ (weighted * self.idf)
+        norms = self.norms[:self.size]
+        np.divide(scores, norms * query_norm, out=scores, where=norms > 0)  # empty messages keep their 0
+        if exclude_conversation is not None:
+            scores[self.conversations[:self.size] == exclude_conversation] = -1
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), float(scores[i])) for i in top]
+
+
+class RetrievalIndex:
+    """Per-user UserIndexes, loaded from the message_vectors table on first use and kept in memory.
+
+    Other workers' inserts are picked up on every lookup (rows with a higher id than the last one loaded,
+    which SQLite commits in id order). Whole users are evicted, least recently used first, to stay under
+    max_bytes.
+    """
+    def __init__(self, dim=RETRIEVAL_DIM, max_bytes=RETRIEVAL_MAX_BYTES):
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._searches = 0
+        self._search_seconds = 0.0
+        self._backfilled = 0
+
+    def add(self, conn, message_id, message, response):
+        """Stores the vector of a new exchange; call inside the transaction that inserts the message."""
+        vector = vectorize(exchange_text(message, response), self.dim)
+        conn.execute("INSERT OR REPLACE INTO message_vectors (message_id, vector) VALUES (?, ?)",
+                     (message_id, vector.tobytes()))
+
+    def _user(self, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                index = self._users[user_id] = UserIndex(self.dim)
+            self._users.move_to_end(user_id)
+            return index
+
+    def _evict(self):
+        with self._lock:
+            total = sum(index.nbytes for index in self._users.values())
+            while total > self.max_bytes and len(self._users) > 1:
+                _, index = self._users.popitem(last=False)
+                total -= index.nbytes
+
+    def _catch_up(self, conn, index, user_id):
+        """Appends the user's messages stored since the last lookup, vectorizing any that have no vector yet."""
+        while True:
+            rows = conn.execute(
+                """
+                SELECT m.id, m.conversation_id, v.vector,
+                       CASE WHEN v.vector IS NULL OR length(v.vector) != ? THEN m.message END AS message,
+                       CASE WHEN v.vector IS NULL OR length(v.vector) != ? THEN m.response END AS response
+                FROM messages m LEFT JOIN message_vectors v ON v.message_id = m.id
+                WHERE m.user_id = ? AND m.id > ?
+                ORDER BY m.id LIMIT ?
+                """, (4 * self.dim, 4 * self.dim, user_id, index.last_id, RETRIEVAL_BACKFILL_BATCH)).fetchall()
+            if not rows:
+                return
+            vectors, missing = [], []
+            for row in rows:
+                if row["message"] is None:
+                    vectors.append(row["vector"])
+                else:
+                    # Stored before this index existed (or with another RETRIEVAL_DIM)
+                    vector = vectorize(exchange_text(row["message"], row["response"]), self.dim).tobytes()
+                    vectors.append(vector)
+                    missing.append((row["id"], vector))
+            if missing:
+                conn.executemany("INSERT OR REPLACE INTO message_vectors (message_id, vector) VALUES (?, ?)", missing)
+                conn.commit()
+                self._backfilled += len(missing)
+            index.append(np.fromiter((r["id"] for r in rows), dtype=np.int64, count=len(rows)),
+                         np.fromiter((r["conversation_id"] for r in rows), dtype=np.int64, count=len(rows)),
+                         np.frombuffer(b"".join(vectors), dtype=np.float32).reshape(len(rows), self.dim))
+            if missing or len(rows) < RETRIEVAL_BACKFILL_BATCH:
+                return  # at most one backfill batch per lookup, so a first /chat never stalls on a big history
+
+    def related(self, conn, user_id, text, exclude_conversation=None, k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """Up to k earlier exchanges of this user that resemble text: [{"message", "response", "score"}]."""
+        start = time.perf_counter()
+        index = self._user(user_id)
+        with index.lock:
+            self._catch_up(conn, index, user_id)
+            hits = index.search(vectorize(text, self.dim), k, exclude_conversation)
+        self._evict()
+        hits = [(message_id, score) for message_id, score in hits if score >= min_score]
+        results = []
+        if hits:
+            rows = conn.execute(f"SELECT id, message, response FROM messages WHERE id IN ({','.join('?' * len(hits))})",
+                                [message_id for message_id, _ in hits]).fetchall()
+            by_id = {row["id"]: row for row in rows}
+            # A message deleted since it was indexed just drops out here
+            results = [{"message": by_id[message_id]["message"], "response": by_id[message_id]["response"],
+                        "score": round(score, 3)} for message_id, score in hits if message_id in by_id]
+        with self._lock:
+            self._searches += 1
+            self._search_seconds += time.perf_counter() - start
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users_loaded": len(self._users),
+                "vectors": sum(index.size for index in self._users.values()),
+                "bytes": sum(index.nbytes for index in self._users.values()),
+                "searches": self._searches,
+                "avg_search_ms": round(1000 * self._search_seconds / self._searches, 2) if self._searches else 0.0,
+                "backfilled": self._backfilled,
+            }
+
+
+retrieval_index = RetrievalIndex()
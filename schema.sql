@@ -1,4 +1,5 @@
 -- schema.sql
+-- Base schema, applied as migration 1 by db.migrate(). Later schema changes live in db.MIGRATIONS.
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT UNIQUE NOT NULL,
@@ -31,4 +32,31 @@ CREATE TABLE IF NOT EXISTS remember_tokens (
     expires_at TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id)
-);
\ No newline at end of file
+);
+
+-- Rolling summary of the older part of a conversation, so /chat only resends recent turns verbatim
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_through_id INTEGER NOT NULL DEFAULT 0, -- id of the last message folded into the summary
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+);
+
+-- Background export jobs (summary / flashcards); persisted so queued work survives a restart
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,                    -- 'summary' or 'flashcards'
+    params TEXT NOT NULL,                  -- JSON input for the job handler
+    status TEXT NOT NULL DEFAULT 'queued', -- queued / running / done / failed
+    progress INTEGER NOT NULL DEFAULT 0,   -- 0-100
+    message TEXT,
+    result TEXT,                           -- JSON, set when done
+    error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
@@ -4,11 +4,33 @@ import requests
 import time
 import re
 import os
+import json
+import tempfile
 from pathlib import Path
+from janitor import FileJanitor
 
 API_URL = "http://localhost:5000"
 session = requests.Session()
 
+# Export jobs run in the background on the backend; the UI polls for their progress
+JOB_POLL_INTERVAL = 1.0  # seconds
+JOB_TIMEOUT = 300  # seconds
+
+# Fetched exports for gr.File: one subdirectory per download (so the file keeps the backend's name).
+# The janitor removes each one DOWNLOAD_TTL after it was written, keeps the directory under
+# DOWNLOAD_DIR_MAX_BYTES (oldest first), and clears out what earlier runs left behind at startup.
+DOWNLOAD_DIR = os.getenv("UI_DOWNLOAD_DIR", os.path.join(tempfile.gettempdir(), "qq_downloads"))
+DOWNLOAD_TTL = 30 * 60  # seconds; Gradio serves the file well before this
+DOWNLOAD_DIR_MAX_BYTES = int(os.getenv("UI_DOWNLOAD_DIR_MAX_BYTES", str(512 * 1024 * 1024)))
+download_janitor = FileJanitor(DOWNLOAD_DIR, DOWNLOAD_TTL, DOWNLOAD_DIR_MAX_BYTES, name="download-janitor")
+download_janitor.start()
+
+def _client_headers(request):
+    """Names the browser's address for the backend's login throttling; otherwise every user is this server."""
+    if request is None or request.client is None:
+        return {}
+    return {"X-Forwarded-For": request.client.host}
+
 # Helper to convert backend history to Gradio's format
 def _format_history_for_chatbot(history_list):
     formatted = []
@@ -31,6 +53,12 @@ def _convert_chatbot_history_to_backend_format(chatbot_history):
             user_msg = None # Reset for the next pair
     return backend_history
 
+# The backend sends history a page at a time, newest page first
+def _history_cursor(data):
+    """Cursor for the next older page (None once everything is loaded) and the matching 'load older' button update."""
+    cursor = data.get("oldest_id") if data.get("has_more") else None
+    return cursor, gr.update(visible=cursor is not None)
+
 
 # def log_in(username, password, remember_me):
 #     try:
@@ -60,10 +88,12 @@ def _convert_chatbot_history_to_backend_format(chatbot_history):
 #         gr.Warning(f"Login error: {e}")
 #         return gr.update(), gr.update(), gr.update(), gr.update()
 
-def log_in(username, password, remember_me):
+def log_in(username, password, remember_me, request: gr.Request = None):
     try:
-        r = session.post(f"{API_URL}/login", json={"username": username, "password": password, "remember_me": remember_me})
-        r.raise_for_status()
+        r = session.post(f"{API_URL}/login", json={"username": username, "password": password, "remember_me": remember_me},
+                         headers=_client_headers(request))
+        if r.status_code not in (429, 503):  # throttled / busy responses still carry a message to show
+            r.raise_for_status()
         result = r.json()
         if result["success"]:
             gr.Info(f"Login successful! Welcome {username}.")
@@ -91,12 +121,13 @@ def log_in(username, password, remember_me):
                 gr.update(value=""),  # clear username
                 gr.update(value=""),  # clear password
                 gr.update(value=False),  # clear checkbox
-                gr.update(visible=False)  # Hide about image
+                gr.update(visible=False),  # Hide about image
+                *_history_cursor(chat_data)  # history_cursor_state, load_older_btn
             )
 
         else:
             gr.Warning(result.get("message", "Login failed. Please check your credentials."))
-            # Return 9 gr.update() to maintain the current state for all outputs
+            # Return 11 gr.update() to maintain the current state for all outputs
             return (
                 gr.update(), # auth_ui (no change)
                 gr.update(), # chat_ui (no change)
@@ -106,11 +137,13 @@ def log_in(username, password, remember_me):
                 gr.update(), # login_user (no change)
                 gr.update(), # login_pass (no change)
                 gr.update(), # remember_chk (no change)
-                gr.update()  # about_img_col (no change)
+                gr.update(), # about_img_col (no change)
+                gr.update(), # history_cursor_state (no change)
+                gr.update()  # load_older_btn (no change)
             )
     except requests.RequestException as e:
         gr.Warning(f"Login error: {e}")
-        # Return 9 gr.update() to maintain the current state for all outputs
+        # Return 11 gr.update() to maintain the current state for all outputs
         return (
             gr.update(), # auth_ui (no change)
             gr.update(), # chat_ui (no change)
@@ -120,7 +153,9 @@ def log_in(username, password, remember_me):
             gr.update(), # login_user (no change)
             gr.update(), # login_pass (no change)
             gr.update(), # remember_chk (no change)
-            gr.update()  # about_img_col (no change)
+            gr.update(), # about_img_col (no change)
+            gr.update(), # history_cursor_state (no change)
+            gr.update()  # load_older_btn (no change)
         )
 
 def log_out():
@@ -128,6 +163,8 @@ def log_out():
     return (
         gr.update(visible=True), gr.update(visible=False),
         [], gr.update(choices=[], value=None), gr.update(visible=True),
+        None, gr.update(visible=False),
+        gr.update(value=""), gr.update(choices=[], value=None, visible=False), gr.update(visible=False), None,  # search
     )
 
 # def sign_up(username, password):
@@ -146,14 +183,16 @@ def log_out():
 #         gr.Warning(f"Signup error: {e}")
 #     return gr.update(value="") # Clear output
 
-def sign_up(username, password):
+def sign_up(username, password, request: gr.Request = None):
     if not username or not password:
         gr.Warning("Username and password cannot be empty.")
         # Ensure 4 outputs are returned to match the expected number of components
         return gr.update(), gr.update(), gr.update(), gr.update()
     try:
-        r = session.post(f"{API_URL}/signup", json={"username": username, "password": password})
-        r.raise_for_status()
+        r = session.post(f"{API_URL}/signup", json={"username": username, "password": password},
+                         headers=_client_headers(request))
+        if r.status_code not in (429, 503):
+            r.raise_for_status()
         result = r.json()
         if result["success"]:
             gr.Info("Signup successful! You can now log in.")
@@ -170,22 +209,37 @@ def sign_up(username, password):
     
 def chat_with_bot(msg, history):
     if not msg:
-        return "", history
+        yield "", history
+        return
+    # 'history' here will be in the 'messages' format (list of dicts)
+    # Show the user's message straight away and fill the reply in as tokens arrive
+    history.append({"role": "user", "content": msg})
+    history.append({"role": "assistant", "content": ""})
+    yield "", history
     try:
-        r = session.post(f"{API_URL}/chat", json={"message": msg})
-        r.raise_for_status()
-        reply = r.json()["response"]
-
-        # Modify this part:
-        # 'history' here will be in the 'messages' format (list of dicts)
-        # So, append new messages in that same format
-        history.append({"role": "user", "content": msg})
-        history.append({"role": "assistant", "content": reply})
-
-        return "", history
-    except requests.RequestException as e:
+        with session.post(f"{API_URL}/chat/stream", json={"message": msg}, stream=True) as r:
+            if r.status_code in (429, 503, 504):  # the AI is busy, down or too slow; the backend says so straight away
+                gr.Warning(r.json().get("response"))
+                del history[-2:]
+                yield msg, history
+                return
+            r.raise_for_status()
+            for line in r.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "delta" in event:
+                    history[-1]["content"] += event["delta"]
+                    yield "", history
+                elif event.get("error"):
+                    gr.Warning(event["error"])
+                    del history[-2:]
+                    yield msg, history
+    except (requests.RequestException, ValueError) as e:
         gr.Warning(f"Chat error: {e}")
-        return msg, history
+        # Drop the half-built turn and give the message back so it can be resent
+        del history[-2:]
+        yield msg, history
     
 # def start_new_conversation():
 #     try:
@@ -214,6 +268,17 @@ def chat_with_bot(msg, history):
 # In UIX.py, replace the existing start_new_conversation and its helper state
 
 # In UIX.py, around line 76
+def refresh_llm_status():
+    """Shows a banner while the backend's circuit breaker says the AI isn't reachable."""
+    try:
+        status = session.get(f"{API_URL}/llm_status", timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return gr.update(visible=False)
+    if status.get("available", True):
+        return gr.update(visible=False)
+    return gr.update(value=f"🚧 The AI service is unavailable right now. Trying again in about "
+                           f"{max(1, round(status.get('retry_in', 0)))} seconds.", visible=True)
+
 def start_new_conversation():
     try:
         r_new = session.post(f"{API_URL}/new_conversation")
@@ -281,13 +346,15 @@ def start_new_conversation():
 
 def load_selected_conversation(conv_id):
     if not conv_id or conv_id == "EMPTY_CONVO":
-        # Don't try to load this from backend if it's the placeholder
+        # Nothing to load for the placeholder, but tell the backend so the next message starts a new chat
+        # (this doesn't create anything until that message is sent)
+        session.post(f"{API_URL}/new_conversation")
         conversations_r = session.get(f"{API_URL}/get_conversations")
         conversations_r.raise_for_status()
         conversations_result = conversations_r.json()
         conv_list_data = conversations_result.get("conversations", [])
         conv_dropdown_choices = [("🗁 New Chat", "EMPTY_CONVO")] + [(c['title'], c['id']) for c in conv_list_data]
-        return [], gr.update(choices=conv_dropdown_choices, value="EMPTY_CONVO")
+        return [], gr.update(choices=conv_dropdown_choices, value="EMPTY_CONVO"), None, gr.update(visible=False)
 
     try:
         r = session.get(f"{API_URL}/load_conversation/{conv_id}")
@@ -313,56 +380,163 @@ def load_selected_conversation(conv_id):
         dropdown_selected_value = conv_id if conv_id in valid_ids else "EMPTY_CONVO"
 
 
-        return formatted_history, gr.update(choices=conv_dropdown_choices, value=dropdown_selected_value)
+        return (formatted_history, gr.update(choices=conv_dropdown_choices, value=dropdown_selected_value),
+                *_history_cursor(data))
 
     except requests.RequestException as e:
         gr.Warning(f"Failed to load conversation: {e}")
-        return [], gr.update(visible=True)
+        return [], gr.update(visible=True), None, gr.update(visible=False)
+
+def load_older_messages(cursor, history):
+    """Prepends the previous page of the open conversation to the Chatbot."""
+    if cursor is None:
+        return history, None, gr.update(visible=False)
+    try:
+        r = session.get(f"{API_URL}/get_current_chat_history", params={"before_id": cursor})
+        r.raise_for_status()
+        data = r.json()
+        older = _format_history_for_chatbot(data.get("history", []))
+        return (older + history, *_history_cursor(data))
+    except requests.RequestException as e:
+        gr.Warning(f"Failed to load older messages: {e}")
+        return history, cursor, gr.update()
+
+# Search results are choices of a Radio: the label shows where the words were found, the value says
+# which conversation to open ("<conversation id>:<message id>", as one chat can match several times)
+def _search_page(query, cursor=None):
+    """One page of /search results as Radio choices, plus the cursor for the next page."""
+    params = {"q": query}
+    if cursor:
+        params["cursor"] = cursor
+    r = session.get(f"{API_URL}/search", params=params, timeout=10)
+    data = r.json()
+    if not data.get("success"):
+        raise ValueError(data.get("message", "Search failed."))
+    choices = []
+    for hit in data.get("results", []):
+        snippet = re.sub(r"\*\*(.+?)\*\*", r"«\1»", hit["snippet"])  # Radio labels are plain text
+        choices.append((f"{hit['title']}: {snippet}", f"{hit['conversation_id']}:{hit['message_id']}"))
+    return choices, data.get("next_cursor")
+
+def search_chats(query):
+    """Runs a new search; the state keeps the query, the choices so far and the next-page cursor."""
+    query = (query or "").strip()
+    if not query:
+        return gr.update(choices=[], value=None, visible=False), gr.update(visible=False), None
+    try:
+        choices, cursor = _search_page(query)
+    except (requests.RequestException, ValueError) as e:
+        gr.Warning(f"Search failed: {e}")
+        return gr.update(), gr.update(), None
+    if not choices:
+        gr.Info("No matching messages found.")
+    return (gr.update(choices=choices, value=None, visible=bool(choices)), gr.update(visible=cursor is not None),
+            {"query": query, "choices": choices, "cursor": cursor})
+
+def more_search_results(state):
+    if not state or not state.get("cursor"):
+        return gr.update(), gr.update(visible=False), state
+    try:
+        choices, cursor = _search_page(state["query"], state["cursor"])
+    except (requests.RequestException, ValueError) as e:
+        gr.Warning(f"Search failed: {e}")
+        return gr.update(), gr.update(), state
+    state = {"query": state["query"], "choices": state["choices"] + choices, "cursor": cursor}
+    return gr.update(choices=state["choices"]), gr.update(visible=cursor is not None), state
+
+def open_search_result(choice):
+    """Selects the hit's conversation in the dropdown, whose change event then loads it."""
+    if not choice:
+        return gr.update()
+    return gr.update(value=int(choice.split(":", 1)[0]))
     
-def generate_summary(chat_history):
+def _poll_job(job_id):
+    """Yields the export job's status from the backend until it finishes (or we stop waiting)."""
+    deadline = time.time() + JOB_TIMEOUT
+    while time.time() < deadline:
+        r = session.get(f"{API_URL}/jobs/{job_id}")
+        r.raise_for_status()
+        job = r.json()
+        yield job
+        if job.get("status") in ("done", "failed"):
+            return
+        time.sleep(JOB_POLL_INTERVAL)
+    yield {"status": "failed", "error": "Timed out waiting for the export to finish."}
+
+def _download_artifact(job):
+    """Fetches a finished export over HTTP into a local file for gr.File (the backend may be on another host)."""
+    r = session.get(f"{API_URL}{job['download_url']}")
+    r.raise_for_status()
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    folder = tempfile.mkdtemp(dir=DOWNLOAD_DIR)
+    path = os.path.join(folder, job["filename"])
+    with open(path, "wb") as f:
+        f.write(r.content)
+    download_janitor.track(folder)
+    return path
+
+def _export_request_body(chat_history, conv_id):
+    """When we know which conversation is open, the backend reads it from its own database;
+    uploading the whole Chatbot history is only the fallback (e.g. a brand-new chat)."""
+    if conv_id not in (None, "", "EMPTY_CONVO"):
+        return {"conversation_id": conv_id}
+    return {"history": _convert_chatbot_history_to_backend_format(chat_history)}
+
+def generate_summary(chat_history, conv_id=None):
     if not chat_history:
         gr.Warning("Chat is empty, nothing to summarize.")
-        return None, "Chat is empty."
+        yield None, "Chat is empty."
+        return
     
-    backend_history = _convert_chatbot_history_to_backend_format(chat_history)
     try:
-        r = session.post(f"{API_URL}/summarize_chat", json={"history": backend_history})
-        r.raise_for_status()
+        r = session.post(f"{API_URL}/summarize_chat", json=_export_request_body(chat_history, conv_id))
         result = r.json()
-        if result["success"]:
-            file_path = result["file_path"]
-            filename = os.path.basename(file_path)
-            download_url = f"{API_URL}/files/{filename}"
-            return gr.File(value=file_path, visible=True), f"Summary ready! [Download PDF]({download_url})"
-        else:
-            return None, f"Error: {result.get('message')}"
-    except requests.RequestException as e:
-        return None, f"Error generating summary: {e}"
+        if not result.get("success"):
+            yield None, f"Error: {result.get('message')}"
+            return
+
+        for job in _poll_job(result["job_id"]):
+            if job["status"] == "done":
+                download_url = f"{API_URL}{job['download_url']}"
+                yield gr.File(value=_download_artifact(job), visible=True), f"Summary ready! [Download PDF]({download_url})"
+            elif job["status"] == "failed":
+                yield None, f"Error: {job.get('error')}"
+            else:
+                yield gr.update(), f"{job.get('message')} ({job.get('progress', 0)}%)"
+    except (requests.RequestException, ValueError) as e:
+        yield None, f"Error generating summary: {e}"
 
-def generate_flashcards(file_format, chat_history):
+def generate_flashcards(file_format, chat_history, conv_id=None):
     if not chat_history:
         gr.Warning("Chat is empty, nothing to generate flashcards from.")
-        return None, "Chat is empty."
+        yield None, "Chat is empty."
+        return
 
-    backend_history = _convert_chatbot_history_to_backend_format(chat_history)
     try:
-        r = session.post(f"{API_URL}/generate_flashcards", json={"history": backend_history, "format": file_format.lower()})
-        r.raise_for_status()
+        body = _export_request_body(chat_history, conv_id)
+        body["format"] = file_format.lower()
+        r = session.post(f"{API_URL}/generate_flashcards", json=body)
         result = r.json()
-        if result["success"]:
-            file_path = result["file_path"]
-            filename = os.path.basename(file_path)
-            download_url = f"{API_URL}/files/{filename}"
-            if "html" in file_format.lower():
-                # For HTML, provide a clickable link to open in a new tab
-                return None, f"Flashcards ready! <a href='{download_url}' target='_blank'>Click here to open them</a>."
+        if not result.get("success"):
+            yield None, f"Error: {result.get('message')}"
+            return
+
+        for job in _poll_job(result["job_id"]):
+            if job["status"] == "done":
+                download_url = f"{API_URL}{job['download_url']}"
+                if "html" in file_format.lower():
+                    # For HTML, provide a clickable link to open in a new tab
+                    yield None, f"Flashcards ready! <a href='{download_url}' target='_blank'>Click here to open them</a>."
+                else:
+                    # For PDF / Markdown / Anki CSV or TSV, provide the file for download
+                    label = job["filename"].rsplit(".", 1)[-1].upper()
+                    yield gr.File(value=_download_artifact(job), visible=True), f"Flashcards ready! [Download {label}]({download_url})"
+            elif job["status"] == "failed":
+                yield None, f"Error: {job.get('error')}"
             else:
-                # For PDF, provide the file for download
-                return gr.File(value=file_path, visible=True), f"Flashcards ready! [Download PDF]({download_url})"
-        else:
-            return None, f"Error: {result.get('message')}"
-    except requests.RequestException as e:
-        return None, f"Error generating flashcards: {e}"
+                yield gr.update(), f"{job.get('message')} ({job.get('progress', 0)}%)"
+    except (requests.RequestException, ValueError) as e:
+        yield None, f"Error generating flashcards: {e}"
 
 
 # def on_load():
@@ -439,13 +613,15 @@ def on_load():
                 selected_value, # Pass to current_conversation_id_state
                 gr.update(choices=conv_choices, value=dropdown_selected_value),
                 gr.update(visible=False),  # Hide about image
+                *_history_cursor(chat_data),  # history_cursor_state, load_older_btn
             )
 
     except requests.ConnectionError:
         gr.Warning("Could not connect to the backend. Please ensure app.py is running.")
     except Exception as e:
         print(f"Error on load: {e}")
-    return gr.update(visible=True), gr.update(visible=False), [], None, gr.update(choices=[], value=None)
+    return (gr.update(visible=True), gr.update(visible=False), [], None, gr.update(choices=[], value=None),
+            gr.update(visible=True), None, gr.update(visible=False))
 
 def show_generating_summary():
     return gr.update(visible=True)
@@ -461,7 +637,7 @@ def hide_generating_flashcards():
 
 custom_css = Path("style.css").read_text()
 with gr.Blocks(theme=None, elem_id="flashcard_block", css=custom_css) as flashcard_ui:
-    flashcard_format = gr.Radio(["PDF", "HTML (Interactive)"], show_label=False, value="PDF")
+    flashcard_format = gr.Radio(["PDF", "HTML (Interactive)", "Markdown", "CSV (Anki)", "TSV (Anki)"], show_label=False, value="PDF")
     flashcard_btn = gr.Button("Generate Flashcards", elem_id="submit_buttons")
     generating_flashcards_msg = gr.Markdown("Generating flashcards, please wait...", visible=False)
     flashcard_file = gr.File(label="Download Flashcards", visible=False, interactive=False)
@@ -492,6 +668,9 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
                     allow_custom_value=False,
                     # placeholder="🗁 New Chat"
                 )
+                search_txt = gr.Textbox(show_label=False, placeholder="🔍 Search your chats...", lines=1)
+                search_results = gr.Radio(show_label=False, visible=False, interactive=True)
+                more_results_btn = gr.Button("More results", visible=False, elem_id="submit_buttons")
 
 
                 new_chat_btn = gr.Button("New Chat", elem_id="submit_buttons")
@@ -517,6 +696,8 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
                     # flashcard_output = gr.Markdown()
 
             with gr.Column(scale=3, elem_id="chatbot-cont"): # Main chat area
+                llm_status_md = gr.Markdown(visible=False)
+                load_older_btn = gr.Button("Load older messages", visible=False, elem_id="submit_buttons")
                 chatbot = gr.Chatbot(
                     type='messages', label="Query Quokka", height=500,
                     avatar_images=(None, "https://github.com/MahekTrivedi44/logo/blob/main/download%20(13).jpg?raw=true")
@@ -563,6 +744,10 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
 
         # A state to hold the current conversation ID, just like in ui.py
     current_conversation_id_state = gr.State(None)
+    # id of the oldest message shown, while older pages are still on the server
+    history_cursor_state = gr.State(None)
+    # query, results so far and next-page cursor of the sidebar search
+    search_state = gr.State(None)
     # Event Handlers
     # login_btn.click(log_in, [login_user, login_pass, remember_chk], [auth_ui, chat_ui, chatbot, conversation_dd])
     
@@ -572,19 +757,21 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
         outputs=[
             auth_ui, chat_ui, chatbot, current_conversation_id_state, conversation_dd,
             login_user, login_pass, remember_chk, about_img_col,  # ✅ Clear inputs
+            history_cursor_state, load_older_btn,
         ]
     )
 
     
-    logout_btn.click(log_out, [], [auth_ui, chat_ui, chatbot, conversation_dd, about_img_col,])
+    logout_btn.click(log_out, [], [auth_ui, chat_ui, chatbot, conversation_dd, about_img_col, history_cursor_state, load_older_btn,
+                                  search_txt, search_results, more_results_btn, search_state])
     # signup_btn.click(sign_up, [signup_user, signup_pass], [status_output])
     signup_btn.click(
         sign_up,
         inputs=[signup_user, signup_pass],
         outputs=[signup_user, signup_pass, auth_tabs, status_output] # Added auth_tabs to outputs
     )
-    msg_txt.submit(chat_with_bot, [msg_txt, chatbot], [msg_txt, chatbot])
-    send_btn.click(chat_with_bot, [msg_txt, chatbot], [msg_txt, chatbot])
+    msg_txt.submit(chat_with_bot, [msg_txt, chatbot], [msg_txt, chatbot]).then(refresh_llm_status, [], [llm_status_md])
+    send_btn.click(chat_with_bot, [msg_txt, chatbot], [msg_txt, chatbot]).then(refresh_llm_status, [], [llm_status_md])
     
     # In UIX.py, find this event handler and modify the .then() block
     
@@ -595,14 +782,18 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
     ).then( # Chained event to reload conversations and set the newly created one
         fn=load_selected_conversation,
         inputs=[current_conversation_id_state], # Pass the ID from the previous step
-        outputs=[chatbot, conversation_dd] # Now load it into the dropdown and chatbot
+        outputs=[chatbot, conversation_dd, history_cursor_state, load_older_btn] # Now load it into the dropdown and chatbot
     )
 
     conversation_dd.change(
         load_selected_conversation,
         [conversation_dd],
-        [chatbot, conversation_dd] # <-- Make sure the dropdown is listed as an output
+        [chatbot, conversation_dd, history_cursor_state, load_older_btn] # <-- Make sure the dropdown is listed as an output
     )
+    load_older_btn.click(load_older_messages, [history_cursor_state, chatbot], [chatbot, history_cursor_state, load_older_btn])
+    search_txt.submit(search_chats, [search_txt], [search_results, more_results_btn, search_state])
+    more_results_btn.click(more_search_results, [search_state], [search_results, more_results_btn, search_state])
+    search_results.change(open_search_result, [search_results], [conversation_dd])
     # summary_btn.click(generate_summary, [chatbot], [summary_file, summary_output], show_progress=True)
     # flashcard_btn.click(generate_flashcards, [flashcard_format, chatbot], [flashcard_file, flashcard_output], show_progress=True)
     summary_btn.click(
@@ -611,7 +802,7 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
         outputs=generating_summary_msg
     ).then(
         fn=generate_summary,
-        inputs=[chatbot],
+        inputs=[chatbot, conversation_dd],
         outputs=[summary_file, summary_output]
     ).then(
         fn=hide_generating_summary,
@@ -626,7 +817,7 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
         outputs=generating_flashcards_msg
     ).then(
         fn=generate_flashcards,
-        inputs=[flashcard_format, chatbot],
+        inputs=[flashcard_format, chatbot, conversation_dd],
         outputs=[flashcard_file, flashcard_output]
     ).then(
         fn=hide_generating_flashcards,
@@ -637,8 +828,10 @@ with gr.Blocks(theme=gr.themes.Soft(), title="Query Quokka Chat", css=custom_css
     demo.load(
         on_load, 
         inputs=[], 
-        outputs=[auth_ui, chat_ui, chatbot, current_conversation_id_state, conversation_dd, about_img_col]
+        outputs=[auth_ui, chat_ui, chatbot, current_conversation_id_state, conversation_dd, about_img_col,
+                 history_cursor_state, load_older_btn]
     )
+    demo.load(refresh_llm_status, [], [llm_status_md])
 
 
 if __name__ == "__main__":